@@ -0,0 +1,118 @@
+"""
+Scanning with several Bluetooth adapters at once.
+
+Each adapter (hci0, hci1, ...) runs its own scan session; MultiAdapterScanner starts
+and stops them together so the scan loop can treat them as one scanner. Every
+advertisement is delivered to the detection callback together with the name of the
+adapter that received it.
+
+Radios whose coverage overlaps receive the same advertising event at nearly the same
+moment. AdvertisementDeduplicator drops those copies: an advertisement whose address
+and payload match one accepted from a different adapter within window_ms is a
+duplicate. Repeats from the same adapter are always accepted, since they are separate
+advertising events. The first adapter to report an event wins.
+"""
+
+import asyncio
+import collections
+import re
+
+from logging_config import get_logger
+
+log = get_logger('scan')
+
+
+def parse_adapters(value):
+    """Parse a comma or space separated adapter list such as 'hci0, hci1' (duplicates removed)."""
+    adapters = []
+    for name in re.split(r'[\s,]+', value.strip()):
+        if name and name not in adapters:
+            adapters.append(name)
+    return adapters
+
+
+def advertisement_fingerprint(device, advertisement_data):
+    """Return a hashable key identifying an advertisement by its address and payload."""
+    return (
+        device.address,
+        tuple(sorted((company, bytes(data)) for company, data in advertisement_data.manufacturer_data.items())),
+        tuple(sorted((service, bytes(data)) for service, data in advertisement_data.service_data.items())),
+    )
+
+
+class AdvertisementDeduplicator:
+    """Drop copies of an advertisement that were heard by more than one adapter."""
+
+    def __init__(self, window_ms=50, max_entries=16384):
+        if window_ms <= 0:
+            raise ValueError(f"window_ms must be positive, got {window_ms}")
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, got {max_entries}")
+        self.window = window_ms / 1000.0
+        self.max_entries = max_entries
+        # fingerprint -> (time accepted, adapter), oldest first
+        self._seen = collections.OrderedDict()
+
+        self.stats = {'accepted': 0, 'duplicates': 0}
+        # adapter -> advertisements accepted from it
+        self.adapter_counts = collections.Counter()
+
+    def accept(self, device, advertisement_data, adapter, now):
+        """Return True if the advertisement is new, False if another adapter already reported it."""
+        seen = self._seen
+        # Forget advertisements older than the window
+        expiry = now - self.window
+        while seen:
+            oldest = next(iter(seen.values()))
+            if oldest[0] > expiry and len(seen) < self.max_entries:
+                break
+            seen.popitem(last=False)
+
+        key = advertisement_fingerprint(device, advertisement_data)
+        previous = seen.get(key)
+        if previous is not None and previous[1] != adapter and now - previous[0] < self.window:
+            self.stats['duplicates'] += 1
+            return False
+
+        seen[key] = (now, adapter)
+        seen.move_to_end(key)
+        self.stats['accepted'] += 1
+        self.adapter_counts[adapter] += 1
+        return True
+
+
+class MultiAdapterScanner:
+    """Run one scanner per adapter and start and stop them as one."""
+
+    def __init__(self, scanners):
+        # adapter -> scanner with async start() and stop()
+        self.scanners = dict(scanners)
+        self.running = {}
+
+    async def start(self):
+        """Start every adapter's scanner concurrently.
+
+        Adapters that fail to start are logged and skipped; the error is raised only if
+        none of them started.
+        """
+        adapters = list(self.scanners)
+        results = await asyncio.gather(*(self.scanners[adapter].start() for adapter in adapters),
+                                       return_exceptions=True)
+        errors = []
+        for adapter, result in zip(adapters, results):
+            if isinstance(result, BaseException):
+                log.warning("Could not start scanning on %s: %s", adapter, result)
+                errors.append(result)
+            else:
+                self.running[adapter] = self.scanners[adapter]
+        if not self.running:
+            raise errors[0]
+        log.info("Scanning on %d adapters: %s", len(self.running), ', '.join(self.running))
+
+    async def stop(self):
+        running, self.running = self.running, {}
+        results = await asyncio.gather(*(scanner.stop() for scanner in running.values()),
+                                       return_exceptions=True)
+        for adapter, result in zip(running, results):
+            if isinstance(result, BaseException):
+                log.error("Error stopping scanner on %s: %s", adapter, result)
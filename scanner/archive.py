@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Local archive of readings in hourly Parquet files, and queries over it.
+
+With [archive] enabled, every processed reading is also written to a local archive,
+so a site can be replayed or analysed without re-consuming the Kafka topic. Readings
+are collected in columns and handed to a writer thread as a row group once
+row_group_size readings are waiting or flush_interval seconds have passed. The writer
+keeps one Parquet file open per UTC hour:
+
+    ~/.ble/archive/date=2026-10-17/hour=14/part-1792245600123.parquet
+
+A file is written as '<name>.tmp' and renamed when its hour ends or the scanner stops,
+so only complete files are ever read. Every row group carries min/max statistics.
+
+query() reads a time range back as a pyarrow Table. Hours outside the range are pruned
+by directory name, row groups by their timestamp statistics, other predicates (beacon,
+type, host, RSSI) are pushed down to the Parquet scan, and only the requested columns
+are read:
+
+    table = query('~/.ble/archive', start=datetime(2026, 10, 1), end=datetime(2026, 10, 15),
+                  beacons=['iBeacon/f7826da6-4fa2-4e98-8024-bc5b71e0893e/1/2'],
+                  columns=['timestamp', 'rssi', 'host_id'])
+
+    python archive.py --start 2026-10-01 --end 2026-10-15 --beacon iBeacon/... --csv out.csv
+
+Beacons are named by their Kafka message key (see routing.py). pyarrow is needed for
+the archive only; the scanner runs without it when the archive is off.
+"""
+
+import argparse
+import datetime
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from decoders import beacon_key
+from logging_config import get_logger
+
+log = get_logger('archive')
+
+HOUR_MS = 3600 * 1000
+
+SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('ms', tz='UTC')),
+    ('host_id', pa.string()),
+    ('type', pa.string()),
+    ('beacon', pa.string()),
+    ('address', pa.string()),
+    ('name', pa.string()),
+    ('adapter', pa.string()),
+    ('rssi', pa.int16()),
+    ('rssi_filtered', pa.float32()),
+    ('distance_m', pa.float32()),
+    ('tx_power', pa.int16()),
+    ('uuid', pa.string()),
+    ('major', pa.int32()),
+    ('minor', pa.int32()),
+    ('namespace', pa.string()),
+    ('instance', pa.string()),
+    ('url', pa.string()),
+    ('eid', pa.string()),
+    ('beacon_id', pa.string()),
+    ('battery_mv', pa.int32()),
+    ('temperature_c', pa.float32()),
+])
+
+# Columns copied from a reading's beacon_data (None where a beacon type does not have them)
+DATA_COLUMNS = tuple(name for name in SCHEMA.names if name not in ('timestamp', 'host_id', 'type', 'beacon'))
+
+# Writer queue length, in row groups; further row groups are dropped while the disk is behind
+MAX_PENDING_ROW_GROUPS = 8
+
+
+def beacon_name(beacon_type, beacon_data):
+    """Return the name a beacon is archived (and keyed in Kafka) under, e.g. 'iBeacon/<uuid>/1/2'."""
+    return '/'.join(str(part) for part in beacon_key(beacon_type, beacon_data))
+
+
+def _partition(hour):
+    """Return the partition directory of an hour (epoch milliseconds // HOUR_MS)."""
+    start = datetime.datetime.fromtimestamp(hour * 3600, datetime.timezone.utc)
+    return os.path.join(f"date={start:%Y-%m-%d}", f"hour={start:%H}")
+
+
+class ReadingArchive:
+    """Write readings to hourly Parquet files from a background thread."""
+
+    def __init__(self, directory, host_id, row_group_size=65536, flush_interval=60.0, compression='zstd',
+                 max_age_hours=0):
+        if row_group_size < 1:
+            raise ValueError(f"row_group_size must be at least 1, got {row_group_size}")
+        self.directory = os.path.expanduser(directory)
+        self.host_id = host_id
+        self.row_group_size = row_group_size
+        self.flush_interval = flush_interval
+        self.compression = None if compression == 'none' else compression
+        self.max_age_hours = max_age_hours
+        os.makedirs(self.directory, exist_ok=True)
+        # Fail now, not on the writer thread, if pyarrow lacks the codec
+        if self.compression is not None and not pa.Codec.is_available(self.compression):
+            raise ValueError(f"Compression '{compression}' is not available")
+
+        self._columns = self._empty_columns()
+        self._last_flush = time.monotonic()
+        self._queue = queue.Queue(MAX_PENDING_ROW_GROUPS)
+
+        # Writer thread state: the open file, its hour and temporary path
+        self._writer = None
+        self._hour = None
+        self._path = None
+
+        self.stats = {'rows': 0, 'row_groups': 0, 'files': 0, 'dropped': 0}
+
+        self._thread = threading.Thread(target=self._run, name="ReadingArchive", daemon=True)
+        self._thread.start()
+        log.info("Archiving readings to %s", self.directory)
+
+    @staticmethod
+    def _empty_columns():
+        return {name: [] for name in SCHEMA.names}
+
+    def add(self, beacon_type, beacon_data, now):
+        """Add a reading taken at `now` (epoch seconds); hands off a row group when enough are waiting."""
+        columns = self._columns
+        columns['timestamp'].append(int(now * 1000))
+        columns['host_id'].append(self.host_id)
+        columns['type'].append(beacon_type)
+        columns['beacon'].append(beacon_name(beacon_type, beacon_data))
+        get = beacon_data.get
+        for name in DATA_COLUMNS:
+            columns[name].append(get(name))
+        if len(columns['timestamp']) >= self.row_group_size:
+            self.flush()
+
+    def pending(self):
+        """Return the number of readings waiting for the next row group."""
+        return len(self._columns['timestamp'])
+
+    def flush_due(self, now):
+        """Hand off the waiting readings if flush_interval has passed (`now` is time.monotonic())."""
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Hand the waiting readings to the writer thread as a row group."""
+        self._last_flush = time.monotonic()
+        if not self._columns['timestamp']:
+            return
+        columns, self._columns = self._columns, self._empty_columns()
+        try:
+            self._queue.put_nowait(columns)
+        except queue.Full:
+            self.stats['dropped'] += len(columns['timestamp'])
+            if self.stats['dropped'] == len(columns['timestamp']):
+                log.warning("Archive writer is behind, dropping readings")
+
+    def close(self):
+        """Write what is waiting, close the open file and stop the writer thread."""
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        log.info("Archive closed", extra=self.stats)
+
+    def _run(self):
+        while True:
+            columns = self._queue.get()
+            if columns is None:
+                break
+            try:
+                self._write(columns)
+            except Exception:
+                log.exception("Error writing readings to the archive")
+                self.stats['dropped'] += len(columns['timestamp'])
+        self._close_file()
+
+    def _write(self, columns):
+        """Write a row group, splitting it where it crosses into a new hour."""
+        table = pa.Table.from_pydict(columns, schema=SCHEMA)
+        hours = np.asarray(columns['timestamp'], dtype=np.int64) // HOUR_MS
+        for hour in np.unique(hours).tolist():
+            part = table if hours[0] == hours[-1] == hour else table.filter(pa.array(hours == hour))
+            if hour != self._hour:
+                self._open_file(hour)
+            self._writer.write_table(part, row_group_size=len(part))
+            self.stats['rows'] += len(part)
+            self.stats['row_groups'] += 1
+
+    def _open_file(self, hour):
+        self._close_file()
+        directory = os.path.join(self.directory, _partition(hour))
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, f"part-{int(time.time() * 1000)}.parquet.tmp")
+        self._writer = pq.ParquetWriter(self._path, SCHEMA, compression=self.compression,
+                                        write_statistics=True)
+        self._hour = hour
+        self.stats['files'] += 1
+        if self.max_age_hours > 0:
+            self._expire(hour - self.max_age_hours)
+
+    def _close_file(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self._path, self._path[:-len('.tmp')])
+        self._writer = self._hour = self._path = None
+
+    def _expire(self, oldest_hour):
+        """Delete the files of hours before oldest_hour."""
+        for hour, path in archive_files(self.directory):
+            if hour < oldest_hour:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    log.warning("Could not delete expired archive file %s: %s", path, e)
+                    continue
+                # Remove the hour and date directories once they are empty
+                hour_directory = os.path.dirname(path)
+                for directory in (hour_directory, os.path.dirname(hour_directory)):
+                    try:
+                        os.rmdir(directory)
+                    except OSError:
+                        break
+
+
+def _hour_of(partition_date, partition_hour):
+    try:
+        day = datetime.datetime.strptime(partition_date, 'date=%Y-%m-%d')
+        hour = int(partition_hour[len('hour='):])
+    except ValueError:
+        return None
+    return int(day.replace(tzinfo=datetime.timezone.utc).timestamp()) // 3600 + hour
+
+
+def archive_files(directory, start_ms=None, end_ms=None):
+    """Return (hour, path) of the complete archive files for hours overlapping [start_ms, end_ms), oldest first."""
+    directory = os.path.expanduser(directory)
+    files = []
+    try:
+        dates = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return files
+    for date in dates:
+        if not date.startswith('date='):
+            continue
+        for hour_name in sorted(os.listdir(os.path.join(directory, date))):
+            hour = _hour_of(date, hour_name)
+            if hour is None:
+                continue
+            if start_ms is not None and (hour + 1) * HOUR_MS <= start_ms:
+                continue
+            if end_ms is not None and hour * HOUR_MS >= end_ms:
+                continue
+            path = os.path.join(directory, date, hour_name)
+            files.extend((hour, os.path.join(path, name)) for name in sorted(os.listdir(path))
+                         if name.endswith('.parquet'))
+    return files
+
+
+def _epoch_ms(value):
+    """Convert a datetime (naive means local time), ISO string or epoch seconds to epoch milliseconds."""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        value = value.timestamp()
+    return int(value * 1000)
+
+
+def query(directory, start=None, end=None, beacons=None, types=None, hosts=None, min_rssi=None, columns=None):
+    """Return the archived readings in [start, end) that match the filters, as a pyarrow Table.
+
+    start and end are datetimes, ISO strings or epoch seconds. beacons, types and hosts
+    are lists of accepted values; columns limits the columns read (all by default).
+    """
+    start_ms = _epoch_ms(start) if start is not None else None
+    end_ms = _epoch_ms(end) if end is not None else None
+    paths = [path for _, path in archive_files(directory, start_ms, end_ms)]
+    if not paths:
+        return SCHEMA.empty_table().select(columns) if columns else SCHEMA.empty_table()
+
+    conditions = []
+    if start_ms is not None:
+        conditions.append(ds.field('timestamp') >= pa.scalar(start_ms, SCHEMA.field('timestamp').type))
+    if end_ms is not None:
+        conditions.append(ds.field('timestamp') < pa.scalar(end_ms, SCHEMA.field('timestamp').type))
+    if beacons:
+        conditions.append(ds.field('beacon').isin(list(beacons)))
+    if types:
+        conditions.append(ds.field('type').isin(list(types)))
+    if hosts:
+        conditions.append(ds.field('host_id').isin(list(hosts)))
+    if min_rssi is not None:
+        conditions.append(ds.field('rssi') >= min_rssi)
+    condition = None
+    for part in conditions:
+        condition = part if condition is None else condition & part
+
+    dataset = ds.dataset(paths, schema=SCHEMA, format='parquet')
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the local archive of beacon readings.")
+    parser.add_argument('--dir', default='~/.ble/archive', help="archive directory")
+    parser.add_argument('--start', help="start time (ISO 8601, local time unless it has an offset)")
+    parser.add_argument('--end', help="end time (exclusive)")
+    parser.add_argument('--beacon', action='append', help="beacon name such as iBeacon/<uuid>/<major>/<minor>")
+    parser.add_argument('--type', action='append', help="beacon type")
+    parser.add_argument('--host', action='append', help="scanner host ID")
+    parser.add_argument('--min-rssi', type=int)
+    parser.add_argument('--columns', help="comma separated columns to read")
+    parser.add_argument('--csv', help="write the result to a CSV file")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    table = query(args.dir, args.start, args.end, args.beacon, args.type, args.host, args.min_rssi,
+                  args.columns.split(',') if args.columns else None)
+    elapsed = time.perf_counter() - started
+    if args.csv:
+        import pyarrow.csv
+        pyarrow.csv.write_csv(table, args.csv)
+    print(f"{table.num_rows} readings in {elapsed:.3f}s")
+    if table.num_rows and 'rssi' in table.column_names:
+        print(f"rssi: min {pc.min(table['rssi']).as_py()}, mean {pc.mean(table['rssi']).as_py():.1f}, "
+              f"max {pc.max(table['rssi']).as_py()}")
+    if not args.csv:
+        print(table.slice(0, 10))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Micro-batching of decoded readings for vectorized processing stages.
+
+Readings are collected as they are decoded and handed to the processing stages as
+one batch, either when max_batch readings are waiting or when the scan loop calls
+flush() on its next tick. A stage sees the whole batch at once, with the RSSI values
+in a NumPy array, so per-reading work such as smoothing is done as a few array
+operations instead of one Python call per reading.
+
+A stage is any object with a process(batch) method. Stages may add fields to the
+readings' beacon_data dicts; the batch is then emitted reading by reading in the
+order the readings arrived.
+"""
+
+import numpy as np
+
+from decoders import beacon_key
+
+
+class ReadingBatch:
+    """A batch of readings, as parallel lists plus NumPy arrays of the numeric fields."""
+
+    __slots__ = ('types', 'data', 'keys', 'times', 'rssi', 'rssi_filtered')
+
+    def __init__(self, types, data, times):
+        self.types = types
+        self.data = data
+        self.keys = [beacon_key(beacon_type, beacon_data) for beacon_type, beacon_data in zip(types, data)]
+        self.times = np.array(times, dtype=np.float64)
+        self.rssi = np.fromiter((beacon_data.get('rssi', 0) for beacon_data in data),
+                                dtype=np.float64, count=len(data))
+        # Set by the smoothing stage for the stages after it
+        self.rssi_filtered = None
+
+    def __len__(self):
+        return len(self.types)
+
+
+class ReadingBatcher:
+    """Collect readings and run them through the batch stages before emitting them."""
+
+    def __init__(self, emit, stages, max_batch=1024):
+        # emit(beacon_type, beacon_data, now) is called for every reading after the stages ran
+        self.emit = emit
+        self.stages = list(stages)
+        self.max_batch = max_batch
+
+        self._types = []
+        self._data = []
+        self._times = []
+
+        self.stats = {'readings': 0, 'batches': 0}
+
+    def add(self, beacon_type, beacon_data, now):
+        """Add a reading taken at `now` (epoch seconds); flushes when the batch is full."""
+        self._types.append(beacon_type)
+        self._data.append(beacon_data)
+        self._times.append(now)
+        if len(self._types) >= self.max_batch:
+            self.flush()
+
+    def pending(self):
+        """Return the number of readings waiting for the next flush."""
+        return len(self._types)
+
+    def flush(self):
+        """Process and emit the waiting readings. Returns the number emitted."""
+        if not self._types:
+            return 0
+        batch = ReadingBatch(self._types, self._data, self._times)
+        self._types = []
+        self._data = []
+        self._times = []
+
+        for stage in self.stages:
+            stage.process(batch)
+
+        emit = self.emit
+        for beacon_type, beacon_data, now in zip(batch.types, batch.data, batch.times.tolist()):
+            emit(beacon_type, beacon_data, now)
+
+        self.stats['readings'] += len(batch)
+        self.stats['batches'] += 1
+        return len(batch)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the scanner's per-advertisement processing.
+
+Runs a corpus of advertisements through each stage of the pipeline without a radio
+or a broker and reports throughput (advertisements or messages per second) and
+per-item latency percentiles:
+
+    decode      decoders.decode_advertisement()
+    serialize   JSON and binary wire format encoding of the decoded readings
+    smooth      RssiSmoother EMA and Kalman filters over batches of decoded readings
+    distance    DistanceEstimator over batches of decoded readings
+    publish     KafkaPublisher queueing and delivery to an in-memory producer
+    pipeline    ReplayScanner at max speed through the scan module's beacon processor
+
+The corpus is either a recorded capture (--capture) or a deterministic synthetic
+mix of iBeacon, Eddystone, AltBeacon and non-beacon traffic, so results are
+comparable between runs and machines.
+
+    python benchmark.py --count 50000
+    python benchmark.py --capture site.jsonl.gz --json
+    python benchmark.py --generate corpus.jsonl --count 100000
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import sys
+import time
+
+from batching import ReadingBatch
+from capture import CapturedAdvertisement, ReplayAdvertisement, ReplayDevice, ReplayScanner, load_capture, write_capture
+from decoders import decode_advertisement
+from distance import DistanceEstimator
+from publisher import KafkaPublisher
+from smoothing import METHODS, RssiSmoother
+from wire_format import encode_record, serialize_json
+
+STAGES = ('decode', 'serialize', 'smooth', 'distance', 'publish', 'pipeline')
+
+# Seconds to wait for the publisher to deliver every message before giving up
+DELIVERY_TIMEOUT = 60.0
+
+EDDYSTONE_SERVICE = '0000feaa-0000-1000-8000-00805f9b34fb'
+
+
+def generate_corpus(count, beacons=200, rate=2000.0, seed=1):
+    """Generate a deterministic synthetic corpus of advertisements."""
+    rng = random.Random(seed)
+    uuids = [bytes(rng.getrandbits(8) for _ in range(16)) for _ in range(4)]
+    devices = []
+    for i in range(beacons):
+        address = ':'.join(f"{rng.getrandbits(8):02X}" for _ in range(6))
+        kind = rng.choices(('ibeacon', 'eddystone', 'altbeacon', 'noise'), (40, 10, 10, 40))[0]
+        if kind == 'ibeacon':
+            mfg = {0x004C: b'\x02\x15' + rng.choice(uuids) + i.to_bytes(2, 'big') + (i * 7 % 65536).to_bytes(2, 'big') + b'\xc5'}
+            svc = {}
+        elif kind == 'eddystone':
+            mfg = {}
+            svc = {EDDYSTONE_SERVICE: b'\x00\xee' + bytes(rng.getrandbits(8) for _ in range(16)) + b'\x00\x00'}
+        elif kind == 'altbeacon':
+            mfg = {0x0118: b'\xbe\xac' + bytes(rng.getrandbits(8) for _ in range(20)) + b'\xc5\x00'}
+            svc = {}
+        else:
+            company = rng.choice((0x004C, 0x0006, 0x0075, 0x00E0))
+            mfg = {company: bytes(rng.getrandbits(8) for _ in range(rng.randint(4, 27)))}
+            svc = {}
+        devices.append((address, mfg, svc))
+
+    corpus = []
+    timestamp = 1_700_000_000.0
+    for _ in range(count):
+        address, mfg, svc = rng.choice(devices)
+        timestamp += rng.expovariate(rate)
+        corpus.append(CapturedAdvertisement(
+            timestamp,
+            ReplayDevice(address, None),
+            ReplayAdvertisement(None, mfg, svc, rng.randint(-95, -40)),
+        ))
+    return corpus
+
+
+def _percentiles(samples_ns):
+    samples_ns.sort()
+    n = len(samples_ns)
+    if not n:
+        return {}
+    return {
+        'p50_us': round(samples_ns[n // 2] / 1000, 3),
+        'p99_us': round(samples_ns[min(n - 1, n * 99 // 100)] / 1000, 3),
+        'max_us': round(samples_ns[-1] / 1000, 3),
+    }
+
+
+def _measure(func, items):
+    """Time func over all items, once in bulk for throughput and once per item for latency."""
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    elapsed = time.perf_counter() - start
+
+    clock = time.perf_counter_ns
+    samples = []
+    for item in items:
+        t0 = clock()
+        func(item)
+        samples.append(clock() - t0)
+
+    result = {'items': len(items), 'seconds': round(elapsed, 4), 'per_second': round(len(items) / elapsed)}
+    result.update(_percentiles(samples))
+    return result
+
+
+def _messages(corpus):
+    """Build the Kafka messages the scanner would publish for a corpus."""
+    timestamp = datetime.datetime.now().isoformat()
+    messages = []
+    for advertisement in corpus:
+        data = advertisement.advertisement_data
+        for record in decode_advertisement(data.manufacturer_data, data.service_data):
+            message = record._asdict()
+            message.update({
+                'type': record.beacon_type,
+                'host_id': 'benchmark-host',
+                'timestamp': timestamp,
+                'rssi': data.rssi,
+                'address': advertisement.device.address,
+                'name': 'Unknown',
+            })
+            messages.append(message)
+    return messages
+
+
+def bench_decode(corpus):
+    payloads = [(a.advertisement_data.manufacturer_data, a.advertisement_data.service_data) for a in corpus]
+    return _measure(lambda p: decode_advertisement(p[0], p[1]), payloads)
+
+
+def bench_serialize(corpus):
+    messages = _messages(corpus)
+    if not messages:
+        return {}
+    json_result = _measure(serialize_json, messages)
+    binary_result = _measure(encode_record, messages)
+    json_result['bytes_per_message'] = round(sum(len(serialize_json(m)) for m in messages) / len(messages), 1)
+    binary_result['bytes_per_message'] = round(sum(len(encode_record(m)) for m in messages) / len(messages), 1)
+    return {'json': json_result, 'binary': binary_result}
+
+
+def _batches(messages, batch_size):
+    """Split messages into ReadingBatches as the scanner's batcher would."""
+    times = [1_700_000_000.0 + i / 2000 for i in range(len(messages))]
+    return [ReadingBatch([m['type'] for m in messages[i:i + batch_size]],
+                         messages[i:i + batch_size], times[i:i + batch_size])
+            for i in range(0, len(messages), batch_size)]
+
+
+def _measure_stage(stage, batches):
+    """Time a batch stage over a list of batches."""
+    items = sum(len(batch) for batch in batches)
+    start = time.perf_counter()
+    for batch in batches:
+        stage.process(batch)
+    elapsed = time.perf_counter() - start
+    return {
+        'items': items,
+        'batch_size': len(batches[0]),
+        'seconds': round(elapsed, 4),
+        'per_second': round(items / elapsed),
+        'per_batch_us': round(elapsed / len(batches) * 1e6, 1),
+    }
+
+
+def bench_smooth(corpus, batch_size=1024):
+    messages = _messages(corpus)
+    if not messages:
+        return {}
+    return {method: _measure_stage(RssiSmoother(method=method), _batches(messages, batch_size))
+            for method in METHODS}
+
+
+def bench_distance(corpus, batch_size=1024):
+    messages = _messages(corpus)
+    if not messages:
+        return {}
+    return _measure_stage(DistanceEstimator(), _batches(messages, batch_size))
+
+
+class _CompletedFuture:
+    """Stands in for a kafka-python future that has already been acknowledged."""
+
+    def add_callback(self, callback, *args):
+        callback(*args, None)
+        return self
+
+    def add_errback(self, errback, *args):
+        return self
+
+    def succeeded(self):
+        return True
+
+
+class NullProducer:
+    """In-memory producer that serializes like KafkaProducer and acknowledges immediately."""
+
+    def __init__(self, serializer=serialize_json):
+        self.serializer = serializer
+        self.bytes_sent = 0
+        self._future = _CompletedFuture()
+
+    def send(self, topic, value, key=None):
+        self.bytes_sent += len(self.serializer(value))
+        return self._future
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+def bench_publish(corpus):
+    messages = _messages(corpus)
+    if not messages:
+        return {}
+    publisher = KafkaPublisher(NullProducer(), 'benchmark', max_queue_size=len(messages) + 1,
+                               batch_size=500, linger_ms=5)
+    publisher.start()
+
+    clock = time.perf_counter_ns
+    samples = []
+    start = time.perf_counter()
+    for message in messages:
+        t0 = clock()
+        publisher.publish(message)
+        samples.append(clock() - t0)
+    enqueued = time.perf_counter() - start
+    deadline = start + DELIVERY_TIMEOUT
+    while publisher.stats['delivered'] < len(messages):
+        if time.perf_counter() > deadline:
+            publisher.close()
+            raise RuntimeError(f"Publisher delivered {publisher.stats['delivered']} of {len(messages)} messages "
+                               f"in {DELIVERY_TIMEOUT:.0f}s: {publisher.stats}")
+        time.sleep(0.001)
+    delivered = time.perf_counter() - start
+    publisher.close()
+
+    result = {
+        'items': len(messages),
+        'enqueue_per_second': round(len(messages) / enqueued),
+        'delivered_per_second': round(len(messages) / delivered),
+    }
+    result.update(_percentiles(samples))
+    return result
+
+
+def bench_pipeline(corpus):
+    import scan
+
+    publisher = KafkaPublisher(NullProducer(), 'benchmark', max_queue_size=len(corpus) + 1)
+    publisher.start()
+    process_beacon = scan.create_beacon_processor(scan.create_reading_sink('benchmark-host', publisher))
+
+    clock = time.perf_counter_ns
+    samples = []
+
+    def detection_callback(device, advertisement_data):
+        t0 = clock()
+        scan.process_advertisement(device, advertisement_data, process_beacon)
+        samples.append(clock() - t0)
+
+    async def run():
+        scanner = ReplayScanner(detection_callback, speed=0, advertisements=corpus)
+        await scanner.start()
+        await scanner.done.wait()
+        await scanner.stop()
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    publisher.close()
+
+    result = {'items': len(corpus), 'seconds': round(elapsed, 4), 'per_second': round(len(corpus) / elapsed)}
+    result.update(_percentiles(samples))
+    return result
+
+
+BENCHMARKS = {
+    'decode': bench_decode,
+    'serialize': bench_serialize,
+    'smooth': bench_smooth,
+    'distance': bench_distance,
+    'publish': bench_publish,
+    'pipeline': bench_pipeline,
+}
+
+
+def run_benchmarks(corpus, stages=STAGES):
+    """Run the selected benchmark stages and return their results keyed by stage."""
+    return {stage: BENCHMARKS[stage](corpus) for stage in stages}
+
+
+def print_results(results):
+    for stage, result in results.items():
+        print(f"{stage}:")
+        nested = all(isinstance(v, dict) for v in result.values()) and result
+        for name, values in (result.items() if nested else [('', result)]):
+            prefix = f"  {name}: " if name else "  "
+            print(prefix + ", ".join(f"{k}={v}" for k, v in values.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the BLE scanner processing pipeline.")
+    parser.add_argument('--capture', help="capture file to use as the corpus")
+    parser.add_argument('--count', type=int, default=50000, help="synthetic corpus size (default 50000)")
+    parser.add_argument('--generate', metavar='FILE', help="write the synthetic corpus to FILE and exit")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"comma-separated stages to run (default {','.join(STAGES)})")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    corpus = load_capture(args.capture) if args.capture else generate_corpus(args.count)
+    if args.generate:
+        write_capture(args.generate, corpus)
+        print(f"Wrote {len(corpus)} advertisements to {args.generate}")
+        return 0
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    results = run_benchmarks(corpus, stages)
+    results['corpus'] = {'advertisements': len(corpus), 'source': args.capture or 'synthetic'}
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
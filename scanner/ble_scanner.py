@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Headless BLE scanner daemon.
+
+Runs the scan, decode and publish pipeline of scan.py without the GUI (wx is never
+imported), for edge boxes and service managers:
+
+    python ble_scanner.py [--config FILE] [--measure-startup]
+
+SIGTERM and SIGINT stop the scan gracefully: the scanner is stopped, batched and
+coalesced readings are flushed and the publisher delivers (or spools) what it still
+holds before the process exits. A second signal cancels the scan immediately.
+
+Startup is kept short by importing bleak, kafka and NumPy only for the stages that
+use them, caching the host ID on disk and connecting to Kafka from the publisher's
+thread. The time from process start to the first reading is logged; with
+--measure-startup the daemon stops after the first reading and prints the startup
+milestones (milliseconds since start) as JSON.
+"""
+
+import time
+
+# Before any other import, so that the startup milestones include import time
+STARTED = time.monotonic()
+
+import argparse
+import asyncio
+import json
+import signal
+import sys
+
+import scan
+
+log = scan.log
+
+
+async def run(startup, measure_startup=False):
+    """Scan until a shutdown signal (or, with measure_startup, the first reading)."""
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(scan.scan_ble_devices(startup))
+    signals = []
+
+    def shutdown(signum):
+        if signals:
+            log.warning("Received %s again, cancelling scan", signal.Signals(signum).name)
+            task.cancel()
+            return
+        log.info("Received %s, shutting down", signal.Signals(signum).name)
+        signals.append(signum)
+        scan.stop_scanning()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, shutdown, signum)
+        except (NotImplementedError, RuntimeError):
+            # No loop signal handlers on Windows
+            signal.signal(signum, lambda received, frame: loop.call_soon_threadsafe(shutdown, received))
+
+    if measure_startup:
+        while not task.done():
+            if 'first_reading' in startup.milestones:
+                scan.stop_scanning()
+            await asyncio.wait([task], timeout=0.005)
+    try:
+        await task
+    except asyncio.CancelledError:
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='ble-scanner', description="Scan for BLE beacons and publish them to Kafka.")
+    parser.add_argument('--config', default=scan.CONFIG_FILE, help="configuration file")
+    parser.add_argument('--measure-startup', action='store_true',
+                        help="stop after the first reading and print the startup timings as JSON")
+    args = parser.parse_args(argv)
+
+    startup = scan.StartupTimer(STARTED)
+    startup.mark('imports')
+    scan.reload_config(args.config)
+    status = asyncio.run(run(startup, args.measure_startup))
+    if args.measure_startup:
+        print(json.dumps(startup.milestones))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Recording and replay of raw BLE advertisements.
+
+A capture is a JSON Lines file (optionally gzip-compressed when the name ends in
+.gz), one advertisement per line:
+
+    {"ts": 1700000000.123, "address": "AA:BB:CC:DD:EE:FF", "name": null, "rssi": -67,
+     "mfg": {"76": "0215..."}, "svc": {"0000feaa-0000-1000-8000-00805f9b34fb": "00e8..."}}
+
+Manufacturer and service data are hex encoded and keyed by company ID and service
+UUID. ReplayScanner feeds a capture back through the same detection callback as
+BleakScanner, in real time, N times faster, or as fast as possible.
+"""
+
+import asyncio
+import gzip
+import json
+import time
+from typing import NamedTuple, Optional
+
+from logging_config import get_logger
+
+log = get_logger('scan')
+
+
+class ReplayDevice(NamedTuple):
+    """The subset of bleak's BLEDevice used by the scan pipeline."""
+    address: str
+    name: Optional[str]
+
+
+class ReplayAdvertisement(NamedTuple):
+    """The subset of bleak's AdvertisementData used by the scan pipeline."""
+    local_name: Optional[str]
+    manufacturer_data: dict
+    service_data: dict
+    rssi: int
+
+
+class CapturedAdvertisement(NamedTuple):
+    """One recorded advertisement."""
+    timestamp: float
+    device: ReplayDevice
+    advertisement_data: ReplayAdvertisement
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class CaptureWriter:
+    """Append advertisements to a capture file."""
+
+    def __init__(self, path, mode='a'):
+        self.path = path
+        self._file = _open(path, mode)
+        self.count = 0
+
+    def write(self, timestamp, device, advertisement_data):
+        """Record one advertisement as delivered to a detection callback."""
+        entry = {
+            'ts': round(timestamp, 6),
+            'address': device.address,
+            'name': device.name,
+            'rssi': advertisement_data.rssi,
+            'mfg': {str(company): bytes(data).hex()
+                    for company, data in advertisement_data.manufacturer_data.items()},
+            'svc': {service_uuid: bytes(data).hex()
+                    for service_uuid, data in advertisement_data.service_data.items()},
+        }
+        self._file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+        log.info("Recorded %d advertisements to %s", self.count, self.path)
+
+
+def parse_entry(entry):
+    """Convert a decoded capture line into a CapturedAdvertisement."""
+    return CapturedAdvertisement(
+        entry['ts'],
+        ReplayDevice(entry['address'], entry.get('name')),
+        ReplayAdvertisement(
+            entry.get('name'),
+            {int(company): bytes.fromhex(data) for company, data in entry.get('mfg', {}).items()},
+            {service_uuid: bytes.fromhex(data) for service_uuid, data in entry.get('svc', {}).items()},
+            entry['rssi'],
+        ),
+    )
+
+
+def load_capture(path):
+    """Load a capture file into a list of CapturedAdvertisement, in recording order."""
+    advertisements = []
+    with _open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                advertisements.append(parse_entry(json.loads(line)))
+            except (ValueError, KeyError) as e:
+                log.warning("Skipping bad capture line %d in %s: %s", line_number, path, e)
+    return advertisements
+
+
+def write_capture(path, advertisements):
+    """Write a list of CapturedAdvertisement to a new capture file."""
+    writer = CaptureWriter(path, mode='w')
+    for advertisement in advertisements:
+        writer.write(advertisement.timestamp, advertisement.device, advertisement.advertisement_data)
+    writer.close()
+
+
+class ReplayScanner:
+    """Scanner backend that replays a capture into a detection callback.
+
+    speed is a multiple of real time (1.0 replays at the recorded pace); 0 replays as
+    fast as possible. With loop set, the capture is replayed until stop() is called.
+    """
+
+    def __init__(self, detection_callback, path=None, speed=1.0, loop=False, advertisements=None):
+        self.detection_callback = detection_callback
+        self.speed = speed
+        self.loop = loop
+        self.advertisements = advertisements if advertisements is not None else load_capture(path)
+        self.delivered = 0
+        self._task = None
+        self.done = asyncio.Event()
+
+    async def start(self):
+        """Start replaying in the background, like BleakScanner.start()."""
+        log.info("Replaying %d advertisements at %s", len(self.advertisements),
+                 f"{self.speed}x" if self.speed > 0 else "max speed")
+        self.done.clear()
+        self._task = asyncio.get_running_loop().create_task(self._replay())
+
+    async def stop(self):
+        """Stop replaying."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _replay(self):
+        callback = self.detection_callback
+        try:
+            while True:
+                if self.speed > 0:
+                    await self._replay_timed(callback)
+                else:
+                    # Yield to the event loop periodically so stop requests are seen
+                    for i, advertisement in enumerate(self.advertisements):
+                        callback(advertisement.device, advertisement.advertisement_data)
+                        if i % 1000 == 999:
+                            await asyncio.sleep(0)
+                    self.delivered += len(self.advertisements)
+                if not self.loop:
+                    break
+        finally:
+            self.done.set()
+
+    async def _replay_timed(self, callback):
+        if not self.advertisements:
+            return
+        first = self.advertisements[0].timestamp
+        start = time.monotonic()
+        for advertisement in self.advertisements:
+            delay = (advertisement.timestamp - first) / self.speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            callback(advertisement.device, advertisement.advertisement_data)
+            self.delivered += 1
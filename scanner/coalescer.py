@@ -0,0 +1,144 @@
+"""
+Per-beacon coalescing of readings into windowed RSSI statistics.
+
+A beacon advertising at 10 Hz would otherwise produce 10 nearly identical Kafka
+records per second. The coalescer collects readings per beacon identity for a fixed
+window and emits a single record with the count, min/max/mean/median RSSI and the
+first/last time the beacon was seen in that window.
+
+All per-beacon state lives in arrays preallocated for max_beacons slots, so adding a
+reading is a dict lookup and a few array stores regardless of how many beacons are
+being tracked.
+"""
+
+import collections
+import datetime
+from array import array
+
+from decoders import beacon_key
+
+
+class BeaconCoalescer:
+    """Aggregate readings per beacon over a fixed window and emit one record per window."""
+
+    def __init__(self, emit, window_ms=1000, max_beacons=4096, max_samples=64):
+        if window_ms <= 0:
+            raise ValueError(f"window_ms must be positive, got {window_ms}")
+        if max_beacons < 1:
+            raise ValueError(f"max_beacons must be at least 1, got {max_beacons}")
+        if max_samples < 1:
+            raise ValueError(f"max_samples must be at least 1, got {max_samples}")
+        # emit(beacon_type, beacon_data, timestamp) is called once per closed window
+        self.emit = emit
+        self.window = window_ms / 1000.0
+        self.max_beacons = max_beacons
+        self.max_samples = max_samples
+
+        # Preallocated per-slot state
+        self._samples = array('b', bytes(max_beacons * max_samples))
+        self._count = array('l', [0]) * max_beacons
+        self._sum = array('l', [0]) * max_beacons
+        self._min = array('b', bytes(max_beacons))
+        self._max = array('b', bytes(max_beacons))
+        self._first_seen = array('d', [0.0]) * max_beacons
+        self._last_seen = array('d', [0.0]) * max_beacons
+        self._types = [None] * max_beacons
+        self._data = [None] * max_beacons
+        self._keys = [None] * max_beacons
+
+        self._slots = {}
+        self._free = list(range(max_beacons - 1, -1, -1))
+        # (deadline, slot) for every open window, in the order the windows were opened
+        self._open = collections.deque()
+
+        self.stats = {'readings': 0, 'emitted': 0, 'evicted': 0}
+
+    def add(self, beacon_type, beacon_data, now):
+        """Add a reading taken at `now` (epoch seconds) to its beacon's window."""
+        key = beacon_key(beacon_type, beacon_data)
+        rssi = beacon_data.get('rssi', 0)
+        rssi = -128 if rssi < -128 else 127 if rssi > 127 else rssi
+
+        slot = self._slots.get(key)
+        if slot is None:
+            if not self._free:
+                # Out of slots: close the oldest window early
+                self._close(self._open.popleft()[1])
+                self.stats['evicted'] += 1
+            slot = self._free.pop()
+            self._slots[key] = slot
+            self._keys[slot] = key
+            self._types[slot] = beacon_type
+            self._count[slot] = 0
+            self._sum[slot] = 0
+            self._min[slot] = rssi
+            self._max[slot] = rssi
+            self._first_seen[slot] = now
+            self._open.append((now + self.window, slot))
+
+        count = self._count[slot]
+        # Keep the most recent max_samples readings for the median
+        self._samples[slot * self.max_samples + count % self.max_samples] = rssi
+        self._count[slot] = count + 1
+        self._sum[slot] += rssi
+        if rssi < self._min[slot]:
+            self._min[slot] = rssi
+        elif rssi > self._max[slot]:
+            self._max[slot] = rssi
+        self._last_seen[slot] = now
+        self._data[slot] = beacon_data
+        self.stats['readings'] += 1
+
+    def flush_due(self, now):
+        """Emit every window that has ended by `now`. Returns the number emitted."""
+        emitted = 0
+        while self._open and self._open[0][0] <= now:
+            self._close(self._open.popleft()[1])
+            emitted += 1
+        return emitted
+
+    def flush_all(self):
+        """Emit all open windows, e.g. when scanning stops."""
+        emitted = len(self._open)
+        while self._open:
+            self._close(self._open.popleft()[1])
+        return emitted
+
+    def active_beacons(self):
+        """Return the number of beacons with an open window."""
+        return len(self._slots)
+
+    def _close(self, slot):
+        """Emit the aggregated record for a slot and return the slot to the free list."""
+        count = self._count[slot]
+        base = slot * self.max_samples
+        samples = sorted(self._samples[base:base + min(count, self.max_samples)])
+        middle = len(samples) // 2
+        if len(samples) % 2:
+            median = samples[middle]
+        else:
+            median = (samples[middle - 1] + samples[middle]) / 2
+
+        mean = self._sum[slot] / count
+        last_seen = datetime.datetime.fromtimestamp(self._last_seen[slot]).isoformat()
+
+        beacon_data = dict(self._data[slot])
+        beacon_data.update({
+            'rssi': round(mean),
+            'rssi_count': count,
+            'rssi_min': self._min[slot],
+            'rssi_max': self._max[slot],
+            'rssi_mean': round(mean, 2),
+            'rssi_median': median,
+            'first_seen': datetime.datetime.fromtimestamp(self._first_seen[slot]).isoformat(),
+            'last_seen': last_seen,
+        })
+        beacon_type = self._types[slot]
+
+        del self._slots[self._keys[slot]]
+        self._keys[slot] = None
+        self._data[slot] = None
+        self._free.append(slot)
+
+        self.stats['emitted'] += 1
+        self.emit(beacon_type, beacon_data, last_seen)
@@ -0,0 +1,263 @@
+"""
+Columnar window records: all readings of a time window in one Kafka message.
+
+With [columnar] enabled, readings are not published one message each. ReadingWindow
+collects them for window_ms and emits one 'BeaconWindow' message: a header (host_id,
+base timestamp), a table of the beacons seen in the window, and one array per field
+with an entry per reading:
+
+    beacon_index   index into the beacon table
+    dt_ms          milliseconds after the base timestamp
+    rssi           RSSI in dBm
+    rssi_filtered  smoothed RSSI (NaN where missing), when the smoothing stage ran
+    distance_m     estimated distance (NaN where missing), when distance estimation ran
+
+Identity, name, address and the other fields that do not change between readings are
+stored once per beacon (and receiving adapter) in the table. The proximity class is not
+carried; consumers classify distance_m themselves.
+
+In the binary serialization a window is a record of its own (magic 'BW'), laid out so
+that every array is a contiguous, aligned block NumPy can view without copying:
+
+    header   magic 'BW' | version u8 | flags u8 | base timestamp ms i64 | readings u32 | table bytes u32
+    host_id  tagged identifier (see wire_format.py)
+    table    JSON array of beacon dicts, padded to a multiple of 4 bytes
+    arrays   dt_ms u32[n] | beacon_index u16[n] (u32 with FLAG_WIDE_INDEX) | [rssi_filtered f32[n]]
+             | [distance_m f32[n]] | rssi i8[n]
+
+In the JSON serialization the same message carries the arrays as lists. Consumers turn
+either form into NumPy arrays in one step with window_arrays(), or into ordinary
+reading messages with window_readings():
+
+    message = decode_message(record.value)
+    if is_window(message):
+        window = window_arrays(message)
+        strongest = window.rssi.max()
+"""
+
+import datetime
+import json
+import struct
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from decoders import beacon_key
+from wire_format import WINDOW_MAGIC, WINDOW_TYPE, _pack_id, _unpack_id
+
+VERSION = 1
+
+HEADER = struct.Struct('<2sBBqII')
+
+FLAG_WIDE_INDEX = 0x01
+FLAG_FILTERED = 0x02
+FLAG_DISTANCE = 0x04
+
+# Fields of a reading stored in the arrays rather than the beacon table
+READING_FIELDS = ('rssi', 'rssi_filtered', 'distance_m', 'proximity')
+
+
+class ColumnarWindow(NamedTuple):
+    """A decoded window: the beacon table and one NumPy array per field."""
+    host_id: str
+    base_timestamp_ms: int
+    beacons: list
+    beacon_index: np.ndarray
+    timestamp_ms: np.ndarray
+    rssi: np.ndarray
+    rssi_filtered: Optional[np.ndarray]
+    distance_m: Optional[np.ndarray]
+
+    def __len__(self):
+        return len(self.beacon_index)
+
+
+class ReadingWindow:
+    """Collect readings into windows and emit each window as one message."""
+
+    def __init__(self, emit, host_id, window_ms=1000, max_readings=65536):
+        if window_ms <= 0:
+            raise ValueError(f"window_ms must be positive, got {window_ms}")
+        if max_readings < 1:
+            raise ValueError(f"max_readings must be at least 1, got {max_readings}")
+        # emit(message) is called with each window message
+        self.emit = emit
+        self.host_id = host_id
+        self.window = window_ms / 1000.0
+        self.max_readings = max_readings
+        self._reset()
+
+        self.stats = {'readings': 0, 'windows': 0}
+
+    def _reset(self):
+        self._started = None
+        # (beacon key, adapter) -> index into self._beacons
+        self._index = {}
+        self._beacons = []
+        self._beacon_index = []
+        self._times = []
+        self._rssi = []
+        self._filtered = []
+        self._distance = []
+
+    def add(self, beacon_type, beacon_data, now):
+        """Add a reading taken at `now` (epoch seconds); emits the window when it is full."""
+        if self._started is None:
+            self._started = now
+        key = (beacon_key(beacon_type, beacon_data), beacon_data.get('adapter'))
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self._beacons)
+            beacon = {field: value for field, value in beacon_data.items() if field not in READING_FIELDS}
+            beacon['type'] = beacon_type
+            self._beacons.append(beacon)
+        self._beacon_index.append(index)
+        self._times.append(now)
+        self._rssi.append(beacon_data.get('rssi', 0))
+        self._filtered.append(beacon_data.get('rssi_filtered'))
+        self._distance.append(beacon_data.get('distance_m'))
+        if len(self._times) >= self.max_readings:
+            self.flush()
+
+    def pending(self):
+        """Return the number of readings in the current window."""
+        return len(self._times)
+
+    def flush_due(self, now):
+        """Emit the current window if it has ended."""
+        if self._started is not None and now - self._started >= self.window:
+            self.flush()
+
+    def flush(self):
+        """Emit the current window, if it has readings."""
+        if not self._times:
+            return
+        base_ms = int(self._started * 1000)
+        message = {
+            'type': WINDOW_TYPE,
+            'host_id': self.host_id,
+            'timestamp': datetime.datetime.fromtimestamp(base_ms / 1000).isoformat(),
+            'timestamp_ms': base_ms,
+            'beacons': self._beacons,
+            'beacon_index': self._beacon_index,
+            'dt_ms': [max(0, round(t * 1000) - base_ms) for t in self._times],
+            'rssi': self._rssi,
+        }
+        if any(value is not None for value in self._filtered):
+            message['rssi_filtered'] = self._filtered
+        if any(value is not None for value in self._distance):
+            message['distance_m'] = self._distance
+        self.stats['readings'] += len(self._times)
+        self.stats['windows'] += 1
+        self._reset()
+        self.emit(message)
+
+
+def is_window(message):
+    """Return True if a decoded message is a window of readings."""
+    return message.get('type') == WINDOW_TYPE
+
+
+def _float_array(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float32)
+
+
+def _pad(out):
+    out += bytes(-len(out) % 4)
+
+
+def encode_window(message):
+    """Encode a window message as a binary record."""
+    count = len(message['beacon_index'])
+    wide = len(message['beacons']) > 0xFFFF
+    filtered = message.get('rssi_filtered')
+    distance = message.get('distance_m')
+    flags = ((FLAG_WIDE_INDEX if wide else 0) | (FLAG_FILTERED if filtered is not None else 0)
+             | (FLAG_DISTANCE if distance is not None else 0))
+    table = json.dumps(message['beacons'], separators=(',', ':')).encode('utf-8')
+    table += b' ' * (-len(table) % 4)
+
+    out = bytearray(HEADER.pack(WINDOW_MAGIC, VERSION, flags, message['timestamp_ms'], count, len(table)))
+    _pack_id(message.get('host_id', ''), out)
+    _pad(out)
+    out += table
+    out += np.asarray(message['dt_ms'], dtype='<u4').tobytes()
+    out += np.asarray(message['beacon_index'], dtype='<u4' if wide else '<u2').tobytes()
+    _pad(out)
+    if filtered is not None:
+        out += _float_array(filtered).astype('<f4').tobytes()
+    if distance is not None:
+        out += _float_array(distance).astype('<f4').tobytes()
+    out += np.clip(np.asarray(message['rssi']), -128, 127).astype('i1').tobytes()
+    return bytes(out)
+
+
+def decode_window(data, iso_timestamps=True):
+    """Decode a binary window record into a window message whose arrays are NumPy arrays (views of data)."""
+    magic, version, flags, base_ms, count, table_size = HEADER.unpack_from(data)
+    if magic != WINDOW_MAGIC:
+        raise ValueError("Not a binary window record")
+    if version != VERSION:
+        raise ValueError(f"Unsupported window format version {version}")
+    view = memoryview(data)
+    host_id, offset = _unpack_id(view, HEADER.size)
+    offset += -offset % 4
+    beacons = json.loads(bytes(view[offset:offset + table_size]))
+    offset += table_size
+
+    def array(dtype):
+        nonlocal offset
+        values = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += values.nbytes
+        return values
+
+    message = {'type': WINDOW_TYPE, 'host_id': host_id, 'timestamp_ms': base_ms, 'beacons': beacons}
+    message['dt_ms'] = array('<u4')
+    message['beacon_index'] = array('<u4' if flags & FLAG_WIDE_INDEX else '<u2')
+    offset += -offset % 4
+    if flags & FLAG_FILTERED:
+        message['rssi_filtered'] = array('<f4')
+    if flags & FLAG_DISTANCE:
+        message['distance_m'] = array('<f4')
+    message['rssi'] = array('i1')
+    if iso_timestamps:
+        message['timestamp'] = datetime.datetime.fromtimestamp(base_ms / 1000).isoformat()
+    return message
+
+
+def window_arrays(message):
+    """Return a decoded window message (JSON or binary) as a ColumnarWindow of NumPy arrays."""
+    filtered = message.get('rssi_filtered')
+    distance = message.get('distance_m')
+    base_ms = message['timestamp_ms']
+    return ColumnarWindow(
+        host_id=message.get('host_id', ''),
+        base_timestamp_ms=base_ms,
+        beacons=message['beacons'],
+        beacon_index=np.asarray(message['beacon_index'], dtype=np.uint32),
+        timestamp_ms=np.asarray(message['dt_ms'], dtype=np.int64) + base_ms,
+        rssi=np.asarray(message['rssi'], dtype=np.int8),
+        rssi_filtered=_float_array(filtered) if isinstance(filtered, list) else filtered,
+        distance_m=_float_array(distance) if isinstance(distance, list) else distance,
+    )
+
+
+def window_readings(message):
+    """Return the readings of a window as individual reading messages, in arrival order."""
+    window = window_arrays(message)
+    readings = []
+    filtered = window.rssi_filtered.tolist() if window.rssi_filtered is not None else None
+    distance = window.distance_m.tolist() if window.distance_m is not None else None
+    for i, (index, timestamp_ms, rssi) in enumerate(zip(window.beacon_index.tolist(), window.timestamp_ms.tolist(),
+                                                         window.rssi.tolist())):
+        reading = dict(window.beacons[index])
+        reading['host_id'] = window.host_id
+        reading['rssi'] = rssi
+        reading['timestamp_ms'] = timestamp_ms
+        reading['timestamp'] = datetime.datetime.fromtimestamp(timestamp_ms / 1000).isoformat()
+        if filtered is not None and filtered[i] == filtered[i]:
+            reading['rssi_filtered'] = round(filtered[i], 2)
+        if distance is not None and distance[i] == distance[i]:
+            reading['distance_m'] = round(distance[i], 2)
+        readings.append(reading)
+    return readings
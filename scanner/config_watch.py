@@ -0,0 +1,96 @@
+"""
+Watching and validating the scanner configuration while it runs.
+
+ConfigWatcher polls the configuration file's modification time and size; a change is
+reported once the file has stayed the same for `settle` seconds, so a save that is
+written in several steps is read only when complete.
+
+validate_config() checks a configuration against the defaults it was built from:
+options whose default is an integer, a number or a boolean must parse as one, and
+options listed in `choices` must have one of the allowed values. A configuration with
+problems is not applied at all, so a typo never leaves the scanner half reconfigured.
+"""
+
+import configparser
+import os
+import re
+
+_INTEGER = re.compile(r'-?\d+$')
+_NUMBER = re.compile(r'-?(\d+\.\d*|\.\d+)$')
+_BOOLEANS = ('true', 'false')
+
+
+class ConfigWatcher:
+    """Report changes to a configuration file."""
+
+    def __init__(self, path, settle=0.5):
+        self.path = path
+        self.settle = settle
+        self._current = self._signature()
+        # Signature seen changing and when it was first seen, until it settles
+        self._pending = None
+        self._pending_since = None
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def poll(self, now):
+        """Return True once the file has changed and stayed unchanged for `settle` seconds."""
+        signature = self._signature()
+        if signature == self._current or signature is None:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            self._pending = signature
+            self._pending_since = now
+            return False
+        if now - self._pending_since < self.settle:
+            return False
+        self._current = signature
+        self._pending = None
+        return True
+
+
+def read_config(path, defaults):
+    """Read `path` over a copy of `defaults`. Raises configparser.Error or OSError if unreadable."""
+    config = configparser.ConfigParser()
+    config.read_dict(defaults)
+    with open(path, encoding='utf-8') as f:
+        config.read_file(f, path)
+    return config
+
+
+def validate_config(config, defaults, choices=None):
+    """Return a list of problems with `config`, judged by the types of the default values."""
+    problems = []
+    for section in defaults.sections():
+        for option, default in defaults[section].items():
+            value = config.get(section, option, fallback=default).strip()
+            allowed = (choices or {}).get((section, option))
+            if allowed is not None:
+                if value not in allowed:
+                    problems.append(f"[{section}] {option} = {value!r}: expected one of {', '.join(allowed)}")
+            elif default.lower() in _BOOLEANS:
+                if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+                    problems.append(f"[{section}] {option} = {value!r}: expected true or false")
+            elif _INTEGER.match(default):
+                if not _INTEGER.match(value):
+                    problems.append(f"[{section}] {option} = {value!r}: expected an integer")
+            elif _NUMBER.match(default):
+                if not (_NUMBER.match(value) or _INTEGER.match(value)):
+                    problems.append(f"[{section}] {option} = {value!r}: expected a number")
+    return problems
+
+
+def changed_sections(old, new):
+    """Return the names of the sections whose options differ between two configurations."""
+    sections = set(old.sections()) | set(new.sections())
+    return {
+        section for section in sections
+        if (dict(old[section]) if old.has_section(section) else {})
+        != (dict(new[section]) if new.has_section(section) else {})
+    }
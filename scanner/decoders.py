@@ -0,0 +1,323 @@
+"""
+Table-driven decoders for BLE beacon advertisements.
+
+Decoders are registered against a Bluetooth SIG company ID (manufacturer data) or a
+service UUID (service data). Each decoder receives a memoryview over the raw payload,
+unpacks it with a precompiled struct layout and returns a typed record, or None if
+the payload is not a frame it understands. New beacon formats can be added with
+register_manufacturer_decoder() / register_service_decoder() without touching the
+scan loop.
+
+Eddystone frames are decoded from service data for the 0xFEAA service, as the
+Eddystone specification defines them. AltBeacon frames are recognised by their 0xBEAC
+beacon code under any company ID; other manufacturer data is not a beacon.
+
+tx_power is always the calibrated RSSI at 1 m, the unit the iBeacon measured power and
+the AltBeacon reference RSSI use. Eddystone frames carry the power at 0 m, which is
+converted with the 41 dB loss the specification gives for the first metre.
+"""
+
+import struct
+from typing import NamedTuple, Optional
+
+# Bluetooth SIG company identifiers
+COMPANY_APPLE = 0x004C
+
+# Base UUID used to expand 16/32-bit service UUIDs to their 128-bit form
+BLUETOOTH_BASE_UUID = "0000{:04x}-0000-1000-8000-00805f9b34fb"
+
+EDDYSTONE_SERVICE_UUID = BLUETOOTH_BASE_UUID.format(0xFEAA)
+
+
+class IBeacon(NamedTuple):
+    """Apple iBeacon frame."""
+    uuid: str
+    major: int
+    minor: int
+    tx_power: int
+
+    beacon_type = 'iBeacon'
+
+
+class EddystoneUID(NamedTuple):
+    """Eddystone-UID frame."""
+    namespace: str
+    instance: str
+    tx_power: int
+
+    beacon_type = 'Eddystone-UID'
+
+
+class EddystoneURL(NamedTuple):
+    """Eddystone-URL frame."""
+    url: str
+    tx_power: int
+
+    beacon_type = 'Eddystone-URL'
+
+
+class EddystoneTLM(NamedTuple):
+    """Unencrypted Eddystone-TLM (telemetry) frame; None where the beacon does not report a value."""
+    battery_mv: Optional[int]
+    temperature_c: Optional[float]
+    adv_count: int
+    uptime_s: float
+
+    beacon_type = 'Eddystone-TLM'
+
+
+class EddystoneETLM(NamedTuple):
+    """Encrypted Eddystone-TLM frame, passed on for decryption downstream."""
+    etlm: str
+    salt: int
+    mic: int
+
+    beacon_type = 'Eddystone-eTLM'
+
+
+class EddystoneEID(NamedTuple):
+    """Eddystone-EID (ephemeral identifier) frame."""
+    eid: str
+    tx_power: int
+
+    beacon_type = 'Eddystone-EID'
+
+
+class AltBeacon(NamedTuple):
+    """AltBeacon frame."""
+    beacon_id: str
+    tx_power: int
+
+    beacon_type = 'AltBeacon'
+
+
+# Precompiled layouts
+# iBeacon: 0x02 0x15, 16-byte proximity UUID, major, minor, signed measured power
+IBEACON_LAYOUT = struct.Struct('>BB16sHHb')
+# AltBeacon: 0xBE 0xAC, 20-byte beacon ID, signed reference RSSI at 1 m (the manufacturer
+# reserved byte that follows is not used)
+ALTBEACON_LAYOUT = struct.Struct('>BB20sb')
+ALTBEACON_CODE = b'\xbe\xac'
+
+# Eddystone service data: frame type, then per frame type (0 m Tx power is signed)
+EDDYSTONE_UID_FRAME = 0x00
+EDDYSTONE_URL_FRAME = 0x10
+EDDYSTONE_TLM_FRAME = 0x20
+EDDYSTONE_EID_FRAME = 0x30
+# UID: Tx power, 10-byte namespace, 6-byte instance (the two reserved bytes are often omitted)
+EDDYSTONE_UID_LAYOUT = struct.Struct('>Bb10s6s')
+# URL: Tx power, scheme prefix, then the encoded URL
+EDDYSTONE_URL_HEADER = struct.Struct('>BbB')
+# TLM version 0: battery mV (0 if unknown), temperature as signed 8.8 fixed point
+# (-128.0 if unknown), advertising PDU count, time since boot in 0.1 s
+EDDYSTONE_TLM_LAYOUT = struct.Struct('>BBHhII')
+# TLM version 1: 12 bytes of encrypted TLM, salt, message integrity check
+EDDYSTONE_ETLM_LAYOUT = struct.Struct('>BB12sHH')
+# EID: Tx power, 8-byte ephemeral identifier
+EDDYSTONE_EID_LAYOUT = struct.Struct('>Bb8s')
+
+# Loss over the first metre, to convert Eddystone's 0 m Tx power to the 1 m convention
+EDDYSTONE_TX_POWER_1M_OFFSET = 41
+EDDYSTONE_TEMPERATURE_UNKNOWN = -0x8000
+
+EDDYSTONE_URL_SCHEMES = ('http://www.', 'https://www.', 'http://', 'https://')
+# Bytes 0x00-0x0D of an encoded URL expand to these strings
+EDDYSTONE_URL_EXPANSIONS = ('.com/', '.org/', '.edu/', '.net/', '.info/', '.biz/', '.gov/',
+                            '.com', '.org', '.edu', '.net', '.info', '.biz', '.gov')
+
+# Fields that identify an individual beacon, per beacon type. Types not listed here
+# are identified by their advertising address.
+KEY_FIELDS = {
+    'iBeacon': ('uuid', 'major', 'minor'),
+    'Eddystone-UID': ('namespace', 'instance'),
+    'Eddystone-URL': ('url',),
+    'Eddystone-EID': ('eid',),
+    'AltBeacon': ('beacon_id',),
+}
+
+# Decoder tables
+_manufacturer_decoders = {}
+_service_decoders = {}
+_fallback_decoders = []
+
+# Formatted UUID strings keyed by their raw 16 bytes. Deployments see a small, fixed
+# set of proximity UUIDs, so formatting each one once avoids uuid.UUID() per frame.
+_uuid_strings = {}
+_UUID_CACHE_LIMIT = 4096
+
+
+def normalize_service_uuid(service_uuid):
+    """Return the lowercase 128-bit string form of a service UUID given as int or string."""
+    if isinstance(service_uuid, int):
+        return BLUETOOTH_BASE_UUID.format(service_uuid)
+    service_uuid = service_uuid.lower()
+    if len(service_uuid) == 4:
+        return BLUETOOTH_BASE_UUID.format(int(service_uuid, 16))
+    return service_uuid
+
+
+def register_manufacturer_decoder(company_id, decoder):
+    """Register a decoder for manufacturer data with the given company ID."""
+    _manufacturer_decoders.setdefault(company_id, []).append(decoder)
+    return decoder
+
+
+def register_service_decoder(service_uuid, decoder):
+    """Register a decoder for service data with the given service UUID."""
+    _service_decoders.setdefault(normalize_service_uuid(service_uuid), []).append(decoder)
+    return decoder
+
+
+def register_fallback_decoder(decoder):
+    """Register a decoder for manufacturer data of any company ID.
+
+    Fallback decoders are tried after the decoders registered for the company ID, when
+    none of those recognises the payload.
+    """
+    _fallback_decoders.append(decoder)
+    return decoder
+
+
+def manufacturer_decoder(company_id):
+    """Decorator form of register_manufacturer_decoder()."""
+    def wrap(decoder):
+        return register_manufacturer_decoder(company_id, decoder)
+    return wrap
+
+
+def service_decoder(service_uuid):
+    """Decorator form of register_service_decoder()."""
+    def wrap(decoder):
+        return register_service_decoder(service_uuid, decoder)
+    return wrap
+
+
+def beacon_key(beacon_type, beacon_data):
+    """Return a hashable identity for the beacon a reading came from."""
+    fields = KEY_FIELDS.get(beacon_type)
+    if fields is None:
+        return (beacon_type, beacon_data.get('address'))
+    return (beacon_type,) + tuple(beacon_data[field] for field in fields)
+
+
+def format_uuid(raw):
+    """Format 16 raw bytes as a canonical UUID string, caching the result."""
+    uuid_str = _uuid_strings.get(raw)
+    if uuid_str is None:
+        h = bytes(raw).hex()
+        uuid_str = f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+        if len(_uuid_strings) >= _UUID_CACHE_LIMIT:
+            _uuid_strings.clear()
+        _uuid_strings[bytes(raw)] = uuid_str
+    return uuid_str
+
+
+def _decode(decoders, view):
+    """Return the record of the first decoder that recognises the payload, or None."""
+    for decoder in decoders:
+        try:
+            record = decoder(view)
+        except (struct.error, IndexError, ValueError):
+            # Truncated or malformed frame
+            continue
+        if record is not None:
+            return record
+    return None
+
+
+def decode_advertisement(manufacturer_data, service_data=None):
+    """Decode all beacon frames in an advertisement and return them as a list of records."""
+    records = []
+
+    for company_id, data in manufacturer_data.items():
+        view = memoryview(data)
+        record = _decode(_manufacturer_decoders.get(company_id, ()), view)
+        if record is None:
+            record = _decode(_fallback_decoders, view)
+        if record is not None:
+            records.append(record)
+
+    if service_data:
+        for service_uuid, data in service_data.items():
+            decoders = _service_decoders.get(service_uuid)
+            if decoders is None:
+                continue
+            record = _decode(decoders, memoryview(data))
+            if record is not None:
+                records.append(record)
+
+    return records
+
+
+@manufacturer_decoder(COMPANY_APPLE)
+def decode_ibeacon(view):
+    """Decode an iBeacon frame from Apple manufacturer data."""
+    if len(view) < IBEACON_LAYOUT.size or view[0] != 0x02 or view[1] != 0x15:
+        return None
+    _, _, uuid_bytes, major, minor, tx_power = IBEACON_LAYOUT.unpack_from(view)
+    return IBeacon(format_uuid(uuid_bytes), major, minor, tx_power)
+
+
+def expand_eddystone_url(encoded):
+    """Expand the encoded part of an Eddystone-URL; reserved bytes raise ValueError."""
+    parts = []
+    for byte in encoded:
+        if byte < len(EDDYSTONE_URL_EXPANSIONS):
+            parts.append(EDDYSTONE_URL_EXPANSIONS[byte])
+        elif 0x21 <= byte <= 0x7E:
+            parts.append(chr(byte))
+        else:
+            raise ValueError(f"Reserved byte 0x{byte:02x} in Eddystone-URL")
+    return ''.join(parts)
+
+
+def _eddystone_tx_power(tx_power_0m):
+    return tx_power_0m - EDDYSTONE_TX_POWER_1M_OFFSET
+
+
+@service_decoder(EDDYSTONE_SERVICE_UUID)
+def decode_eddystone(view):
+    """Decode an Eddystone UID, URL, TLM or EID frame from 0xFEAA service data."""
+    if not view:
+        return None
+    frame_type = view[0]
+
+    if frame_type == EDDYSTONE_UID_FRAME:
+        _, tx_power, namespace, instance = EDDYSTONE_UID_LAYOUT.unpack_from(view)
+        return EddystoneUID(namespace.hex(), instance.hex(), _eddystone_tx_power(tx_power))
+
+    if frame_type == EDDYSTONE_URL_FRAME:
+        _, tx_power, scheme = EDDYSTONE_URL_HEADER.unpack_from(view)
+        url = EDDYSTONE_URL_SCHEMES[scheme] + expand_eddystone_url(view[EDDYSTONE_URL_HEADER.size:])
+        return EddystoneURL(url, _eddystone_tx_power(tx_power))
+
+    if frame_type == EDDYSTONE_TLM_FRAME:
+        if len(view) < 2:
+            return None
+        if view[1] == 0x00:
+            _, _, battery_mv, temperature, adv_count, uptime = EDDYSTONE_TLM_LAYOUT.unpack_from(view)
+            return EddystoneTLM(
+                battery_mv or None,
+                None if temperature == EDDYSTONE_TEMPERATURE_UNKNOWN else temperature / 256,
+                adv_count,
+                uptime / 10,
+            )
+        if view[1] == 0x01:
+            _, _, etlm, salt, mic = EDDYSTONE_ETLM_LAYOUT.unpack_from(view)
+            return EddystoneETLM(etlm.hex(), salt, mic)
+        return None
+
+    if frame_type == EDDYSTONE_EID_FRAME:
+        _, tx_power, eid = EDDYSTONE_EID_LAYOUT.unpack_from(view)
+        return EddystoneEID(eid.hex(), _eddystone_tx_power(tx_power))
+
+    return None
+
+
+@register_fallback_decoder
+def decode_altbeacon(view):
+    """Decode an AltBeacon frame, identified by its 0xBEAC beacon code, from any manufacturer's data."""
+    if len(view) < ALTBEACON_LAYOUT.size or view[:2] != ALTBEACON_CODE:
+        return None
+    _, _, beacon_id, tx_power = ALTBEACON_LAYOUT.unpack_from(view)
+    return AltBeacon(beacon_id.hex(), tx_power)
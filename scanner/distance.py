@@ -0,0 +1,127 @@
+"""
+Batched distance estimation from RSSI with a log-distance path-loss model.
+
+    distance_m = 10 ** ((tx_power - rssi) / (10 * n))
+
+tx_power is the calibrated RSSI at 1 m (the iBeacon measured power) and n the path-loss
+exponent of the environment: 2.0 in free space, higher where walls, shelving and people
+absorb the signal. Both can be overridden per beacon from a calibration table. The
+smoothed RSSI is used when the smoothing stage ran before this one.
+
+Each reading with a known tx_power gets 'distance_m' and a 'proximity' class
+(immediate, near or far).
+"""
+
+import numpy as np
+
+# Path-loss exponents for typical environments
+ENVIRONMENTS = {
+    'free-space': 2.0,
+    'warehouse': 2.2,
+    'indoor': 2.7,
+    'office': 3.0,
+    'obstructed': 3.5,
+}
+
+PROXIMITY_CLASSES = ('immediate', 'near', 'far')
+
+# Resolved parameters are cached per beacon; the cache is reset beyond this many beacons
+_PARAMS_CACHE_LIMIT = 4096
+
+
+def calibration_key(beacon_key):
+    """Return the calibration table key for a beacon identity, e.g. 'ibeacon/<uuid>/1/2'."""
+    return '/'.join(str(part) for part in beacon_key).lower()
+
+
+def parse_calibration(section):
+    """Parse calibration entries ('tx_power' or 'tx_power, exponent') keyed by calibration_key().
+
+    Returns a dict of key -> (tx_power or None, exponent or None).
+    """
+    calibration = {}
+    for key, value in section.items():
+        parts = [part.strip() for part in value.split(',')]
+        if not 1 <= len(parts) <= 2:
+            raise ValueError(f"Bad calibration for {key}: expected 'tx_power[, exponent]'")
+        tx_power = float(parts[0]) if parts[0] else None
+        exponent = float(parts[1]) if len(parts) == 2 and parts[1] else None
+        calibration[key.lower()] = (tx_power, exponent)
+    return calibration
+
+
+class DistanceEstimator:
+    """Batch stage that estimates beacon distance and proximity from RSSI."""
+
+    def __init__(self, environment='indoor', path_loss_exponent=None, default_tx_power=None,
+                 calibration=None, immediate=0.5, near=4.0):
+        if path_loss_exponent is None:
+            if environment not in ENVIRONMENTS:
+                raise ValueError(f"Unknown environment '{environment}', expected one of {tuple(ENVIRONMENTS)}")
+            path_loss_exponent = ENVIRONMENTS[environment]
+        if path_loss_exponent <= 0:
+            raise ValueError(f"Path-loss exponent must be positive, got {path_loss_exponent}")
+        if not 0 < immediate < near:
+            raise ValueError(f"Proximity thresholds must satisfy 0 < immediate < near, got {immediate}, {near}")
+
+        self.environment = environment
+        self.path_loss_exponent = path_loss_exponent
+        self.default_tx_power = default_tx_power
+        self.calibration = calibration or {}
+        self.thresholds = np.array([immediate, near])
+
+        # beacon key -> (tx_power override or None, exponent), resolved once per beacon
+        self._params = {}
+
+        self.stats = {'estimated': 0, 'skipped': 0}
+
+    def estimate(self, rssi, tx_power, exponent):
+        """Return distances in metres for arrays of RSSI, tx_power and path-loss exponent."""
+        return np.power(10.0, (tx_power - rssi) / (10.0 * exponent))
+
+    def classify(self, distance):
+        """Return the index into PROXIMITY_CLASSES for each distance."""
+        return np.searchsorted(self.thresholds, distance, side='right')
+
+    def process(self, batch):
+        """Batch stage: attach 'distance_m' and 'proximity' to readings with a known tx_power."""
+        count = len(batch)
+        tx_power = np.empty(count, dtype=np.float64)
+        exponent = np.empty(count, dtype=np.float64)
+        params = self._params
+        default_tx_power = self.default_tx_power
+        for i, (key, beacon_data) in enumerate(zip(batch.keys, batch.data)):
+            beacon_params = params.get(key)
+            if beacon_params is None:
+                beacon_params = self._resolve(key)
+            tx_override, exponent[i] = beacon_params
+            if tx_override is not None:
+                tx_power[i] = tx_override
+            else:
+                value = beacon_data.get('tx_power', default_tx_power)
+                tx_power[i] = np.nan if value is None else value
+
+        rssi = batch.rssi_filtered if batch.rssi_filtered is not None else batch.rssi
+        distance = self.estimate(rssi, tx_power, exponent)
+        known = np.isfinite(distance)
+        proximity = self.classify(distance)
+
+        for i, value, klass in zip(np.flatnonzero(known).tolist(),
+                                   np.round(distance[known], 2).tolist(),
+                                   proximity[known].tolist()):
+            beacon_data = batch.data[i]
+            beacon_data['distance_m'] = value
+            beacon_data['proximity'] = PROXIMITY_CLASSES[klass]
+
+        estimated = int(known.sum())
+        self.stats['estimated'] += estimated
+        self.stats['skipped'] += count - estimated
+
+    def _resolve(self, key):
+        """Look up a beacon's calibration and cache its model parameters."""
+        tx_power, exponent = self.calibration.get(calibration_key(key), (None, None))
+        params = (tx_power, exponent if exponent is not None else self.path_loss_exponent)
+        if len(self._params) >= _PARAMS_CACHE_LIMIT:
+            self._params.clear()
+        self._params[key] = params
+        return params
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Out-of-process scanner engine.
+
+The launcher runs the scan, decode and publish pipeline (scan.py) in a separate
+process so that decoding and Kafka I/O never compete with wx rendering for the GIL.
+Readings reach the GUI through a ring buffer of fixed-size records in shared memory,
+with one producer (the engine's GUI callback) and one consumer (the GUI's refresh
+timer):
+
+    header   write index u64 | dropped u64 | capacity u64 | ready u8 | ... | read index u64 | stop u8
+    slots    capacity x (sequence u64 | RECORD)
+
+Only the producer writes the write index and only the consumer writes the read index,
+so neither side takes a lock. A slot's sequence number is written after its record and
+the write index after that; the consumer only reads slots whose sequence number
+matches the position it expects. When the ring is full the producer drops the reading
+and counts it rather than waiting for the GUI, which only needs the latest state of
+each beacon.
+
+The engine sets the ready byte once it has attached to the ring and loaded the scanner,
+and ScannerEngine.start() waits for it, so an engine that cannot start is reported as a
+startup failure rather than a scan that stopped. The consumer asks the engine to stop
+by setting the stop byte in the header; the engine also stops if the launcher that
+started it goes away.
+
+The engine process is started with multiprocessing (spawn), which works from the app
+bundle as well as from source; it can also be run on its own:
+
+    python engine.py --ring NAME
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from decoders import beacon_key
+from logging_config import get_logger
+
+log = get_logger('engine')
+
+# Readings the ring holds; the GUI drains it GUI_REFRESH_HZ times per second
+DEFAULT_CAPACITY = 65536
+
+# Seconds to wait for a new engine process to report ready
+STARTUP_TIMEOUT = 30.0
+
+INDEX = struct.Struct('<Q')
+HEADER_SIZE = 128
+WRITE_OFFSET = 0
+DROPPED_OFFSET = 8
+CAPACITY_OFFSET = 16
+READY_OFFSET = 24
+# The consumer's fields are on their own cache line
+READ_OFFSET = 64
+STOP_OFFSET = 72
+
+# type code u8 | rssi i8 | flags u8 | tx_power i8 | received f64 | major u16 | minor u16 |
+# rssi_filtered f32 | distance_m f32 | identity 20s | address 36s | text 40s
+RECORD = struct.Struct('<BbBbdHHff20s36s40s')
+SLOT_SIZE = INDEX.size + RECORD.size
+
+# Record type codes; TYPE_OTHER carries the beacon type name in the text field
+TYPE_OTHER = 0
+TYPE_CODES = {'iBeacon': 1, 'Eddystone-UID': 2, 'Eddystone-URL': 3, 'AltBeacon': 4, 'Eddystone-EID': 5}
+
+HAS_TX_POWER = 0x01
+HAS_FILTERED = 0x02
+HAS_DISTANCE = 0x04
+
+
+def _text(value, size):
+    return str(value).encode('utf-8')[:size]
+
+
+def _untext(raw):
+    return raw.rstrip(b'\0').decode('utf-8', 'replace')
+
+
+def _format_uuid(h):
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def pack_reading(buffer, offset, beacon_type, beacon_data, received):
+    """Write a reading into the record at `offset`."""
+    code = TYPE_CODES.get(beacon_type, TYPE_OTHER)
+    identity = b''
+    major = minor = 0
+    text = ''
+    try:
+        if code == 1:
+            identity = bytes.fromhex(beacon_data['uuid'].replace('-', ''))
+            major = beacon_data['major']
+            minor = beacon_data['minor']
+        elif code == 2:
+            identity = bytes.fromhex(beacon_data['namespace']) + bytes.fromhex(beacon_data['instance'])
+        elif code == 3:
+            text = beacon_data['url']
+        elif code == 4:
+            identity = bytes.fromhex(beacon_data['beacon_id'])
+        elif code == 5:
+            identity = bytes.fromhex(beacon_data['eid'])
+        else:
+            text = beacon_type
+    except (KeyError, ValueError):
+        # Not the usual shape; identify the beacon by its address instead
+        code, identity, major, minor, text = TYPE_OTHER, b'', 0, 0, beacon_type
+
+    flags = 0
+    tx_power = beacon_data.get('tx_power')
+    if tx_power is not None:
+        flags |= HAS_TX_POWER
+    filtered = beacon_data.get('rssi_filtered')
+    if filtered is not None:
+        flags |= HAS_FILTERED
+    distance = beacon_data.get('distance_m')
+    if distance is not None:
+        flags |= HAS_DISTANCE
+
+    RECORD.pack_into(
+        buffer, offset,
+        code,
+        max(-128, min(127, int(beacon_data.get('rssi', 0)))),
+        flags,
+        max(-128, min(127, int(tx_power))) if tx_power is not None else 0,
+        received,
+        major,
+        minor,
+        filtered if filtered is not None else 0.0,
+        distance if distance is not None else 0.0,
+        identity,
+        _text(beacon_data.get('address', 'unknown'), 36),
+        _text(text, 40),
+    )
+
+
+def unpack_reading(buffer, offset):
+    """Read the record at `offset` back as (beacon_type, beacon_data, received)."""
+    (code, rssi, flags, tx_power, received, major, minor, filtered, distance,
+     identity, address, text) = RECORD.unpack_from(buffer, offset)
+    beacon_data = {'rssi': rssi, 'address': _untext(address)}
+    if code == 1:
+        beacon_type = 'iBeacon'
+        beacon_data.update({'uuid': _format_uuid(identity[:16].hex()), 'major': major, 'minor': minor})
+    elif code == 2:
+        beacon_type = 'Eddystone-UID'
+        beacon_data.update({'namespace': identity[:10].hex(), 'instance': identity[10:16].hex()})
+    elif code == 3:
+        beacon_type = 'Eddystone-URL'
+        beacon_data['url'] = _untext(text)
+    elif code == 4:
+        beacon_type = 'AltBeacon'
+        beacon_data['beacon_id'] = identity.hex()
+    elif code == 5:
+        beacon_type = 'Eddystone-EID'
+        beacon_data['eid'] = identity[:8].hex()
+    else:
+        beacon_type = _untext(text)
+    if flags & HAS_TX_POWER:
+        beacon_data['tx_power'] = tx_power
+    if flags & HAS_FILTERED:
+        beacon_data['rssi_filtered'] = round(filtered, 2)
+    if flags & HAS_DISTANCE:
+        beacon_data['distance_m'] = round(distance, 2)
+    return beacon_type, beacon_data, received
+
+
+class BeaconRing:
+    """Single-producer, single-consumer ring of reading records in shared memory."""
+
+    def __init__(self, memory, capacity, owner):
+        self.memory = memory
+        self.buffer = memory.buf
+        self.capacity = capacity
+        self.owner = owner
+        # Each side keeps its own index locally and only publishes it
+        self._write = INDEX.unpack_from(self.buffer, WRITE_OFFSET)[0]
+        self._read = INDEX.unpack_from(self.buffer, READ_OFFSET)[0]
+
+        self.stats = {'written': 0, 'read': 0}
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY):
+        """Create a new ring; the creator unlinks it on close()."""
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        memory = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * SLOT_SIZE)
+        memory.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        INDEX.pack_into(memory.buf, CAPACITY_OFFSET, capacity)
+        return cls(memory, capacity, owner=True)
+
+    @classmethod
+    def attach(cls, name, own_tracker=True):
+        """Attach to a ring created by another process.
+
+        own_tracker is False in a process started by the creator with multiprocessing,
+        which shares the creator's resource tracker.
+        """
+        try:
+            # The creator owns the segment; do not let this process's tracker unlink it
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            memory = shared_memory.SharedMemory(name=name)
+            if own_tracker:
+                resource_tracker.unregister(memory._name, 'shared_memory')
+        capacity = INDEX.unpack_from(memory.buf, CAPACITY_OFFSET)[0]
+        return cls(memory, capacity, owner=False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    # Producer side
+
+    def put(self, beacon_type, beacon_data, received):
+        """Append a reading. Returns False (and counts it as dropped) if the ring is full."""
+        buffer = self.buffer
+        position = self._write
+        if position - INDEX.unpack_from(buffer, READ_OFFSET)[0] >= self.capacity:
+            INDEX.pack_into(buffer, DROPPED_OFFSET, INDEX.unpack_from(buffer, DROPPED_OFFSET)[0] + 1)
+            return False
+        offset = HEADER_SIZE + (position % self.capacity) * SLOT_SIZE
+        pack_reading(buffer, offset + INDEX.size, beacon_type, beacon_data, received)
+        # Sequence number, then write index: the consumer never sees a partial record
+        INDEX.pack_into(buffer, offset, position + 1)
+        position += 1
+        INDEX.pack_into(buffer, WRITE_OFFSET, position)
+        self._write = position
+        self.stats['written'] += 1
+        return True
+
+    def set_ready(self):
+        self.buffer[READY_OFFSET] = 1
+
+    def stop_requested(self):
+        return self.buffer[STOP_OFFSET] != 0
+
+    # Consumer side
+
+    def read(self, limit=None):
+        """Return the readings written since the last read, oldest first."""
+        buffer = self.buffer
+        position = self._read
+        end = INDEX.unpack_from(buffer, WRITE_OFFSET)[0]
+        if limit is not None:
+            end = min(end, position + limit)
+        readings = []
+        while position < end:
+            offset = HEADER_SIZE + (position % self.capacity) * SLOT_SIZE
+            if INDEX.unpack_from(buffer, offset)[0] != position + 1:
+                break
+            readings.append(unpack_reading(buffer, offset + INDEX.size))
+            position += 1
+        if position != self._read:
+            INDEX.pack_into(buffer, READ_OFFSET, position)
+            self._read = position
+            self.stats['read'] += len(readings)
+        return readings
+
+    def drain(self):
+        """Return the readings written since the last drain, latest per beacon."""
+        latest = {}
+        for update in self.read():
+            latest[beacon_key(update[0], update[1])] = update
+        return list(latest.values())
+
+    def ready(self):
+        """Return True once the producer has reported that it is running."""
+        return self.buffer[READY_OFFSET] != 0
+
+    def dropped(self):
+        """Return the number of readings the producer dropped because the ring was full."""
+        return INDEX.unpack_from(self.buffer, DROPPED_OFFSET)[0]
+
+    def request_stop(self):
+        self.buffer[STOP_OFFSET] = 1
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class ScannerEngine:
+    """Launcher-side handle for a scanner engine running in its own process."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.ring = None
+        self.process = None
+
+    def start(self, timeout=STARTUP_TIMEOUT):
+        """Create the ring, start the engine process and wait until it reports ready.
+
+        Raises RuntimeError if the process exits or does not become ready within
+        `timeout` seconds; nothing is left running in that case.
+        """
+        self.ring = BeaconRing.create(self.capacity)
+        try:
+            context = multiprocessing.get_context('spawn')
+            self.process = context.Process(target=run_engine, args=(self.ring.name, os.getpid()),
+                                           name="ScannerEngine")
+            self.process.start()
+            deadline = time.monotonic() + timeout
+            while not self.ring.ready():
+                if not self.process.is_alive():
+                    raise RuntimeError(f"scanner engine exited during startup (exit code {self.process.exitcode})")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"scanner engine did not start within {timeout:.0f}s")
+                time.sleep(0.01)
+        except Exception:
+            if self.process is not None and self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.process = None
+            self.ring.close()
+            self.ring = None
+            raise
+        log.info("Started scanner engine (pid %d)", self.process.pid)
+
+    def running(self):
+        return self.process is not None and self.process.is_alive()
+
+    def drain(self):
+        """Return the readings received since the last drain, latest per beacon."""
+        return self.ring.drain() if self.ring is not None else []
+
+    def stop(self):
+        """Ask the engine to stop scanning and exit; it flushes its publisher first."""
+        if self.ring is not None:
+            self.ring.request_stop()
+
+    def close(self, timeout=5.0):
+        """Wait for the engine to exit (terminating it after `timeout`) and release the ring."""
+        if self.process is not None:
+            self.stop()
+            self.process.join(timeout)
+            if self.process.is_alive():
+                log.warning("Scanner engine did not stop within %.1fs, terminating it", timeout)
+                self.process.terminate()
+                self.process.join()
+            self.process = None
+        if self.ring is not None:
+            dropped = self.ring.dropped()
+            if dropped:
+                log.info("GUI ring was full for %d readings", dropped)
+            self.ring.close()
+            self.ring = None
+
+
+async def _run(ring, parent_pid):
+    import scan
+
+    ring.set_ready()
+    scan.set_gui_callback(lambda beacon_type, beacon_data: ring.put(beacon_type, beacon_data, time.time()))
+    task = asyncio.ensure_future(scan.scan_ble_devices())
+    while not task.done():
+        if ring.stop_requested() or os.getppid() != parent_pid:
+            scan.stop_scanning()
+        await asyncio.wait([task], timeout=scan.STOP_POLL_INTERVAL)
+    task.result()
+
+
+def run_engine(ring_name, parent_pid, own_tracker=False):
+    """Run the scanner, passing readings to the ring `ring_name`, until asked to stop or
+    until the process `parent_pid` goes away."""
+    ring = BeaconRing.attach(ring_name, own_tracker)
+    try:
+        asyncio.run(_run(ring, parent_pid))
+    finally:
+        ring.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the scanner engine for the launcher.")
+    parser.add_argument('--ring', required=True, help="name of the shared memory ring created by the launcher")
+    args = parser.parse_args(argv)
+
+    run_engine(args.ring, os.getppid(), own_tracker=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Allow and deny rules evaluated on raw advertisements, before they are decoded.
+
+In busy places most advertisements come from phones, headphones and beacons that are
+not ours. AdvertisementFilter drops them in the scan loop, before the decoders, the
+pipeline stages and Kafka see them. It runs after cross-adapter deduplication (so each
+advertisement is counted once) and after the capture recorder (so captures stay raw).
+Rules are compiled once into hash tables keyed by the raw values found in an
+advertisement (16-byte UUIDs, 10-byte Eddystone namespaces, company IDs) and into a
+table of address prefixes per prefix length, so checking an advertisement costs a few
+dictionary lookups however many rules there are.
+
+An advertisement is rejected if its RSSI is below min_rssi or it matches any deny rule.
+If any allow rule is configured, it must also match at least one of them. Each rule
+counts its hits in `hits`, keyed by (list, value).
+
+    [filter]
+    enabled = true
+    allow_uuids = f7826da6-4fa2-4e98-8024-bc5b71e0893e
+    allow_namespaces = edd1ebeac04e5defa017
+    deny_mac_prefixes = 00:1A:7D
+    min_rssi = -90
+
+UUIDs are matched against iBeacon proximity UUIDs and the first 16 bytes of AltBeacon
+IDs, namespaces against Eddystone-UID frames. On platforms that do not expose MAC
+addresses (macOS), address prefixes match the platform's device identifiers instead.
+"""
+
+import collections
+import re
+
+from decoders import ALTBEACON_CODE, EDDYSTONE_SERVICE_UUID, EDDYSTONE_UID_FRAME
+
+# Rule lists, in the order they are reported
+RULE_LISTS = (
+    'allow_uuids', 'deny_uuids',
+    'allow_namespaces', 'deny_namespaces',
+    'allow_mac_prefixes', 'deny_mac_prefixes',
+    'allow_company_ids', 'deny_company_ids',
+)
+
+IBEACON_PREFIX = b'\x02\x15'
+
+
+def split_values(value):
+    """Split a comma or whitespace separated list, skipping empty entries."""
+    return [part for part in re.split(r'[\s,]+', value.strip()) if part]
+
+
+def _hex_table(values, size, what):
+    """Return a dict of raw bytes -> the value as configured."""
+    table = {}
+    for value in values:
+        try:
+            raw = bytes.fromhex(value.replace('-', ''))
+        except ValueError:
+            raw = b''
+        if len(raw) != size:
+            raise ValueError(f"Bad {what} {value!r}: expected {size * 2} hex digits")
+        table[raw] = value.lower()
+    return table
+
+
+def _company_table(values):
+    table = {}
+    for value in values:
+        try:
+            company_id = int(value, 0)
+        except ValueError:
+            raise ValueError(f"Bad company ID {value!r}: expected a number such as 0x004C") from None
+        if not 0 <= company_id <= 0xFFFF:
+            raise ValueError(f"Bad company ID {value!r}: expected 0 to 0xFFFF")
+        table[company_id] = f"0x{company_id:04X}"
+    return table
+
+
+def _prefix_table(values):
+    """Return ((length, {prefix: prefix}), ...), longest prefixes first."""
+    by_length = collections.defaultdict(dict)
+    for value in values:
+        prefix = value.strip().upper().replace('-', ':')
+        by_length[len(prefix)][prefix] = prefix
+    return tuple(sorted(by_length.items(), reverse=True))
+
+
+def _match_prefix(table, address):
+    for length, prefixes in table:
+        prefix = prefixes.get(address[:length])
+        if prefix is not None:
+            return prefix
+    return None
+
+
+class AdvertisementFilter:
+    """Accept or reject raw advertisements by allow and deny rules."""
+
+    def __init__(self, allow_uuids=(), deny_uuids=(), allow_namespaces=(), deny_namespaces=(),
+                 allow_mac_prefixes=(), deny_mac_prefixes=(), allow_company_ids=(), deny_company_ids=(),
+                 min_rssi=None):
+        self.allow_uuids = _hex_table(allow_uuids, 16, 'UUID')
+        self.deny_uuids = _hex_table(deny_uuids, 16, 'UUID')
+        self.allow_namespaces = _hex_table(allow_namespaces, 10, 'namespace')
+        self.deny_namespaces = _hex_table(deny_namespaces, 10, 'namespace')
+        self.allow_mac_prefixes = _prefix_table(allow_mac_prefixes)
+        self.deny_mac_prefixes = _prefix_table(deny_mac_prefixes)
+        self.allow_company_ids = _company_table(allow_company_ids)
+        self.deny_company_ids = _company_table(deny_company_ids)
+        self.min_rssi = min_rssi
+
+        # Only extract what some rule looks at
+        self._uuids = bool(self.allow_uuids or self.deny_uuids)
+        self._namespaces = bool(self.allow_namespaces or self.deny_namespaces)
+        self._allowing = bool(self.allow_uuids or self.allow_namespaces or self.allow_mac_prefixes
+                              or self.allow_company_ids)
+
+        self.stats = {'accepted': 0, 'rejected': 0}
+        # (rule list, value) -> advertisements the rule matched; ('min_rssi', threshold) and
+        # ('allow', 'none matched') count the other rejections
+        self.hits = collections.Counter()
+
+    def rules(self):
+        """Return the number of rules configured."""
+        count = int(self.min_rssi is not None)
+        for name in RULE_LISTS:
+            table = getattr(self, name)
+            if name.endswith('_prefixes'):
+                count += sum(len(prefixes) for _, prefixes in table)
+            else:
+                count += len(table)
+        return count
+
+    def _identities(self, manufacturer_data, service_data):
+        """Return the raw UUIDs and namespaces the rules look at."""
+        uuids = []
+        namespaces = []
+        if self._uuids:
+            for data in manufacturer_data.values():
+                if len(data) >= 18 and data[:2] in (IBEACON_PREFIX, ALTBEACON_CODE):
+                    uuids.append(bytes(data[2:18]))
+        if self._namespaces and service_data:
+            data = service_data.get(EDDYSTONE_SERVICE_UUID)
+            if data is not None and len(data) >= 12 and data[0] == EDDYSTONE_UID_FRAME:
+                namespaces.append(bytes(data[2:12]))
+        return uuids, namespaces
+
+    def _reject(self, rule, value):
+        self.hits[(rule, value)] += 1
+        self.stats['rejected'] += 1
+        return False
+
+    def accept(self, address, manufacturer_data, service_data, rssi):
+        """Return True if an advertisement passes the rules."""
+        if self.min_rssi is not None and rssi is not None and rssi < self.min_rssi:
+            return self._reject('min_rssi', self.min_rssi)
+
+        if self.deny_mac_prefixes or self.allow_mac_prefixes:
+            address = address.upper()
+        if self.deny_mac_prefixes:
+            prefix = _match_prefix(self.deny_mac_prefixes, address)
+            if prefix is not None:
+                return self._reject('deny_mac_prefixes', prefix)
+        if self.deny_company_ids:
+            for company_id in manufacturer_data:
+                label = self.deny_company_ids.get(company_id)
+                if label is not None:
+                    return self._reject('deny_company_ids', label)
+
+        uuids = namespaces = ()
+        if self._uuids or self._namespaces:
+            uuids, namespaces = self._identities(manufacturer_data, service_data)
+            for uuid in uuids:
+                label = self.deny_uuids.get(uuid)
+                if label is not None:
+                    return self._reject('deny_uuids', label)
+            for namespace in namespaces:
+                label = self.deny_namespaces.get(namespace)
+                if label is not None:
+                    return self._reject('deny_namespaces', label)
+
+        if self._allowing:
+            match = self._allowed(address, manufacturer_data, uuids, namespaces)
+            if match is None:
+                return self._reject('allow', 'none matched')
+            self.hits[match] += 1
+
+        self.stats['accepted'] += 1
+        return True
+
+    def _allowed(self, address, manufacturer_data, uuids, namespaces):
+        """Return the first allow rule the advertisement matches, or None."""
+        for uuid in uuids:
+            label = self.allow_uuids.get(uuid)
+            if label is not None:
+                return ('allow_uuids', label)
+        for namespace in namespaces:
+            label = self.allow_namespaces.get(namespace)
+            if label is not None:
+                return ('allow_namespaces', label)
+        if self.allow_company_ids:
+            for company_id in manufacturer_data:
+                label = self.allow_company_ids.get(company_id)
+                if label is not None:
+                    return ('allow_company_ids', label)
+        if self.allow_mac_prefixes:
+            prefix = _match_prefix(self.allow_mac_prefixes, address)
+            if prefix is not None:
+                return ('allow_mac_prefixes', prefix)
+        return None
+
+
+def parse_filter(section):
+    """Create an AdvertisementFilter from a [filter] section. Raises ValueError for bad rules."""
+    rules = {name: split_values(section.get(name, '')) for name in RULE_LISTS}
+    min_rssi = section.get('min_rssi', '').strip()
+    try:
+        rules['min_rssi'] = int(min_rssi) if min_rssi else None
+    except ValueError:
+        raise ValueError(f"Bad min_rssi {min_rssi!r}: expected an integer such as -90") from None
+    return AdvertisementFilter(**rules)
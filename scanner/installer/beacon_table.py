@@ -0,0 +1,169 @@
+"""
+Keyed model and virtual list control for the launcher's beacon table.
+
+BeaconTableModel keeps one entry per beacon in a dict, plus the visible rows (the
+entries that pass the filter, in sort order) and a key-to-row index, so applying a
+reading to an existing beacon is a dict lookup and never a scan over the rows.
+BeaconListCtrl is a wx.LC_VIRTUAL list that asks the model for the text of the rows
+that are actually on screen.
+
+Readings change the sort column values (RSSI, last seen) all the time; rather than
+re-sorting on every reading, the model marks itself stale and is re-sorted at most
+once per refresh by the frame.
+"""
+
+import wx
+
+from decoders import KEY_FIELDS
+
+# (entry field, heading, width)
+COLUMNS = (
+    ('type', "Type", 100),
+    ('id', "UUID / ID", 300),
+    ('major', "Major", 80),
+    ('minor', "Minor", 80),
+    ('rssi', "RSSI", 80),
+    ('last_seen', "Last Seen", 150),
+)
+
+
+def beacon_table_key(beacon_type, beacon_data):
+    """Return the key identifying the beacon a reading came from."""
+    fields = KEY_FIELDS.get(beacon_type, ('address',))
+    return "_".join([beacon_type] + [str(beacon_data.get(field, 'unknown')) for field in fields])
+
+
+def beacon_id(beacon_type, beacon_data):
+    """Return the identifier shown in the UUID / ID column."""
+    if beacon_type == "iBeacon":
+        return str(beacon_data['uuid'])
+    fields = KEY_FIELDS.get(beacon_type, ('address',))
+    return "/".join(str(beacon_data.get(field, 'unknown')) for field in fields)
+
+
+def _sort_value(value):
+    """Sort numbers numerically and everything else as text, numbers first."""
+    if isinstance(value, (int, float)):
+        return (0, value, "")
+    return (1, 0, str(value))
+
+
+class BeaconTableModel:
+    """Beacon entries keyed by beacon, with a filtered and sorted view of row keys."""
+
+    def __init__(self):
+        # key -> entry dict (type, id, uuid, major, minor, rssi, last_seen)
+        self.entries = {}
+        # Keys of the visible rows, in display order, and key -> row
+        self.rows = []
+        self._row_of = {}
+
+        self.sort_column = None
+        self.sort_ascending = True
+        self.filter_text = ""
+        # True when readings may have changed the order of the visible rows
+        self.stale = False
+        # Keys of the entries added since the last drain_added(), visible or not
+        self.added = []
+
+    def update(self, beacon_type, beacon_data, last_seen):
+        """Apply a reading. Returns (row, inserted); row is None if the beacon is filtered out.
+
+        `inserted` is True when the reading added a visible row, either for a new beacon or
+        for a known one whose new values now match the filter.
+        """
+        key = beacon_table_key(beacon_type, beacon_data)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = {'type': beacon_type, 'id': beacon_id(beacon_type, beacon_data)}
+            if beacon_type == "iBeacon":
+                entry.update({
+                    'uuid': beacon_data['uuid'],
+                    'major': beacon_data['major'],
+                    'minor': beacon_data['minor']
+                })
+            self.entries[key] = entry
+            self.added.append(key)
+        entry['rssi'] = beacon_data.get('rssi', 'N/A')
+        entry['last_seen'] = last_seen
+
+        row = self._row_of.get(key)
+        inserted = row is None
+        if inserted:
+            if not self._matches(entry):
+                return None, False
+            # New rows go to the end until the next re-sort
+            row = len(self.rows)
+            self.rows.append(key)
+            self._row_of[key] = row
+        if self.sort_column is not None:
+            self.stale = True
+        return row, inserted
+
+    def drain_added(self):
+        """Return and forget the keys of the entries added since the last call."""
+        added, self.added = self.added, []
+        return added
+
+    def cell(self, row, column):
+        """Return the text for a visible row and column."""
+        entry = self.entries[self.rows[row]]
+        return str(entry.get(COLUMNS[column][0], "N/A"))
+
+    def set_sort(self, column, ascending=True):
+        self.sort_column = column
+        self.sort_ascending = ascending
+        self.refresh_view()
+
+    def set_filter(self, text):
+        self.filter_text = text.strip().lower()
+        self.refresh_view()
+
+    def refresh_view(self):
+        """Rebuild the visible rows from the filter and sort settings."""
+        keys = [key for key, entry in self.entries.items() if self._matches(entry)]
+        if self.sort_column is not None:
+            field = COLUMNS[self.sort_column][0]
+            entries = self.entries
+            keys.sort(key=lambda key: _sort_value(entries[key].get(field, "")), reverse=not self.sort_ascending)
+        self.rows = keys
+        self._row_of = {key: row for row, key in enumerate(keys)}
+        self.stale = False
+
+    def _matches(self, entry):
+        if not self.filter_text:
+            return True
+        text = self.filter_text
+        return any(text in str(entry.get(field, "")).lower() for field, _, _ in COLUMNS)
+
+
+class BeaconListCtrl(wx.ListCtrl):
+    """Virtual report list that renders rows from a BeaconTableModel."""
+
+    def __init__(self, parent, model):
+        super(BeaconListCtrl, self).__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL)
+        self.model = model
+        for column, (_, heading, width) in enumerate(COLUMNS):
+            self.InsertColumn(column, heading, width=width)
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.on_column_click)
+
+    def OnGetItemText(self, item, column):
+        return self.model.cell(item, column)
+
+    def sync(self):
+        """Redraw after the model's rows were rebuilt (sort or filter)."""
+        self.SetItemCount(len(self.model.rows))
+        self.Refresh()
+
+    def rows_changed(self, rows, inserted):
+        """Redraw the rows touched by a batch of update() calls."""
+        if inserted:
+            self.SetItemCount(len(self.model.rows))
+        self.RefreshItems(min(rows), max(rows))
+
+    def on_column_click(self, event):
+        """Sort by the clicked column; clicking it again reverses the order."""
+        column = event.GetColumn()
+        ascending = not (self.model.sort_column == column and self.model.sort_ascending)
+        self.model.set_sort(column, ascending)
+        self.sync()
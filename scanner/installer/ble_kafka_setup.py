@@ -8,7 +8,25 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 APP = ['launcher.py']
 DATA_FILES = [
     ('', ['../requirements.txt']),
-    ('', ['../scan.py'])  # Changed to include scan.py in the root resources directory
+    ('', ['../scan.py']),  # Changed to include scan.py in the root resources directory
+    ('', ['../publisher.py']),
+    ('', ['../decoders.py']),
+    ('', ['../wire_format.py']),
+    ('', ['../coalescer.py']),
+    ('', ['../logging_config.py']),
+    ('', ['../spool.py']),
+    ('', ['../capture.py']),
+    ('', ['../batching.py']),
+    ('', ['../smoothing.py']),
+    ('', ['../distance.py']),
+    ('', ['../adapters.py']),
+    ('', ['../engine.py']),
+    ('', ['../config_watch.py']),
+    ('', ['../metrics.py']),
+    ('', ['../routing.py']),
+    ('', ['../filters.py']),
+    ('', ['../columnar.py']),
+    ('', ['../archive.py'])
 ]
 
 OPTIONS = {
@@ -33,7 +51,8 @@ OPTIONS = {
     'packages': [
         'bleak', 
         'asyncio', 
-        'kafka'
+        'kafka',
+        'numpy'
     ],
     'includes': [
         'json',
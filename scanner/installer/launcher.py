@@ -12,12 +12,38 @@ import platform
 import time
 import logging
 import threading
+import multiprocessing
 import queue
 import wx
 import wx.lib.scrolledpanel as scrolled
 from datetime import datetime
 import configparser
+
+def setup_paths():
+    """Set up the Python path to find modules correctly in both bundled and development modes."""
+    # Get the directory of the current script
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    # Add the parent directory to the path to find the scan module
+    parent_dir = os.path.dirname(current_dir)
+    if parent_dir not in sys.path:
+        sys.path.insert(0, parent_dir)
+    
+    # If we're in a bundled app, we need to adjust paths
+    if getattr(sys, 'frozen', False):
+        # Running in a bundle
+        bundle_dir = os.path.dirname(sys.executable)
+        if bundle_dir not in sys.path:
+            sys.path.insert(0, bundle_dir)
+    
+    print(f"Python path: {sys.path}")
+
+# Set up paths before importing any modules
+setup_paths()
+
 from rssi_display_frame import RSSIDisplayFrame
+from beacon_table import BeaconTableModel, BeaconListCtrl
+from update_channel import BeaconUpdateChannel
 
 # Set up logging to a file in the user's Documents folder
 log_dir = os.path.expanduser("~/Documents/BLE_Kafka_Scanner_Logs")
@@ -45,28 +71,12 @@ logger.addHandler(file_handler)
 # Create a queue for thread-safe logging to the GUI
 log_queue = queue.Queue()
 
+# How often beacon updates from the scanner are applied to the GUI
+GUI_REFRESH_HZ = 20
+
 print(f"BLE Kafka Scanner started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 print(f"Log file: {log_file}")
 
-def setup_paths():
-    """Set up the Python path to find modules correctly in both bundled and development modes."""
-    # Get the directory of the current script
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Add the parent directory to the path to find the scan module
-    parent_dir = os.path.dirname(current_dir)
-    if parent_dir not in sys.path:
-        sys.path.insert(0, parent_dir)
-    
-    # If we're in a bundled app, we need to adjust paths
-    if getattr(sys, 'frozen', False):
-        # Running in a bundle
-        bundle_dir = os.path.dirname(sys.executable)
-        if bundle_dir not in sys.path:
-            sys.path.insert(0, bundle_dir)
-    
-    print(f"Python path: {sys.path}")
-
 def check_permissions():
     """Check and request necessary permissions for BLE scanning."""
     if platform.system() == "Darwin":  # macOS
@@ -219,8 +229,14 @@ class BLEScannerFrame(wx.Frame):
         super(BLEScannerFrame, self).__init__(parent, title=title, size=(876, 600))
         
         self.scanner_thread = None
+        # Scanner engine process; None when the scanner runs in scanner_thread instead
+        self.engine = None
         self.scanning = False
-        self.beacon_data = {}
+        # Beacons keyed by beacon; beacon_data is the model's entry dict, shared with the RSSI display
+        self.beacon_model = BeaconTableModel()
+        self.beacon_data = self.beacon_model.entries
+        # Latest reading per beacon from the scanner thread, applied on the refresh timer
+        self.beacon_updates = BeaconUpdateChannel()
         self.rssi_display = None
         
         # Create menu bar
@@ -297,14 +313,14 @@ class BLEScannerFrame(wx.Frame):
         self.beacon_panel = wx.Panel(self.notebook)
         beacon_sizer = wx.BoxSizer(wx.VERTICAL)
         
-        # Add list control for beacons
-        self.beacon_list = wx.ListCtrl(self.beacon_panel, style=wx.LC_REPORT)
-        self.beacon_list.InsertColumn(0, "Type", width=100)
-        self.beacon_list.InsertColumn(1, "UUID", width=300)
-        self.beacon_list.InsertColumn(2, "Major", width=80)
-        self.beacon_list.InsertColumn(3, "Minor", width=80)
-        self.beacon_list.InsertColumn(4, "RSSI", width=80)
-        self.beacon_list.InsertColumn(5, "Last Seen", width=150)
+        # Add filter box for beacons
+        self.beacon_filter = wx.SearchCtrl(self.beacon_panel)
+        self.beacon_filter.SetDescriptiveText("Filter beacons")
+        self.beacon_filter.Bind(wx.EVT_TEXT, self.on_filter_beacons)
+        beacon_sizer.Add(self.beacon_filter, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, 5)
+        
+        # Add virtual list control for beacons; click a column heading to sort
+        self.beacon_list = BeaconListCtrl(self.beacon_panel, self.beacon_model)
         beacon_sizer.Add(self.beacon_list, 1, wx.EXPAND | wx.ALL, 5)
         self.beacon_panel.SetSizer(beacon_sizer)
         
@@ -324,6 +340,16 @@ class BLEScannerFrame(wx.Frame):
         self.Bind(wx.EVT_TIMER, self.process_log_queue, self.timer)
         self.timer.Start(100)  # Check queue every 100ms
         
+        # Set up a timer for applying beacon updates at a fixed frame rate
+        self.refresh_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_refresh_timer, self.refresh_timer)
+        self.refresh_timer.Start(1000 // GUI_REFRESH_HZ)
+        
+        # Set up a timer for re-sorting the beacon list as readings change the order
+        self.sort_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_sort_timer, self.sort_timer)
+        self.sort_timer.Start(1000)
+        
         # Bind the close event
         self.Bind(wx.EVT_CLOSE, self.on_closing)
         
@@ -355,12 +381,23 @@ class BLEScannerFrame(wx.Frame):
                 import scan
                 scan.reload_config()
                 print("Configuration reloaded")
+                print(f"Scanner log: {os.path.expanduser(scan.config['logging']['file'])}")
             except Exception as e:
                 print(f"Error reloading configuration: {e}")
                 import traceback
                 traceback.print_exc()
             
-            # Start the scanner in a separate thread
+            # Run the scanner in its own process, streaming readings back over shared memory
+            try:
+                from engine import ScannerEngine
+                self.engine = ScannerEngine()
+                self.engine.start()
+                return
+            except Exception as e:
+                print(f"Could not start the scanner process ({e}), scanning in-process")
+                self.engine = None
+            
+            # Fall back to running the scanner in a separate thread
             self.scanner_thread = threading.Thread(target=self.run_scanner)
             self.scanner_thread.daemon = True
             self.scanner_thread.start()
@@ -372,8 +409,11 @@ class BLEScannerFrame(wx.Frame):
             print("Stopping scanner...")
             self.status.SetLabel("Stopping...")
             
-            # Call the stop_scanning function in the scan module
+            # Ask the engine process, or the scan module in the scanner thread, to stop
             try:
+                if self.engine is not None:
+                    self.engine.stop()
+                    return
                 import scan
                 scan.stop_scanning()
             except Exception as e:
@@ -381,7 +421,7 @@ class BLEScannerFrame(wx.Frame):
                 import traceback
                 traceback.print_exc()
             
-            # The scanner thread will detect self.scanning is False and exit
+            # The scanner will detect the stop request and exit
     
     def run_scanner(self):
         """Run the BLE scanner in a separate thread."""
@@ -391,8 +431,8 @@ class BLEScannerFrame(wx.Frame):
             
             # Define the beacon callback function
             def beacon_callback(beacon_type, beacon_data):
-                """Callback function for beacon updates."""
-                wx.CallAfter(self.update_beacon, beacon_type, beacon_data)
+                """Callback function for beacon updates; the GUI picks them up on its refresh timer."""
+                self.beacon_updates.put(beacon_type, beacon_data)
             
             # Set the callback in the scan module
             scan.set_gui_callback(beacon_callback)
@@ -434,70 +474,53 @@ class BLEScannerFrame(wx.Frame):
         self.status.SetLabel("Ready")
         print("Scanner stopped")
     
-    def update_beacon(self, beacon_type, beacon_data):
-        """Update the beacon list with new data."""
-        # Create a unique key for this beacon
-        if beacon_type == "iBeacon":
-            key = f"{beacon_type}_{beacon_data['uuid']}_{beacon_data['major']}_{beacon_data['minor']}"
-        else:
-            key = f"{beacon_type}_{beacon_data.get('id', 'unknown')}"
-        
-        # Store the beacon data for the RSSI display
-        current_time = datetime.now().strftime("%H:%M:%S")
-        if key not in self.beacon_data:
-            self.beacon_data[key] = {
-                'type': beacon_type,
-                'last_seen': current_time,
-                'rssi': beacon_data.get('rssi', 'N/A')
-            }
-            if beacon_type == "iBeacon":
-                self.beacon_data[key].update({
-                    'uuid': beacon_data['uuid'],
-                    'major': beacon_data['major'],
-                    'minor': beacon_data['minor']
-                })
-            else:
-                self.beacon_data[key]['id'] = beacon_data.get('id', 'unknown')
-        else:
-            self.beacon_data[key]['last_seen'] = current_time
-            self.beacon_data[key]['rssi'] = beacon_data.get('rssi', 'N/A')
-        
-        # Update the RSSI display if it's open
-        if self.rssi_display and self.rssi_display.IsShown():
-            wx.CallAfter(self.rssi_display.update_device_list, self.beacon_data)
-        
-        # Check if this beacon is already in our list
-        found = False
-        for i in range(self.beacon_list.GetItemCount()):
-            if self.beacon_list.GetItemData(i) == hash(key):
-                found = True
-                # Update the existing item
-                if beacon_type == "iBeacon":
-                    self.beacon_list.SetItem(i, 3, str(beacon_data['minor']))
-                    self.beacon_list.SetItem(i, 4, str(beacon_data['rssi']))
-                    self.beacon_list.SetItem(i, 5, current_time)
-                else:
-                    self.beacon_list.SetItem(i, 4, str(beacon_data.get('rssi', 'N/A')))
-                    self.beacon_list.SetItem(i, 5, current_time)
-                break
-        
-        # If not found, add a new item
-        if not found:
-            index = self.beacon_list.InsertItem(self.beacon_list.GetItemCount(), beacon_type)
-            
-            if beacon_type == "iBeacon":
-                self.beacon_list.SetItem(index, 1, str(beacon_data['uuid']))
-                self.beacon_list.SetItem(index, 2, str(beacon_data['major']))
-                self.beacon_list.SetItem(index, 3, str(beacon_data['minor']))
-                self.beacon_list.SetItem(index, 4, str(beacon_data['rssi']))
-            else:
-                self.beacon_list.SetItem(index, 1, str(beacon_data.get('id', 'unknown')))
-                self.beacon_list.SetItem(index, 2, "N/A")
-                self.beacon_list.SetItem(index, 3, "N/A")
-                self.beacon_list.SetItem(index, 4, str(beacon_data.get('rssi', 'N/A')))
-            
-            self.beacon_list.SetItem(index, 5, current_time)
-            self.beacon_list.SetItemData(index, hash(key))
+    def on_refresh_timer(self, event):
+        """Apply the beacon updates received since the last tick."""
+        engine = self.engine
+        updates = engine.drain() if engine is not None else self.beacon_updates.drain()
+        if updates:
+            self.update_beacons(updates)
+        
+        # The engine process exits once it has stopped scanning (or if it failed)
+        if engine is not None and not engine.running():
+            self.update_beacons(engine.drain())
+            engine.close()
+            self.engine = None
+            self.scanner_stopped()
+    
+    def update_beacons(self, updates):
+        """Update the beacon list with a batch of (beacon_type, beacon_data, received time) readings."""
+        if not updates:
+            return
+        rows = []
+        inserted = False
+        for beacon_type, beacon_data, received in updates:
+            last_seen = datetime.fromtimestamp(received).strftime("%H:%M:%S")
+            row, is_new = self.beacon_model.update(beacon_type, beacon_data, last_seen)
+            if row is not None:
+                rows.append(row)
+                inserted = inserted or is_new
+        
+        # One redraw per tick, covering only the affected rows
+        if rows:
+            self.beacon_list.rows_changed(rows, inserted)
+        
+        # The device selector only changes when new beacons appear; a hidden display
+        # catches up with a full update when it is shown again
+        added = self.beacon_model.drain_added()
+        if added and self.rssi_display and self.rssi_display.IsShown():
+            self.rssi_display.update_device_list(self.beacon_data, added)
+    
+    def on_filter_beacons(self, event):
+        """Show only beacons with a column containing the filter text."""
+        self.beacon_model.set_filter(self.beacon_filter.GetValue())
+        self.beacon_list.sync()
+    
+    def on_sort_timer(self, event):
+        """Re-sort the beacon list if readings have changed the order since the last tick."""
+        if self.beacon_model.stale:
+            self.beacon_model.refresh_view()
+            self.beacon_list.sync()
     
     def on_clear_log(self, event):
         """Clear the log text control."""
@@ -524,10 +547,16 @@ class BLEScannerFrame(wx.Frame):
         if self.scanning:
             print("Stopping scanner before exit...")
             self.scanning = False
+            if self.engine is not None:
+                self.engine.close()
+                self.engine = None
             # Wait a bit for the scanner to stop
             wx.CallLater(500, self.on_closing, event)
             return
         
+        self.refresh_timer.Stop()
+        self.sort_timer.Stop()
+        
         # Close the RSSI display if it's open
         if self.rssi_display is not None:
             # Stop the timer in the RSSI display
@@ -555,8 +584,8 @@ class BLEScannerFrame(wx.Frame):
 
 def main():
     """Main function to run the BLE scanner GUI."""
-    # Set up paths before importing any modules
-    setup_paths()
+    # The scanner engine process is started with multiprocessing, which needs this in a bundled app
+    multiprocessing.freeze_support()
     
     # Create the GUI
     app = BLEScannerApp()
@@ -59,6 +59,10 @@ class RSSIDisplayFrame(wx.Frame):
         self.selected_key = None
         self.current_rssi = None  # Track current RSSI value
         
+        # Device selector state: beacon key -> choice index, and cached display names
+        self.device_index = {}
+        self.device_names = {}
+        
         # For smooth color transitions
         self.target_color = wx.Colour(0, 0, 0)  # Target color to transition to
         self.current_color = wx.Colour(0, 0, 0)  # Current displayed color
@@ -338,12 +342,7 @@ class RSSIDisplayFrame(wx.Frame):
             rssi_value = str(data.get('rssi', 'N/A'))
             last_seen_value = data.get('last_seen', 'N/A')
             
-            # Create device display name
-            device_name = f"{data['type']} - "
-            if data['type'] == "iBeacon":
-                device_name += f"{data['uuid'][-8:]} ({data['major']}/{data['minor']})"
-            else:
-                device_name += f"{data.get('id', 'unknown')}"
+            device_name = self.get_display_name(self.selected_key, data)
             
             # Update both normal and fullscreen displays
             self.rssi_value.SetLabel(rssi_value)
@@ -507,28 +506,48 @@ class RSSIDisplayFrame(wx.Frame):
             self.selected_key = self.device_choice.GetClientData(selection)
             self.update_display(None)
     
-    def update_device_list(self, beacon_data):
-        """Update the device choice control with current beacons."""
-        current_selection = self.device_choice.GetSelection()
-        selected_key = None
-        if current_selection != wx.NOT_FOUND:
-            selected_key = self.device_choice.GetClientData(current_selection)
-        
-        self.device_choice.Clear()
-        
-        for key, data in beacon_data.items():
-            display_name = f"{data['type']} - "
+    def get_display_name(self, key, data):
+        """Return the display name of a beacon, formatting it only the first time."""
+        name = self.device_names.get(key)
+        if name is None:
+            name = f"{data['type']} - "
             if data['type'] == "iBeacon":
-                display_name += f"{data['uuid'][-8:]} ({data['major']}/{data['minor']})"
+                name += f"{data['uuid'][-8:]} ({data['major']}/{data['minor']})"
             else:
-                display_name += f"{data.get('id', 'unknown')}"
-            
-            index = self.device_choice.Append(display_name, key)
-            
-            if key == selected_key:
-                self.device_choice.SetSelection(index)
-                self.selected_key = key 
-
+                name += f"{data.get('id', 'unknown')}"
+            self.device_names[key] = name
+        return name
+    
+    def update_device_list(self, beacon_data, added=None):
+        """Bring the device choice control up to date with beacon_data.
+        
+        With `added`, only those new beacons are appended. Otherwise removals and inserts
+        are found by comparing the control with all of beacon_data.
+        """
+        # Remove beacons that are gone, from the highest index down so lower indices stay valid
+        removed = [key for key in self.device_index if key not in beacon_data] if added is None else ()
+        if removed:
+            for index in sorted((self.device_index.pop(key) for key in removed), reverse=True):
+                self.device_choice.Delete(index)
+            for key in removed:
+                self.device_names.pop(key, None)
+            self.device_index = {self.device_choice.GetClientData(i): i
+                                 for i in range(self.device_choice.GetCount())}
+            if self.selected_key in self.device_index:
+                self.device_choice.SetSelection(self.device_index[self.selected_key])
+            elif self.selected_key is not None:
+                # The plotted beacon is gone; show nothing until another one is picked
+                self.selected_key = None
+                self.current_rssi = None
+                self.device_choice.SetSelection(wx.NOT_FOUND)
+                self.update_display(None)
+                self.update_background_color()
+        
+        # Append new beacons; existing entries and the selection are left untouched
+        for key in beacon_data if added is None else added:
+            if key not in self.device_index and key in beacon_data:
+                self.device_index[key] = self.device_choice.Append(self.get_display_name(key, beacon_data[key]), key)
+    
     def on_maximize(self, event):
         """Handle macOS maximize event."""
         self.adjust_font_size()
@@ -0,0 +1,43 @@
+"""
+Coalescing channel for beacon updates from the scanner thread to the GUI.
+
+The scanner thread calls put() for every reading, which only stores the reading as
+the latest state of its beacon under a lock. The GUI drains the channel on a fixed
+refresh timer and applies everything received since the previous tick in one batch,
+so the number of wx events and redraws depends on the refresh rate and the number
+of beacons, not on the advertisement rate.
+"""
+
+import threading
+import time
+
+from beacon_table import beacon_table_key
+
+
+class BeaconUpdateChannel:
+    """Latest reading per beacon, written by the scanner thread and drained by the GUI."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (beacon_type, beacon_data, epoch seconds received)
+        self._latest = {}
+        self.stats = {'received': 0, 'coalesced': 0, 'drained': 0}
+
+    def put(self, beacon_type, beacon_data):
+        """Record a reading, replacing any not yet drained reading of the same beacon."""
+        key = beacon_table_key(beacon_type, beacon_data)
+        update = (beacon_type, beacon_data, time.time())
+        with self._lock:
+            if key in self._latest:
+                self.stats['coalesced'] += 1
+            self._latest[key] = update
+            self.stats['received'] += 1
+
+    def drain(self):
+        """Return the readings received since the last drain, one per beacon."""
+        with self._lock:
+            if not self._latest:
+                return []
+            latest, self._latest = self._latest, {}
+        self.stats['drained'] += len(latest)
+        return list(latest.values())
@@ -0,0 +1,130 @@
+"""
+Logging for the BLE scanner.
+
+Each part of the scanner logs to its own subsystem logger under "ble" (ble.scan,
+ble.publisher, ...), so levels can be set per subsystem. Records are written as JSON
+lines to a rotating file; nothing is written to stdout, so scanner logging never
+goes through the launcher's GUI log window.
+
+Hot paths log with lazy %-style arguments, and guard anything that is expensive to
+compute with log.isEnabledFor(logging.DEBUG), so disabled debug output costs only
+a cached level check. Debug records can additionally be rate limited per call site.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import time
+
+ROOT_LOGGER = 'ble'
+
+SUBSYSTEMS = ('scan', 'publisher', 'config', 'positioning', 'rollups', 'archive', 'engine', 'metrics')
+
+# Attributes every LogRecord has; anything else was passed with extra= and is structured data
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_handler = None
+
+
+def get_logger(subsystem):
+    """Return the logger for a scanner subsystem."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects, including fields passed with extra=."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most `rate` DEBUG records per second from each call site.
+
+    Records at INFO and above are never limited. The next record let through from a
+    call site that had records suppressed carries a `suppressed` count.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        # (logger name, line number) -> [window start, records in window, suppressed]
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate <= 0:
+            return True
+        site = self._sites.get((record.name, record.lineno))
+        now = time.monotonic()
+        if site is None:
+            self._sites[(record.name, record.lineno)] = [now, 1, 0]
+            return True
+        if now - site[0] >= 1.0:
+            site[0] = now
+            site[1] = 0
+        if site[1] >= self.rate:
+            site[2] += 1
+            return False
+        site[1] += 1
+        if site[2]:
+            record.suppressed = site[2]
+            site[2] = 0
+        return True
+
+
+def configure_logging(config):
+    """Configure the scanner loggers from the [logging] section of the configuration."""
+    global _handler
+
+    log_config = config['logging']
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(_parse_level(log_config.get('level', 'INFO')))
+    # Keep scanner records out of handlers installed by the launcher
+    root.propagate = False
+
+    for subsystem in SUBSYSTEMS:
+        level = log_config.get(f"level.{subsystem}")
+        get_logger(subsystem).setLevel(_parse_level(level) if level else logging.NOTSET)
+
+    log_file = os.path.expanduser(log_config.get('file', '~/.ble/logs/scanner.log'))
+    max_bytes = log_config.getint('max_bytes', 5 * 1024 * 1024)
+    backup_count = log_config.getint('backup_count', 5)
+    if _handler is not None:
+        # Keep the open file unless the path or a rotation setting changed
+        if (getattr(_handler, 'baseFilename', None) == os.path.abspath(log_file)
+                and _handler.maxBytes == max_bytes and _handler.backupCount == backup_count):
+            _handler.filters.clear()
+            _handler.addFilter(RateLimitFilter(log_config.getint('debug_rate', 20)))
+            return
+        root.removeHandler(_handler)
+        _handler.close()
+
+    try:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        _handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    except OSError as e:
+        # Fall back to the last-resort stderr handler for warnings and errors
+        logging.getLogger(ROOT_LOGGER).warning("Cannot open log file %s: %s", log_file, e)
+        _handler = None
+        return
+    _handler.setFormatter(JsonFormatter())
+    _handler.addFilter(RateLimitFilter(log_config.getint('debug_rate', 20)))
+    root.addHandler(_handler)
+
+
+def _parse_level(name):
+    """Convert a level name from the configuration to a logging level."""
+    level = logging.getLevelName(str(name).strip().upper())
+    return level if isinstance(level, int) else logging.INFO
@@ -0,0 +1,208 @@
+"""
+Counters, gauges and latency histograms for the scanner, served over local HTTP in the
+Prometheus text exposition format.
+
+Hot paths update Counter and Histogram objects directly; an update is a dict or list
+increment, cheap enough for every advertisement. Values the pipeline already counts
+in its `stats` dicts are not counted twice: they are registered as callbacks that are
+read when the endpoint is scraped.
+
+Each metric is updated from one thread (the scan loop, the publisher's delivery
+thread or the producer's I/O thread), so updates take no locks. Scrapes run on the
+server's thread and may see a histogram mid-update, which is off by at most one
+observation.
+
+    registry = MetricsRegistry()
+    beacons = registry.counter('ble_beacons_total', "Beacons decoded", labels=('type',))
+    beacons.inc('iBeacon')
+    server = MetricsServer(registry, port=9475)
+    server.start()      # curl http://127.0.0.1:9475/metrics
+"""
+
+import bisect
+import http.server
+import threading
+
+from logging_config import get_logger
+
+log = get_logger('metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds in seconds
+MICROSECOND_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2)
+MILLISECOND_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # tuple of label values -> count
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        values = self.values
+        values[label_values] = values.get(label_values, 0) + amount
+
+    def samples(self):
+        return [(self.name, _labels(self.labels, key), value) for key, value in list(self.values.items())]
+
+
+class Histogram:
+    """Distribution of observed values (e.g. latencies in seconds) over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=MILLISECOND_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(sorted(buckets))
+        # Per-bucket (not cumulative) counts; the last is for values above every bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), list(self.counts)):
+            cumulative += count
+            samples.append((self.name + '_bucket', f'{{le="{_number(bound)}"}}', cumulative))
+        samples.append((self.name + '_sum', '', self.sum))
+        samples.append((self.name + '_count', '', cumulative))
+        return samples
+
+
+class CallbackMetric:
+    """A counter or gauge whose value is read from a function at scrape time.
+
+    The function returns a number, or a dict of label value tuples to numbers.
+    """
+
+    def __init__(self, name, help, kind, function, labels=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.function = function
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.function()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [(self.name, _labels(self.labels, key), number) for key, number in value.items()]
+        return [(self.name, '', value)]
+
+
+class MetricsRegistry:
+    """The metrics of one process, rendered together for each scrape."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None and type(existing) is type(metric) and not isinstance(metric, CallbackMetric):
+            # Stages rebuilt after a configuration change keep counting in the same metric
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets=MILLISECOND_BUCKETS):
+        return self._register(Histogram(name, help, buckets))
+
+    def gauge_callback(self, name, help, function, labels=()):
+        return self._register(CallbackMetric(name, help, 'gauge', function, labels))
+
+    def counter_callback(self, name, help, function, labels=()):
+        return self._register(CallbackMetric(name, help, 'counter', function, labels))
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception:
+                log.exception("Error collecting metric %s", metric.name)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serve a registry at http://host:port/metrics from a background thread."""
+
+    def __init__(self, registry, host='127.0.0.1', port=9475):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("Metrics request: " + format, *args)
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        # Port 0 picks a free port
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True)
+        self._thread.start()
+        log.info("Serving metrics at http://%s:%d/metrics", self.host, self.port)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
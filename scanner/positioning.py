@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Multi-scanner positioning service.
+
+Consumes the beacon topic, groups readings of each beacon from every scanner host into
+tumbling time windows and, once a window is complete, solves the position of every
+beacon seen by enough scanners in one batched weighted least-squares step.
+
+Per window, the readings of a beacon from one host are averaged (using the smoothed
+RSSI when the scanner publishes it) and converted to a range with the same
+log-distance path-loss model as distance.py. With scanner positions p_i and ranges
+r_i, the position x satisfies
+
+    -2 p_i . x + |x|^2 = r_i^2 - |p_i|^2
+
+which is linear in (x, |x|^2). The systems of all beacons in a window are padded to
+the same number of scanners (padding rows get zero weight) and solved together with
+NumPy, weighting each range by 1 / r_i^2 since range error grows with distance.
+
+Windows close when the watermark (the latest event time seen, minus allowed_lateness_ms)
+passes their end; readings that arrive for an already closed window are counted and
+dropped. Scanner coordinates and service settings come from ~/.ble/positioning.conf:
+
+    [positioning]
+    input_topic = ble_beacons
+    output_topic = ble_positions
+    window_ms = 2000
+
+    [scanners]
+    # host_id = x, y[, z] in metres
+    scanner-lobby = 0.0, 0.0
+    scanner-hall = 12.5, 0.0
+
+    python positioning.py [--config FILE]
+"""
+
+import argparse
+import configparser
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+from decoders import KEY_FIELDS, beacon_key
+from distance import ENVIRONMENTS
+from logging_config import configure_logging, get_logger
+from wire_format import decode_message, message_readings, message_time_ms
+
+log = get_logger('positioning')
+
+DEFAULT_CONFIG_FILE = os.path.expanduser("~/.ble/positioning.conf")
+
+# Ranges are clamped below this before weighting (metres)
+MIN_RANGE = 0.1
+
+
+def load_positioning_config(path=DEFAULT_CONFIG_FILE):
+    """Load the positioning service configuration, with defaults for anything not set."""
+    config = configparser.ConfigParser()
+    # Host IDs are case sensitive
+    config.optionxform = str
+    config['kafka'] = {
+        'broker': 'localhost:9092',
+        'group_id': 'ble-positioning'
+    }
+    config['positioning'] = {
+        'input_topic': 'ble_beacons',
+        'output_topic': 'ble_positions',
+        'window_ms': '2000',
+        'allowed_lateness_ms': '1000',
+        'min_scanners': '3',
+        'dimensions': '2',
+        'environment': 'indoor',
+        'path_loss_exponent': '',
+        'default_tx_power': '-59'
+    }
+    config['scanners'] = {}
+    config['logging'] = {
+        'level': 'INFO',
+        'file': '~/.ble/logs/positioning.log',
+        'max_bytes': '5242880',
+        'backup_count': '5',
+        'debug_rate': '20'
+    }
+    if os.path.exists(path):
+        config.read(path)
+    return config
+
+
+def parse_scanner_positions(section, dimensions=2):
+    """Parse 'host_id = x, y[, z]' entries into a dict of host_id -> coordinate tuple."""
+    positions = {}
+    for host_id, value in section.items():
+        coordinates = [float(part) for part in value.split(',')]
+        if len(coordinates) == 2 and dimensions == 3:
+            coordinates.append(0.0)
+        if len(coordinates) < dimensions:
+            raise ValueError(f"Scanner {host_id} needs {dimensions} coordinates, got '{value}'")
+        positions[host_id] = tuple(coordinates[:dimensions])
+    return positions
+
+
+def solve_positions(anchors, ranges, weights):
+    """Solve a batch of weighted least-squares multilateration problems.
+
+    anchors is (beacons, scanners, dimensions), ranges and weights are (beacons, scanners);
+    rows with zero weight are ignored. Returns (positions, rms residual in metres).
+    """
+    beacons, scanners, dimensions = anchors.shape
+    # Unknowns (x, |x|^2): rows [-2 p_i, 1], right-hand side r_i^2 - |p_i|^2
+    design = np.empty((beacons, scanners, dimensions + 1))
+    design[..., :dimensions] = -2.0 * anchors
+    design[..., dimensions] = 1.0
+    target = ranges ** 2 - np.einsum('bsd,bsd->bs', anchors, anchors)
+
+    weighted = design * weights[..., None]
+    normal = np.einsum('bsi,bsj->bij', weighted, design)
+    rhs = np.einsum('bsi,bs->bi', weighted, target)
+    # pinv rather than solve: collinear scanner layouts give singular systems
+    solution = np.einsum('bij,bj->bi', np.linalg.pinv(normal), rhs)
+    positions = solution[:, :dimensions]
+
+    errors = np.linalg.norm(anchors - positions[:, None, :], axis=2) - ranges
+    residual = np.sqrt(np.einsum('bs,bs->b', weights, errors ** 2) / weights.sum(axis=1))
+    return positions, residual
+
+
+class PositionTracker:
+    """Group readings into windows per beacon and host and solve positions as windows close."""
+
+    def __init__(self, scanners, window_ms=2000, allowed_lateness_ms=1000, min_scanners=3,
+                 path_loss_exponent=ENVIRONMENTS['indoor'], default_tx_power=-59.0):
+        self.scanners = scanners
+        self.host_index = {host_id: i for i, host_id in enumerate(scanners)}
+        self.anchors = np.array(list(scanners.values()), dtype=np.float64)
+        self.dimensions = self.anchors.shape[1] if len(scanners) else 2
+        self.window_ms = window_ms
+        self.allowed_lateness_ms = allowed_lateness_ms
+        self.min_scanners = max(min_scanners, self.dimensions + 1)
+        self.path_loss_exponent = path_loss_exponent
+        self.default_tx_power = default_tx_power
+
+        # window start -> {beacon key: [beacon_data, {host index: [rssi sum, count]}]}
+        self._windows = {}
+        self.watermark = None
+
+        self.stats = {'readings': 0, 'unknown_host': 0, 'late': 0, 'positions': 0, 'unsolved': 0}
+
+    def add(self, message):
+        """Add a decoded beacon message to its window."""
+        host = self.host_index.get(message.get('host_id'))
+        if host is None:
+            self.stats['unknown_host'] += 1
+            return
+        event_ms = message_time_ms(message)
+        window = event_ms - event_ms % self.window_ms
+        if self.watermark is not None and window + self.window_ms <= self.watermark:
+            self.stats['late'] += 1
+            return
+
+        beacons = self._windows.get(window)
+        if beacons is None:
+            beacons = self._windows[window] = {}
+        key = beacon_key(message.get('type'), message)
+        entry = beacons.get(key)
+        if entry is None:
+            entry = beacons[key] = [message, {}]
+        else:
+            entry[0] = message
+        sums = entry[1].get(host)
+        rssi = message.get('rssi_filtered', message.get('rssi', 0))
+        if sums is None:
+            entry[1][host] = [rssi, 1]
+        else:
+            sums[0] += rssi
+            sums[1] += 1
+
+        self.stats['readings'] += 1
+        watermark = event_ms - self.allowed_lateness_ms
+        if self.watermark is None or watermark > self.watermark:
+            self.watermark = watermark
+
+    def close_due(self, flush=False):
+        """Solve and remove every window behind the watermark (all windows with flush)."""
+        results = []
+        for window in sorted(self._windows):
+            if not flush and (self.watermark is None or window + self.window_ms > self.watermark):
+                break
+            results.extend(self._solve_window(window, self._windows.pop(window)))
+        return results
+
+    def _solve_window(self, window, beacons):
+        """Solve the positions of all beacons in one window as a single batch."""
+        entries = [(key, data, hosts) for key, (data, hosts) in beacons.items() if len(hosts) >= self.min_scanners]
+        self.stats['unsolved'] += len(beacons) - len(entries)
+        if not entries:
+            return []
+
+        width = max(len(hosts) for _, _, hosts in entries)
+        count = len(entries)
+        host_ids = np.zeros((count, width), dtype=np.intp)
+        rssi = np.zeros((count, width))
+        tx_power = np.empty(count)
+        used = np.zeros((count, width), dtype=bool)
+        for row, (_, data, hosts) in enumerate(entries):
+            n = len(hosts)
+            host_ids[row, :n] = list(hosts)
+            rssi[row, :n] = [total / samples for total, samples in hosts.values()]
+            used[row, :n] = True
+            tx_power[row] = data.get('tx_power', self.default_tx_power)
+
+        ranges = np.power(10.0, (tx_power[:, None] - rssi) / (10.0 * self.path_loss_exponent))
+        weights = np.where(used, 1.0 / np.maximum(ranges, MIN_RANGE) ** 2, 0.0)
+        positions, residual = solve_positions(self.anchors[host_ids], ranges, weights)
+
+        window_start = datetime.datetime.fromtimestamp(window / 1000).isoformat()
+        window_end = datetime.datetime.fromtimestamp((window + self.window_ms) / 1000).isoformat()
+        results = []
+        for (key, data, hosts), position, error in zip(entries, positions.tolist(), residual.tolist()):
+            result = {'type': data.get('type')}
+            for field in KEY_FIELDS.get(data.get('type'), ('address',)):
+                result[field] = data.get(field)
+            result.update({
+                'position': [round(value, 3) for value in position],
+                'residual_m': round(error, 3),
+                'scanners': len(hosts),
+                'window_start': window_start,
+                'window_end': window_end,
+                'timestamp': window_end,
+            })
+            results.append((key, result))
+        self.stats['positions'] += len(results)
+        return results
+
+
+def create_tracker(config):
+    """Create a PositionTracker from the [positioning] and [scanners] sections."""
+    positioning = config['positioning']
+    dimensions = positioning.getint('dimensions', 2)
+    if dimensions not in (2, 3):
+        raise ValueError(f"dimensions must be 2 or 3, got {dimensions}")
+    exponent = positioning.get('path_loss_exponent', '')
+    if not exponent:
+        environment = positioning.get('environment', 'indoor')
+        if environment not in ENVIRONMENTS:
+            raise ValueError(f"Unknown environment '{environment}', expected one of {tuple(ENVIRONMENTS)}")
+    return PositionTracker(
+        parse_scanner_positions(config['scanners'], dimensions),
+        window_ms=positioning.getint('window_ms', 2000),
+        allowed_lateness_ms=positioning.getint('allowed_lateness_ms', 1000),
+        min_scanners=positioning.getint('min_scanners', 3),
+        path_loss_exponent=float(exponent) if exponent else ENVIRONMENTS[positioning.get('environment', 'indoor')],
+        default_tx_power=positioning.getfloat('default_tx_power', -59.0),
+    )
+
+
+def _key_bytes(key):
+    return '/'.join(str(part) for part in key).encode('utf-8')
+
+
+def run(config):
+    """Consume readings and publish positions until interrupted."""
+    from kafka import KafkaConsumer, KafkaProducer
+
+    tracker = create_tracker(config)
+    if not tracker.scanners:
+        log.error("No scanner positions configured in [scanners]")
+        return 1
+
+    positioning = config['positioning']
+    broker = config['kafka']['broker']
+    output_topic = positioning['output_topic']
+    # Several topics when the scanners route beacon types to topics of their own
+    input_topics = [topic.strip() for topic in positioning['input_topic'].split(',') if topic.strip()]
+    consumer = KafkaConsumer(
+        *input_topics,
+        bootstrap_servers=[broker],
+        group_id=config['kafka']['group_id'],
+        value_deserializer=decode_message,
+    )
+    producer = KafkaProducer(
+        bootstrap_servers=[broker],
+        key_serializer=_key_bytes,
+        value_serializer=lambda value: json.dumps(value).encode('utf-8'),
+        linger_ms=20,
+    )
+    log.info("Positioning %d scanners from %s to %s", len(tracker.scanners),
+             positioning['input_topic'], output_topic)
+
+    try:
+        while True:
+            for records in consumer.poll(timeout_ms=200, max_records=10000).values():
+                for record in records:
+                    try:
+                        for reading in message_readings(record.value):
+                            tracker.add(reading)
+                    except (KeyError, TypeError, ValueError) as e:
+                        log.debug("Skipping unreadable reading: %s", e)
+            for key, position in tracker.close_due():
+                producer.send(output_topic, key=key, value=position)
+    except KeyboardInterrupt:
+        log.info("Positioning service stopping")
+    finally:
+        for key, position in tracker.close_due(flush=True):
+            producer.send(output_topic, key=key, value=position)
+        producer.flush()
+        producer.close()
+        consumer.close()
+        log.info("Positioning service stopped", extra=tracker.stats)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Locate beacons from the readings of several scanners.")
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE, help="configuration file")
+    args = parser.parse_args(argv)
+
+    config = load_positioning_config(args.config)
+    configure_logging(config)
+    try:
+        return run(config)
+    except ValueError as e:
+        print(f"Invalid positioning configuration: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+"""
+Background Kafka publisher for BLE beacon readings.
+
+Readings are put on a bounded in-memory queue by the scan loop and delivered to
+Kafka by a worker thread, so a slow or unreachable broker never stalls scanning.
+
+With a spool attached, nothing is lost while the broker is unreachable: readings
+that cannot be delivered (no producer, failed sends, queue overflow with the spill
+policy) are appended to the spool, and once the broker is back the spool is replayed
+in order and in bulk before live readings are sent again.
+
+A publisher created without a producer creates one with its producer_factory on the
+delivery thread (retrying every retry_interval), so the scan loop can start before
+the broker has been reached.
+
+Messages are keyed by beacon identity (see routing.py) unless keyed is False, so the
+readings of a beacon stay on one partition, in order.
+"""
+
+import collections
+import threading
+import time
+
+from logging_config import get_logger
+from routing import message_key
+
+log = get_logger('publisher')
+
+# What to do with a new reading when the queue is full
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK, OVERFLOW_SPILL)
+
+
+class KafkaPublisher:
+    """Deliver readings to a Kafka topic from a bounded queue on a background thread."""
+
+    def __init__(self, producer, topic, max_queue_size=10000, overflow_policy=OVERFLOW_DROP_OLDEST,
+                 batch_size=500, linger_ms=20, block_timeout=1.0, spool=None, producer_factory=None,
+                 retry_interval=5.0, replay_timeout=30.0, on_delivery=None, metrics=None, keyed=True):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+
+        self.producer = producer
+        self.topic = topic
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000.0
+        self.block_timeout = block_timeout
+        self.on_delivery = on_delivery
+        self.keyed = keyed
+
+        # Store-and-forward
+        self.spool = spool
+        self.producer_factory = producer_factory
+        self.retry_interval = retry_interval
+        self.replay_timeout = replay_timeout
+        self._broker_available = producer is not None
+        self._next_retry = 0.0
+        # Set by reconfigure() to replace the producer on the delivery thread
+        self._reconnect = False
+
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+        # Set by close() when the delivery thread outlives its timeout (e.g. blocked connecting to
+        # the broker); that thread then closes the producer and spool itself when it finishes
+        self._abandoned = False
+        self._worker_done = True
+        # Serializes spool appends from the scan loop, delivery thread, producer I/O thread and
+        # close(); appends after the spool is closed are counted as dropped
+        self._spool_lock = threading.Lock()
+        self._spool_closed = False
+
+        # Latency histograms, when a metrics registry is given: how long producer.send() takes
+        # (it blocks when the producer's buffer is full) and how long the broker takes to acknowledge
+        self.send_latency = None
+        self.ack_latency = None
+        if metrics is not None:
+            from metrics import MICROSECOND_BUCKETS
+            self.send_latency = metrics.histogram(
+                'ble_kafka_send_seconds', "Time taken by producer.send() per message", MICROSECOND_BUCKETS)
+            self.ack_latency = metrics.histogram(
+                'ble_kafka_ack_seconds', "Time from producer.send() to the broker's acknowledgement")
+
+        self.stats = {
+            'queued': 0,
+            'sent': 0,
+            'delivered': 0,
+            'failed': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'replayed': 0,
+        }
+
+    def start(self):
+        """Start the delivery thread."""
+        if self._running:
+            return
+        self._running = True
+        self._worker_done = False
+        self._thread = threading.Thread(target=self._run, name="KafkaPublisher", daemon=True)
+        self._thread.start()
+        log.info("Kafka publisher started (queue=%d, overflow=%s, batch=%d, linger=%dms, spool=%s)",
+                 self.max_queue_size, self.overflow_policy, self.batch_size, self.linger * 1000,
+                 self.spool.directory if self.spool else 'off')
+
+    def publish(self, message):
+        """Queue a message for delivery. Returns False if the message was dropped."""
+        with self._lock:
+            if len(self._queue) >= self.max_queue_size:
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self.stats['dropped'] += 1
+                elif self.overflow_policy == OVERFLOW_BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.max_queue_size and self._running:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.stats['dropped'] += 1
+                            return False
+                        self._not_full.wait(remaining)
+                else:
+                    return self._spill([message])
+
+            self._queue.append(message)
+            self.stats['queued'] += 1
+            if len(self._queue) >= self.batch_size:
+                self._not_empty.notify()
+        return True
+
+    def reconfigure(self, topic=None, max_queue_size=None, overflow_policy=None, batch_size=None,
+                    linger_ms=None, block_timeout=None, retry_interval=None, keyed=None, reconnect=False):
+        """Change settings while the publisher is running.
+
+        With reconnect, the delivery thread flushes and closes the current producer and
+        creates a new one with the producer factory (e.g. for a new broker); readings
+        queue up in the meantime.
+        """
+        if overflow_policy is not None and overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+        with self._lock:
+            if topic is not None:
+                self.topic = topic
+            if max_queue_size is not None:
+                self.max_queue_size = max_queue_size
+            if overflow_policy is not None:
+                self.overflow_policy = overflow_policy
+            if batch_size is not None:
+                self.batch_size = batch_size
+            if linger_ms is not None:
+                self.linger = linger_ms / 1000.0
+            if block_timeout is not None:
+                self.block_timeout = block_timeout
+            if retry_interval is not None:
+                self.retry_interval = retry_interval
+            if keyed is not None:
+                self.keyed = keyed
+            if reconnect and self.producer_factory is not None:
+                self._reconnect = True
+            self._not_full.notify_all()
+            self._not_empty.notify()
+
+    def queue_depth(self):
+        """Return the number of messages waiting for delivery."""
+        return len(self._queue)
+
+    def broker_available(self):
+        """Return True if the last delivery attempt reached the broker."""
+        return self._broker_available
+
+    def close(self, timeout=10.0):
+        """Stop the delivery thread, deliver or spool what is still queued and close the producer."""
+        with self._lock:
+            self._running = False
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            self._abandoned = not self._worker_done
+
+        # Deliver whatever the worker did not get to, or keep it for the next run
+        remaining = self._take_batch(len(self._queue))
+        if remaining:
+            if self._store_and_forward():
+                self._spill(remaining)
+            else:
+                self._send_batch(remaining)
+
+        if self._abandoned:
+            log.warning("Kafka delivery thread still busy after %.1fs; it closes the producer and spool "
+                        "when it finishes", timeout)
+        else:
+            self._close_outputs(timeout)
+        log.info("Kafka publisher closed", extra=self.stats)
+
+    def _close_outputs(self, timeout):
+        """Flush and close the producer and close the spool."""
+        if self.producer is not None:
+            try:
+                self.producer.flush(timeout)
+            except Exception as e:
+                log.error("Error flushing Kafka producer: %s", e)
+            self.producer.close()
+
+        if self.spool is not None:
+            with self._spool_lock:
+                self._spool_closed = True
+                self.spool.close()
+
+    def _run(self):
+        """Worker loop: deliver queued batches, going through the spool while it has a backlog."""
+        while self._running:
+            with self._lock:
+                if len(self._queue) < self.batch_size and self._running:
+                    # Linger so that a batch can fill up before sending
+                    self._not_empty.wait(self.linger)
+            if self._reconnect:
+                self._replace_producer()
+            batch = self._take_batch(self.batch_size)
+
+            if self._store_and_forward():
+                # Keep ordering: live readings queue up behind the spooled backlog
+                if batch:
+                    self._spill(batch)
+                if time.monotonic() >= self._next_retry:
+                    self._replay()
+            elif batch:
+                if self.producer is None and self.producer_factory is not None \
+                        and time.monotonic() >= self._next_retry:
+                    self._connect()
+                self._send_batch(batch)
+
+        with self._lock:
+            self._worker_done = True
+            abandoned = self._abandoned
+        if abandoned:
+            # close() gave up waiting for this thread and left the producer and spool to it
+            self._close_outputs(self.replay_timeout)
+
+    def _store_and_forward(self):
+        """Return True if readings should go to the spool instead of straight to Kafka."""
+        if self.spool is None:
+            return False
+        return not self._broker_available or self.producer is None or self.spool.pending()
+
+    def _take_batch(self, size):
+        """Remove up to `size` messages from the head of the queue."""
+        with self._lock:
+            count = min(size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            if count:
+                self._not_full.notify_all()
+        return batch
+
+    def _send_batch(self, batch):
+        """Hand a batch to the producer; results are reported by the delivery callbacks."""
+        if self.producer is None:
+            self.stats['dropped'] += len(batch)
+            return
+        send_latency = self.send_latency
+        keyed = self.keyed
+        for message in batch:
+            try:
+                sent = time.perf_counter()
+                future = self.producer.send(self.topic, message, key=message_key(message) if keyed else None)
+                if send_latency is not None:
+                    send_latency.observe(time.perf_counter() - sent)
+                future.add_callback(self._on_success, message, sent)
+                future.add_errback(self._on_error, message)
+                self.stats['sent'] += 1
+            except Exception as e:
+                self._on_error(message, e)
+
+    def _replace_producer(self):
+        """Deliver what the current producer holds, close it and connect a new one."""
+        self._reconnect = False
+        producer, self.producer = self.producer, None
+        if producer is not None:
+            try:
+                producer.flush(self.replay_timeout)
+                producer.close()
+            except Exception as e:
+                log.error("Error closing the previous Kafka producer: %s", e)
+        self._next_retry = 0.0
+        self._connect()
+        self._broker_available = self.producer is not None
+        log.info("Kafka producer replaced (topic %s)", self.topic)
+
+    def _connect(self):
+        """Create the producer with the producer factory; on failure, retry after retry_interval."""
+        self.producer = self.producer_factory()
+        if self.producer is None:
+            self._next_retry = time.monotonic() + self.retry_interval
+
+    def _replay(self):
+        """Deliver the oldest spooled readings in bulk; commit them only once all are acknowledged."""
+        if self.producer is None and self.producer_factory is not None:
+            self._connect()
+        if self._abandoned:
+            # close() has moved on while the producer was being created; leave the spool alone
+            return
+        if self.producer is None:
+            self._next_retry = time.monotonic() + self.retry_interval
+            return
+
+        messages = self.spool.read_messages(self.batch_size * 10)
+        if not messages:
+            self.spool.commit()
+            self._broker_available = True
+            return
+
+        try:
+            futures = [self.producer.send(self.topic, message, key=message_key(message) if self.keyed else None)
+                       for message in messages]
+            self.producer.flush(self.replay_timeout)
+            delivered = all(future.succeeded() for future in futures)
+        except Exception as e:
+            log.debug("Spool replay failed: %s", e)
+            delivered = False
+
+        if delivered:
+            self.spool.commit()
+            self.stats['replayed'] += len(messages)
+            self.stats['delivered'] += len(messages)
+            if not self._broker_available:
+                log.info("Kafka broker reachable again, replaying spooled readings")
+            self._broker_available = True
+        else:
+            # Try the same records again later
+            self.spool.rewind()
+            if self._broker_available:
+                log.warning("Kafka broker unreachable, spooling readings to %s", self.spool.directory)
+            self._broker_available = False
+            self._next_retry = time.monotonic() + self.retry_interval
+
+    def _on_success(self, message, sent, metadata):
+        """Called from the producer's I/O thread when a message is acknowledged."""
+        if self.ack_latency is not None:
+            self.ack_latency.observe(time.perf_counter() - sent)
+        self.stats['delivered'] += 1
+        if self.on_delivery:
+            self.on_delivery(message, metadata, None)
+
+    def _on_error(self, message, exc=None):
+        """Called when a message could not be delivered."""
+        self.stats['failed'] += 1
+        if self.stats['failed'] == 1 or self.stats['failed'] % 1000 == 0:
+            log.warning("Error sending to Kafka (%d failures so far): %s", self.stats['failed'], exc)
+        if self.spool is not None:
+            # Keep the reading and stop sending directly until a replay succeeds
+            if self._broker_available:
+                log.warning("Kafka broker unreachable, spooling readings to %s", self.spool.directory)
+            self._broker_available = False
+            self._next_retry = time.monotonic() + self.retry_interval
+            self._spill([message])
+        if self.on_delivery:
+            self.on_delivery(message, None, exc)
+
+    def _spill(self, messages):
+        """Append messages to the spool. Returns False if they had to be dropped."""
+        with self._spool_lock:
+            if self.spool is None or self._spool_closed:
+                self.stats['dropped'] += len(messages)
+                return False
+            try:
+                self.spool.append_messages(messages)
+                self.stats['spilled'] += len(messages)
+                return True
+            except Exception as e:
+                log.error("Error spooling messages to disk: %s", e)
+                self.stats['dropped'] += len(messages)
+                return False
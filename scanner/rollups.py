@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Multi-resolution rollup service.
+
+Consumes the beacon topic and incrementally maintains time-bucketed aggregates per
+(beacon, host_id) at several resolutions (by default 1s, 10s and 1m): reading count,
+RSSI min/max/mean and percentiles. Each closed bucket is published to a compacted
+topic per resolution (ble_rollups_1s, ble_rollups_10s, ...), keyed by beacon, host and
+bucket start, so dashboards read pre-aggregated data instead of raw readings.
+
+Readings only update the finest resolution. When a bucket closes it is merged into
+the enclosing bucket of the next resolution, so the cost per reading does not depend
+on how many resolutions are kept. The percentile sketch is a histogram of integer
+RSSI values (RSSI is an 8-bit quantity), which is exact, small, and mergeable by
+adding counts.
+
+Buckets close when the watermark (the latest event time seen, minus
+allowed_lateness_ms) passes their end. Readings for a bucket that has already closed
+are counted as late and dropped; because records are keyed per bucket, reprocessing
+the topic rewrites the same keys and compaction keeps the latest version.
+
+Coalesced scanner records count as rssi_count readings with their mean, minimum and
+maximum RSSI. Their individual readings are not known, so the histogram gets one
+reading at each extreme and the rest at the record's median; percentiles of buckets
+fed by coalesced records are approximate, min, max and mean exact.
+
+    python rollups.py [--config FILE]
+"""
+
+import argparse
+import configparser
+import datetime
+import json
+import os
+import sys
+
+from decoders import KEY_FIELDS, beacon_key
+from logging_config import configure_logging, get_logger
+from wire_format import decode_message, message_readings, message_time_ms
+
+log = get_logger('rollups')
+
+DEFAULT_CONFIG_FILE = os.path.expanduser("~/.ble/rollups.conf")
+
+_UNITS = {'ms': 1, 's': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000}
+
+
+def parse_resolution(name):
+    """Convert a resolution such as '10s', '1m' or '1h' to milliseconds."""
+    name = name.strip().lower()
+    for unit in ('ms', 's', 'm', 'h'):
+        if name.endswith(unit) and name[:-len(unit)].isdigit():
+            value = int(name[:-len(unit)]) * _UNITS[unit]
+            if value > 0:
+                return value
+    raise ValueError(f"Bad resolution '{name}', expected e.g. 1s, 10s, 1m or 1h")
+
+
+def load_rollup_config(path=DEFAULT_CONFIG_FILE):
+    """Load the rollup service configuration, with defaults for anything not set."""
+    config = configparser.ConfigParser()
+    config['kafka'] = {
+        'broker': 'localhost:9092',
+        'group_id': 'ble-rollups'
+    }
+    config['rollups'] = {
+        'input_topic': 'ble_beacons',
+        'topic_prefix': 'ble_rollups',
+        'resolutions': '1s, 10s, 1m',
+        'allowed_lateness_ms': '2000',
+        'percentiles': '50, 90, 99',
+        'create_topics': 'true',
+        'partitions': '1',
+        'replication_factor': '1'
+    }
+    config['logging'] = {
+        'level': 'INFO',
+        'file': '~/.ble/logs/rollups.log',
+        'max_bytes': '5242880',
+        'backup_count': '5',
+        'debug_rate': '20'
+    }
+    if os.path.exists(path):
+        config.read(path)
+    return config
+
+
+class RollupBucket:
+    """Aggregate of the readings of one beacon and host in one time bucket."""
+
+    __slots__ = ('count', 'total', 'min', 'max', 'histogram', 'data')
+
+    def __init__(self, data):
+        self.count = 0
+        self.total = 0.0
+        self.min = 127
+        self.max = -128
+        # RSSI value -> number of readings
+        self.histogram = {}
+        # Latest reading, for the beacon identity fields
+        self.data = data
+
+    def add(self, rssi, count=1):
+        self.count += count
+        self.total += rssi * count
+        if rssi < self.min:
+            self.min = rssi
+        if rssi > self.max:
+            self.max = rssi
+        self.histogram[rssi] = self.histogram.get(rssi, 0) + count
+
+    def add_summary(self, count, mean, rssi_min, rssi_max, median=None):
+        """Add `count` readings known only by their mean, min, max and (optionally) median RSSI."""
+        self.count += count
+        self.total += mean * count
+        if rssi_min < self.min:
+            self.min = rssi_min
+        if rssi_max > self.max:
+            self.max = rssi_max
+        histogram = self.histogram
+        center = round(median if median is not None else mean)
+        extremes = (rssi_min, rssi_max) if count >= 2 else (center,)
+        for rssi in extremes:
+            histogram[rssi] = histogram.get(rssi, 0) + 1
+        if count > len(extremes):
+            histogram[center] = histogram.get(center, 0) + count - len(extremes)
+
+    def merge(self, other):
+        """Add another bucket's readings to this one."""
+        self.count += other.count
+        self.total += other.total
+        if other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        histogram = self.histogram
+        for rssi, count in other.histogram.items():
+            histogram[rssi] = histogram.get(rssi, 0) + count
+        self.data = other.data
+
+    def percentiles(self, ranks):
+        """Return the RSSI value at each percentile rank (0-100), nearest-rank method."""
+        values = sorted(self.histogram.items())
+        results = []
+        for rank in ranks:
+            target = max(1, -(-self.count * rank // 100))
+            seen = 0
+            for rssi, count in values:
+                seen += count
+                if seen >= target:
+                    results.append(rssi)
+                    break
+        return results
+
+
+class RollupAggregator:
+    """Maintain rollups at several resolutions and return buckets as they close."""
+
+    def __init__(self, resolutions=('1s', '10s', '1m'), allowed_lateness_ms=2000, percentiles=(50, 90, 99)):
+        self.levels = []
+        previous = None
+        for name in resolutions:
+            size = parse_resolution(name)
+            if previous is not None and (size <= previous or size % previous):
+                raise ValueError(f"Resolution {name} must be a larger multiple of the one before it")
+            # (resolution name, bucket size ms, {bucket start: {(beacon key, host_id): RollupBucket}})
+            self.levels.append((name.strip(), size, {}))
+            previous = size
+        if not self.levels:
+            raise ValueError("At least one resolution is required")
+        self.allowed_lateness_ms = allowed_lateness_ms
+        self.percentile_ranks = tuple(percentiles)
+        self.watermark = None
+
+        self.stats = {'readings': 0, 'late': 0, 'emitted': 0}
+
+    def add(self, message):
+        """Add a decoded beacon message to its finest-resolution bucket."""
+        event_ms = message_time_ms(message)
+        _, size, buckets = self.levels[0]
+        start = event_ms - event_ms % size
+        if self.watermark is not None and start + size <= self.watermark:
+            self.stats['late'] += 1
+            return
+
+        series = buckets.get(start)
+        if series is None:
+            series = buckets[start] = {}
+        key = (beacon_key(message.get('type'), message), message.get('host_id'))
+        bucket = series.get(key)
+        if bucket is None:
+            bucket = series[key] = RollupBucket(message)
+        else:
+            bucket.data = message
+
+        count = message.get('rssi_count')
+        if count and 'rssi_min' in message and 'rssi_max' in message:
+            bucket.add_summary(count, message.get('rssi_mean', message.get('rssi', 0)), message['rssi_min'],
+                               message['rssi_max'], message.get('rssi_median'))
+        elif count:
+            bucket.add(round(message.get('rssi_mean', message.get('rssi', 0))), count)
+        else:
+            bucket.add(message.get('rssi', 0))
+
+        self.stats['readings'] += 1
+        watermark = event_ms - self.allowed_lateness_ms
+        if self.watermark is None or watermark > self.watermark:
+            self.watermark = watermark
+
+    def close_due(self, flush=False):
+        """Close every bucket behind the watermark (all buckets with flush).
+
+        Returns a list of (resolution, key, record) for the closed buckets.
+        """
+        closed = []
+        for level, (name, size, buckets) in enumerate(self.levels):
+            parent = self.levels[level + 1] if level + 1 < len(self.levels) else None
+            for start in sorted(buckets):
+                if not flush and (self.watermark is None or start + size > self.watermark):
+                    break
+                series = buckets.pop(start)
+                if parent is not None:
+                    self._merge_into(parent, start, series)
+                window = {
+                    'resolution': name,
+                    'bucket_start': datetime.datetime.fromtimestamp(start / 1000).isoformat(),
+                    'bucket_end': datetime.datetime.fromtimestamp((start + size) / 1000).isoformat(),
+                }
+                for (key, host_id), bucket in series.items():
+                    closed.append((name, key + (host_id, start), self._record(window, host_id, bucket)))
+        self.stats['emitted'] += len(closed)
+        return closed
+
+    def open_buckets(self):
+        """Return the number of (beacon, host) buckets still open, over all resolutions."""
+        return sum(len(series) for _, _, buckets in self.levels for series in buckets.values())
+
+    @staticmethod
+    def _merge_into(parent, start, series):
+        _, size, buckets = parent
+        parent_start = start - start % size
+        target = buckets.get(parent_start)
+        if target is None:
+            target = buckets[parent_start] = {}
+        for key, bucket in series.items():
+            existing = target.get(key)
+            if existing is None:
+                merged = target[key] = RollupBucket(bucket.data)
+                merged.merge(bucket)
+            else:
+                existing.merge(bucket)
+
+    def _record(self, window, host_id, bucket):
+        data = bucket.data
+        beacon_type = data.get('type')
+        record = {'type': beacon_type}
+        for field in KEY_FIELDS.get(beacon_type, ('address',)):
+            record[field] = data.get(field)
+        record['host_id'] = host_id
+        record.update(window)
+        record.update({
+            'count': bucket.count,
+            'rssi_min': bucket.min,
+            'rssi_max': bucket.max,
+            'rssi_mean': round(bucket.total / bucket.count, 2),
+        })
+        for rank, value in zip(self.percentile_ranks, bucket.percentiles(self.percentile_ranks)):
+            record[f"rssi_p{rank}"] = value
+        return record
+
+
+def rollup_topic(prefix, resolution):
+    """Return the topic name for a resolution, e.g. ble_rollups_10s."""
+    return f"{prefix}_{resolution}"
+
+
+def create_aggregator(config):
+    """Create a RollupAggregator from the [rollups] section."""
+    rollups = config['rollups']
+    return RollupAggregator(
+        [name for name in rollups.get('resolutions', '1s, 10s, 1m').split(',') if name.strip()],
+        allowed_lateness_ms=rollups.getint('allowed_lateness_ms', 2000),
+        percentiles=[int(rank) for rank in rollups.get('percentiles', '50, 90, 99').split(',') if rank.strip()],
+    )
+
+
+def ensure_compacted_topics(broker, topics, partitions=1, replication_factor=1):
+    """Create any missing rollup topics with log compaction enabled."""
+    from kafka.admin import KafkaAdminClient, NewTopic
+    from kafka.errors import TopicAlreadyExistsError
+
+    admin = KafkaAdminClient(bootstrap_servers=[broker])
+    try:
+        missing = [topic for topic in topics if topic not in set(admin.list_topics())]
+        if missing:
+            try:
+                admin.create_topics([
+                    NewTopic(topic, num_partitions=partitions, replication_factor=replication_factor,
+                             topic_configs={'cleanup.policy': 'compact'})
+                    for topic in missing
+                ])
+                log.info("Created compacted rollup topics: %s", ', '.join(missing))
+            except TopicAlreadyExistsError:
+                pass
+    finally:
+        admin.close()
+
+
+def _key_bytes(key):
+    return '/'.join(str(part) for part in key).encode('utf-8')
+
+
+def run(config):
+    """Consume readings and publish rollups until interrupted."""
+    from kafka import KafkaConsumer, KafkaProducer
+
+    aggregator = create_aggregator(config)
+    rollups = config['rollups']
+    broker = config['kafka']['broker']
+    prefix = rollups.get('topic_prefix', 'ble_rollups')
+    topics = {name: rollup_topic(prefix, name) for name, _, _ in aggregator.levels}
+
+    if rollups.getboolean('create_topics', True):
+        try:
+            ensure_compacted_topics(broker, list(topics.values()), rollups.getint('partitions', 1),
+                                    rollups.getint('replication_factor', 1))
+        except Exception as e:
+            log.warning("Could not create rollup topics: %s", e)
+
+    # Several topics when the scanners route beacon types to topics of their own
+    input_topics = [topic.strip() for topic in rollups['input_topic'].split(',') if topic.strip()]
+    consumer = KafkaConsumer(
+        *input_topics,
+        bootstrap_servers=[broker],
+        group_id=config['kafka']['group_id'],
+        value_deserializer=decode_message,
+    )
+    producer = KafkaProducer(
+        bootstrap_servers=[broker],
+        key_serializer=_key_bytes,
+        value_serializer=lambda value: json.dumps(value).encode('utf-8'),
+        linger_ms=50,
+    )
+    log.info("Rolling up %s into %s", rollups['input_topic'], ', '.join(topics.values()))
+
+    def publish(closed):
+        for resolution, key, record in closed:
+            producer.send(topics[resolution], key=key, value=record)
+
+    try:
+        while True:
+            for records in consumer.poll(timeout_ms=200, max_records=10000).values():
+                for record in records:
+                    try:
+                        for reading in message_readings(record.value):
+                            aggregator.add(reading)
+                    except (KeyError, TypeError, ValueError) as e:
+                        log.debug("Skipping unreadable reading: %s", e)
+            publish(aggregator.close_due())
+    except KeyboardInterrupt:
+        log.info("Rollup service stopping")
+    finally:
+        publish(aggregator.close_due(flush=True))
+        producer.flush()
+        producer.close()
+        consumer.close()
+        log.info("Rollup service stopped", extra=aggregator.stats)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish multi-resolution rollups of beacon readings.")
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE, help="configuration file")
+    args = parser.parse_args(argv)
+
+    config = load_rollup_config(args.config)
+    configure_logging(config)
+    try:
+        return run(config)
+    except ValueError as e:
+        print(f"Invalid rollup configuration: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
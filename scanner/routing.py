@@ -0,0 +1,141 @@
+"""
+Kafka message keys and per-beacon-type topic routing.
+
+Every message is keyed by the identity of the beacon it describes
+('iBeacon/<uuid>/<major>/<minor>', 'Eddystone-UID/<namespace>/<instance>', ...), the
+same keys the positioning and rollup services write. Kafka's partitioner hashes the
+key, so all readings of a beacon, from every scanner host, land on one partition in
+order, and consumers can scale out by partition while keeping per-beacon state local.
+Columnar windows of readings (see columnar.py) are keyed by the scanner host instead.
+
+The [routing] section sends beacon types to topics of their own, each optionally with
+its own producer batching (linger_ms, batch_bytes) and compression:
+
+    [routing]
+    iBeacon = ble_ibeacon, compression=lz4, linger_ms=50, batch_bytes=65536
+    Eddystone-URL = ble_eddystone_url
+
+Beacon types without a route go to the [kafka] topic with the [publisher] settings.
+Compression and batching are per producer, so RoutingProducer keeps one producer for
+each distinct combination of settings.
+"""
+
+import collections
+
+from decoders import KEY_FIELDS
+from logging_config import get_logger
+from wire_format import WINDOW_TYPE
+
+log = get_logger('publisher')
+
+COMPRESSION_TYPES = ('none', 'gzip', 'snappy', 'lz4', 'zstd')
+
+# Kafka's default producer batch size in bytes
+DEFAULT_BATCH_BYTES = 16384
+
+# topic None means the topic the publisher sends to
+Route = collections.namedtuple('Route', 'topic compression linger_ms batch_bytes')
+
+
+def message_key(message):
+    """Return the Kafka key of a message: its beacon identity (a window's host) as UTF-8 bytes."""
+    beacon_type = message.get('type')
+    if beacon_type == WINDOW_TYPE:
+        return f"{WINDOW_TYPE}/{message.get('host_id')}".encode('utf-8')
+    fields = KEY_FIELDS.get(beacon_type)
+    try:
+        parts = [message[field] for field in fields] if fields else [message.get('address')]
+    except KeyError:
+        parts = [message.get('address')]
+    return '/'.join([str(beacon_type)] + [str(part) for part in parts]).encode('utf-8')
+
+
+def parse_routes(section, default):
+    """Parse [routing] entries ('topic[, option=value ...]') into a dict of beacon type -> Route.
+
+    Options not given for a route are taken from `default`. Beacon types are matched
+    case-insensitively, since configparser lowercases option names.
+    """
+    routes = {}
+    for beacon_type, value in section.items():
+        parts = [part.strip() for part in value.split(',')]
+        if not parts[0] or '=' in parts[0]:
+            raise ValueError(f"Bad route for {beacon_type}: expected 'topic[, option=value ...]'")
+        options = {}
+        for part in parts[1:]:
+            name, sep, option = (text.strip() for text in part.partition('='))
+            if not sep or name not in Route._fields[1:]:
+                raise ValueError(f"Bad route option for {beacon_type}: {part!r}, expected one of "
+                                 f"{', '.join(Route._fields[1:])}")
+            options[name] = option
+        route = default._replace(topic=parts[0])
+        if 'compression' in options:
+            route = route._replace(compression=options['compression'])
+        if 'linger_ms' in options:
+            route = route._replace(linger_ms=int(options['linger_ms']))
+        if 'batch_bytes' in options:
+            route = route._replace(batch_bytes=int(options['batch_bytes']))
+        if route.compression not in COMPRESSION_TYPES:
+            raise ValueError(f"Unknown compression '{route.compression}' for {beacon_type}, "
+                             f"expected one of {COMPRESSION_TYPES}")
+        if route.linger_ms < 0 or route.batch_bytes < 1:
+            raise ValueError(f"linger_ms and batch_bytes for {beacon_type} must be positive")
+        routes[beacon_type.lower()] = route
+    return routes
+
+
+class RoutingProducer:
+    """Send each message with the producer and topic of its beacon type's route.
+
+    Has the send(), flush() and close() of a KafkaProducer, so the publisher can use it
+    in place of one. make_producer(route) creates a producer with a route's compression
+    and batching settings.
+    """
+
+    def __init__(self, default, routes, make_producer):
+        # (compression, linger_ms, batch_bytes) -> producer
+        self._producers = {}
+        try:
+            self._default = (None, self._producer(default, make_producer))
+            self._routes = {beacon_type: (route.topic, self._producer(route, make_producer))
+                            for beacon_type, route in routes.items()}
+        except Exception:
+            self.close()
+            raise
+        # Exact beacon type -> (topic, producer), filled as types are first seen
+        self._by_type = {}
+
+        # topic -> messages sent
+        self.stats = collections.Counter()
+
+    def _producer(self, route, make_producer):
+        settings = route[1:]
+        producer = self._producers.get(settings)
+        if producer is None:
+            producer = self._producers[settings] = make_producer(route)
+        return producer
+
+    def send(self, topic, value, key=None):
+        """Send a message to its route's topic, or to `topic` if its type has no route."""
+        beacon_type = value.get('type')
+        route = self._by_type.get(beacon_type)
+        if route is None:
+            route = self._routes.get(str(beacon_type).lower(), self._default)
+            self._by_type[beacon_type] = route
+        route_topic = route[0] or topic
+        self.stats[route_topic] += 1
+        return route[1].send(route_topic, value, key=key)
+
+    def flush(self, timeout=None):
+        for producer in self._producers.values():
+            producer.flush(timeout)
+
+    def close(self, timeout=None):
+        for producer in self._producers.values():
+            try:
+                producer.close(timeout)
+            except Exception as e:
+                log.error("Error closing Kafka producer: %s", e)
+        if self.stats:
+            log.info("Messages sent per topic: %s",
+                     ', '.join(f"{topic}={count}" for topic, count in sorted(self.stats.items())))
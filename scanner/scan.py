@@ -1,17 +1,29 @@
 import asyncio
-from bleak import BleakScanner
-import struct
-import uuid
+import functools
 import time
 import socket
 import platform
 import os
+import re
+import subprocess
 import uuid as system_uuid
-import json
-from kafka import KafkaProducer
-from kafka.errors import KafkaError
+from publisher import KafkaPublisher, OVERFLOW_POLICIES
+from spool import Spool
+from capture import CaptureWriter, ReplayScanner
+from adapters import AdvertisementDeduplicator, MultiAdapterScanner, parse_adapters
+from config_watch import ConfigWatcher, changed_sections, read_config, validate_config
+from decoders import decode_advertisement
+from filters import parse_filter
+from routing import COMPRESSION_TYPES, DEFAULT_BATCH_BYTES, Route, RoutingProducer, parse_routes
+from wire_format import get_serializer
+from coalescer import BeaconCoalescer
+from logging_config import configure_logging, get_logger
 import datetime
 import configparser
+import logging
+
+log = get_logger('scan')
+config_log = get_logger('config')
 
 # Callback function for GUI updates - will be set by the GUI
 _gui_callback = None
@@ -19,95 +31,387 @@ _gui_callback = None
 # Add a global variable to control scanning
 _scanning_active = False
 
+# Called once with the first message handed to the publisher, for startup timing
+_first_publish_hook = None
+
+# Configuration file and host ID cache; bleak, kafka and NumPy are imported only when
+# the stage that needs them is created, so importing this module is cheap
+CONFIG_DIR = os.path.expanduser("~/.ble")
+CONFIG_FILE = os.path.join(CONFIG_DIR, "config.conf")
+HOST_ID_FILE = os.path.join(CONFIG_DIR, "host_id")
+
 def set_gui_callback(callback_func):
     """Set the callback function for GUI updates."""
     global _gui_callback
-    print(f"DEBUG: Setting GUI callback: {callback_func}")
+    log.debug("Setting GUI callback: %s", callback_func)
     _gui_callback = callback_func
 
-# Load configuration from file
-def load_config():
-    """Load configuration from ~/.ble/config.conf or create with defaults if it doesn't exist."""
+def default_config():
+    """Return the default configuration."""
     config = configparser.ConfigParser()
     
     # Default configuration
     config['kafka'] = {
         'broker': 'localhost:9092',
-        'topic': 'ble_beacons'
+        'topic': 'ble_beacons',
+        'serialization': 'json',
+        'message_key': 'identity'
+    }
+    config['scanner'] = {
+        'scanning_mode': 'active',
+        'backend': 'bleak',
+        'replay_file': '',
+        'replay_speed': '1.0',
+        'replay_loop': 'false',
+        'record_file': '',
+        'adapters': '',
+        'dedup_window_ms': '50',
+        'reload_interval': '1.0'
+    }
+    # Allow/deny rules checked before decoding; lists are comma separated, empty lists are not used
+    config['filter'] = {
+        'enabled': 'false',
+        'allow_uuids': '',
+        'deny_uuids': '',
+        'allow_namespaces': '',
+        'deny_namespaces': '',
+        'allow_mac_prefixes': '',
+        'deny_mac_prefixes': '',
+        'allow_company_ids': '',
+        'deny_company_ids': '',
+        'min_rssi': ''
+    }
+    config['publisher'] = {
+        'queue_size': '10000',
+        'overflow_policy': 'drop-oldest',
+        'batch_size': '500',
+        'linger_ms': '20',
+        'compression': 'none',
+        'block_timeout': '1.0'
+    }
+    config['spool'] = {
+        'enabled': 'true',
+        'directory': '~/.ble/spool',
+        'segment_size_mb': '16',
+        'max_segments': '64',
+        'retry_interval': '5.0'
+    }
+    config['archive'] = {
+        'enabled': 'false',
+        'directory': '~/.ble/archive',
+        'row_group_size': '65536',
+        'flush_interval': '60',
+        'compression': 'zstd',
+        'max_age_hours': '0'
+    }
+    config['columnar'] = {
+        'enabled': 'false',
+        'window_ms': '1000',
+        'max_readings': '65536'
     }
+    config['coalesce'] = {
+        'enabled': 'false',
+        'window_ms': '1000',
+        'max_beacons': '4096',
+        'max_samples': '64'
+    }
+    config['smoothing'] = {
+        'enabled': 'false',
+        'method': 'ema',
+        'alpha': '0.3',
+        'process_noise': '0.5',
+        'measurement_noise': '16.0',
+        'max_beacons': '4096',
+        'idle_timeout': '30.0'
+    }
+    config['distance'] = {
+        'enabled': 'false',
+        'environment': 'indoor',
+        'path_loss_exponent': '',
+        'default_tx_power': '',
+        'immediate': '0.5',
+        'near': '4.0'
+    }
+    # Per-beacon overrides: <type>/<identity fields> = tx_power[, path_loss_exponent]
+    config['calibration'] = {}
+    # Per-type topics: <beacon type> = topic[, compression=...][, linger_ms=...][, batch_bytes=...]
+    config['routing'] = {}
+    config['batching'] = {
+        'batch_size': '1024'
+    }
+    config['metrics'] = {
+        'enabled': 'false',
+        'host': '127.0.0.1',
+        'port': '9475'
+    }
+    config['logging'] = {
+        'level': 'INFO',
+        'file': '~/.ble/logs/scanner.log',
+        'max_bytes': '5242880',
+        'backup_count': '5',
+        'debug_rate': '20'
+    }
+    return config
+
+# Load configuration from file
+def load_config(config_file=None):
+    """Load configuration from ~/.ble/config.conf (or config_file) or create it with defaults if it doesn't exist."""
+    config = default_config()
+    config_file = config_file or CONFIG_FILE
     
     # Create config directory if it doesn't exist
-    config_dir = os.path.expanduser("~/.ble")
-    os.makedirs(config_dir, exist_ok=True)
-    
-    config_file = os.path.join(config_dir, "config.conf")
+    os.makedirs(os.path.dirname(config_file), exist_ok=True)
     
     # If config file exists, read it
     if os.path.exists(config_file):
         try:
             config.read(config_file)
-            print(f"DEBUG: Loaded configuration from {config_file}")
+            config_log.debug("Loaded configuration from %s", config_file)
         except Exception as e:
-            print(f"DEBUG: Error reading config file: {e}")
+            config_log.error("Error reading config file: %s", e)
     else:
         # Create default config file
         try:
             with open(config_file, 'w') as f:
                 config.write(f)
-            print(f"DEBUG: Created default configuration at {config_file}")
+            config_log.info("Created default configuration at %s", config_file)
         except Exception as e:
-            print(f"DEBUG: Error creating config file: {e}")
+            config_log.error("Error creating config file: %s", e)
     
     return config
 
-# Load configuration
-config = load_config()
+# Allowed values of options with a fixed set of choices, checked when the file changes while scanning
+CONFIG_CHOICES = {
+    ('kafka', 'serialization'): ('json', 'binary'),
+    ('kafka', 'message_key'): ('identity', 'none'),
+    ('scanner', 'scanning_mode'): ('active', 'passive'),
+    ('scanner', 'backend'): ('bleak', 'replay'),
+    ('publisher', 'overflow_policy'): OVERFLOW_POLICIES,
+    ('publisher', 'compression'): COMPRESSION_TYPES,
+    ('smoothing', 'method'): ('ema', 'kalman'),
+    ('archive', 'compression'): ('none', 'snappy', 'gzip', 'lz4', 'zstd'),
+}
+
+# Sections whose changes are applied by replacing the scanner, the publisher's producer,
+# or the processing stages, respectively
+SCANNER_SECTIONS = {'scanner'}
+PRODUCER_SECTIONS = {'kafka', 'publisher', 'routing'}
+STAGE_SECTIONS = {'columnar', 'coalesce', 'smoothing', 'distance', 'calibration', 'batching'}
+
+# Defaults until load_config() reads the configuration file, which reload_config() (or
+# the first scan) does; importing this module touches neither the file system nor logging
+config = default_config()
+_config_loaded = False
 
 # Kafka configuration
 KAFKA_BROKER = os.environ.get('KAFKA_BROKER', config['kafka']['broker'])
 KAFKA_TOPIC = os.environ.get('KAFKA_TOPIC', config['kafka']['topic'])
+KAFKA_SERIALIZATION = os.environ.get('KAFKA_SERIALIZATION', config['kafka']['serialization'])
+
+# Scanner configuration ('active' sends scan requests, 'passive' only listens)
+SCANNING_MODE = os.environ.get('BLE_SCANNING_MODE', config['scanner']['scanning_mode'])
+
+# How often the scan loop checks whether it has been asked to stop (seconds)
+STOP_POLL_INTERVAL = 0.1
+
+# How often the scan loop logs a throughput summary (seconds)
+SUMMARY_INTERVAL = 10.0
+
+def default_route():
+    """Return the producer settings of beacon types without a route in [routing]."""
+    publisher_config = config['publisher']
+    return Route(None, publisher_config.get('compression', 'none'), publisher_config.getint('linger_ms', 20),
+                 DEFAULT_BATCH_BYTES)
+
+def create_routes():
+    """Parse the [routing] section; invalid routes are ignored with a warning."""
+    if not config.has_section('routing'):
+        return {}
+    try:
+        return parse_routes(config['routing'], default_route())
+    except ValueError as e:
+        config_log.warning("Invalid [routing] configuration (%s), sending every beacon type to %s", e, KAFKA_TOPIC)
+        return {}
 
 def create_kafka_producer():
-    """Create a Kafka producer with error handling."""
-    print(f"DEBUG: Creating Kafka producer with broker {KAFKA_BROKER}")
+    """Create a Kafka producer with error handling.
+    
+    With routes in [routing], this is a RoutingProducer holding a producer per distinct
+    set of route settings.
+    """
+    log.info("Creating Kafka producer with broker %s", KAFKA_BROKER)
     try:
-        producer = KafkaProducer(
-            bootstrap_servers=[KAFKA_BROKER],
-            value_serializer=lambda v: json.dumps(v).encode('utf-8')
-        )
-        print("DEBUG: Kafka producer created successfully")
+        from kafka import KafkaProducer
+        serializer = get_serializer(KAFKA_SERIALIZATION)
+        
+        def make_producer(route):
+            return KafkaProducer(
+                bootstrap_servers=[KAFKA_BROKER],
+                value_serializer=serializer,
+                linger_ms=route.linger_ms,
+                batch_size=route.batch_bytes,
+                compression_type=None if route.compression == 'none' else route.compression,
+                # Fail sends quickly when the broker is unreachable so readings get spooled
+                max_block_ms=5000
+            )
+        
+        routes = create_routes()
+        if routes:
+            producer = RoutingProducer(default_route(), routes, make_producer)
+            log.info("Routing %s", ', '.join(f"{beacon_type} to {route.topic}" for beacon_type, route in routes.items()))
+        else:
+            producer = make_producer(default_route())
+        log.info("Kafka producer created successfully (%s serialization)", KAFKA_SERIALIZATION)
         return producer
     except Exception as e:
-        print(f"DEBUG: Error creating Kafka producer: {e}")
+        log.error("Error creating Kafka producer: %s", e)
+        return None
+
+def create_spool():
+    """Open the store-and-forward spool if it is enabled in the [spool] section."""
+    spool_config = config['spool']
+    if not spool_config.getboolean('enabled', True):
+        return None
+    try:
+        return Spool(
+            spool_config.get('directory', '~/.ble/spool'),
+            segment_size=spool_config.getint('segment_size_mb', 16) * 1024 * 1024,
+            max_segments=spool_config.getint('max_segments', 64)
+        )
+    except Exception as e:
+        log.error("Error opening spool, readings will be dropped while Kafka is unreachable: %s", e)
         return None
 
+def create_archive(host_id):
+    """Open the local reading archive if it is enabled in the [archive] section."""
+    archive_config = config['archive']
+    if not archive_config.getboolean('enabled', False):
+        return None
+    try:
+        from archive import ReadingArchive
+    except ImportError as e:
+        config_log.warning("The archive needs pyarrow (%s), archive disabled", e)
+        return None
+    try:
+        return ReadingArchive(
+            archive_config.get('directory', '~/.ble/archive'),
+            host_id,
+            row_group_size=archive_config.getint('row_group_size', 65536),
+            flush_interval=archive_config.getfloat('flush_interval', 60.0),
+            compression=archive_config.get('compression', 'zstd'),
+            max_age_hours=archive_config.getint('max_age_hours', 0)
+        )
+    except (OSError, ValueError) as e:
+        config_log.warning("Could not open the archive (%s), archive disabled", e)
+        return None
+
+def create_metrics_server():
+    """Create and start the metrics endpoint if it is enabled in the [metrics] section."""
+    metrics_config = config['metrics']
+    if not metrics_config.getboolean('enabled', False):
+        return None
+    from metrics import MetricsRegistry, MetricsServer
+    server = MetricsServer(MetricsRegistry(), metrics_config.get('host', '127.0.0.1'),
+                           metrics_config.getint('port', 9475))
+    try:
+        server.start()
+    except OSError as e:
+        config_log.warning("Could not serve metrics on %s:%s (%s), metrics disabled", server.host, server.port, e)
+        return None
+    return server
+
+def create_publisher(producer=None, on_delivery=None, metrics=None):
+    """Create the background publisher configured from the [publisher] and [spool] sections.
+    
+    Without a producer, the publisher connects to Kafka from its delivery thread, so
+    scanning starts without waiting for the broker.
+    """
+    spool = create_spool()
+    publisher_config = config['publisher']
+    retry_interval = config['spool'].getfloat('retry_interval', 5.0)
+    try:
+        publisher = KafkaPublisher(
+            producer,
+            KAFKA_TOPIC,
+            max_queue_size=publisher_config.getint('queue_size', 10000),
+            overflow_policy=publisher_config.get('overflow_policy', 'drop-oldest'),
+            batch_size=publisher_config.getint('batch_size', 500),
+            linger_ms=publisher_config.getint('linger_ms', 20),
+            block_timeout=publisher_config.getfloat('block_timeout', 1.0),
+            spool=spool,
+            producer_factory=create_kafka_producer,
+            retry_interval=retry_interval,
+            on_delivery=on_delivery,
+            metrics=metrics,
+            keyed=config['kafka'].get('message_key', 'identity') != 'none'
+        )
+    except ValueError as e:
+        config_log.warning("Invalid publisher configuration (%s), using defaults", e)
+        publisher = KafkaPublisher(producer, KAFKA_TOPIC, spool=spool, producer_factory=create_kafka_producer,
+                                   retry_interval=retry_interval, on_delivery=on_delivery, metrics=metrics,
+                                   keyed=config['kafka'].get('message_key', 'identity') != 'none')
+    publisher.start()
+    return publisher
+
 def get_host_id():
-    """Get a unique host ID that persists across reboots."""
-    print("DEBUG: Getting host ID")
+    """Get a unique host ID that persists across reboots.
+    
+    The ID is detected once and cached in ~/.ble/host_id; delete the file to detect it again.
+    """
+    try:
+        with open(HOST_ID_FILE, encoding='utf-8') as f:
+            host_id = f.read().strip()
+        if host_id:
+            return host_id
+    except OSError:
+        pass
+    
+    host_id = detect_host_id()
+    try:
+        os.makedirs(os.path.dirname(HOST_ID_FILE), exist_ok=True)
+        temp_file = f"{HOST_ID_FILE}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(host_id + "\n")
+        os.replace(temp_file, HOST_ID_FILE)
+    except OSError as e:
+        log.warning("Could not cache host ID in %s: %s", HOST_ID_FILE, e)
+    return host_id
+
+def detect_host_id():
+    """Detect the host ID: the hardware UUID on macOS, the hostname elsewhere."""
+    log.debug("Detecting host ID")
     try:
         if platform.system() == 'Darwin':  # macOS
             # Use the hardware UUID on macOS
-            cmd = 'ioreg -rd1 -c IOPlatformExpertDevice | grep -i "UUID" | cut -c27-62'
-            import subprocess
-            result = subprocess.check_output(cmd, shell=True).decode('utf-8').strip()
-            print(f"DEBUG: Got macOS hardware UUID: {result}")
-            return result
+            output = subprocess.run(['ioreg', '-rd1', '-c', 'IOPlatformExpertDevice'],
+                                    capture_output=True, text=True, check=True, timeout=10).stdout
+            match = re.search(r'"IOPlatformUUID"\s*=\s*"([^"]+)"', output)
+            if match is None:
+                raise ValueError("IOPlatformUUID not found in ioreg output")
+            log.debug("Got macOS hardware UUID: %s", match.group(1))
+            return match.group(1)
         else:
             # Fallback to hostname + first MAC address
             hostname = socket.gethostname()
-            print(f"DEBUG: Using hostname for host ID: {hostname}")
+            log.debug("Using hostname for host ID: %s", hostname)
             return hostname
     except Exception as e:
-        print(f"DEBUG: Error getting host ID: {e}")
+        log.error("Error getting host ID: %s", e)
         # Generate a random UUID as fallback
         fallback_id = str(system_uuid.uuid4())
-        print(f"DEBUG: Using fallback random UUID: {fallback_id}")
+        log.warning("Using fallback random UUID: %s", fallback_id)
         return fallback_id
 
-def process_beacon_data(producer, beacon_type, beacon_data, host_id, timestamp):
-    """Process beacon data and send to Kafka."""
-    print(f"DEBUG: Processing beacon data: type={beacon_type}, data={beacon_data}")
-    
+def notify_gui(beacon_type, beacon_data):
+    """Pass a reading to the GUI callback, if one is set."""
+    if _gui_callback:
+        try:
+            _gui_callback(beacon_type, beacon_data)
+        except Exception:
+            log.exception("Error in GUI callback")
+
+def publish_beacon_data(publisher, beacon_type, beacon_data, host_id, timestamp):
+    """Build the Kafka message for a reading and queue it for delivery."""
     # Add common fields
     message = {
         'type': beacon_type,
@@ -120,217 +424,666 @@ def process_beacon_data(producer, beacon_type, beacon_data, host_id, timestamp):
     # Add type-specific fields
     message.update(beacon_data)
     
-    # Call GUI callback if set
-    if _gui_callback:
-        print(f"DEBUG: Calling GUI callback with {beacon_type} and data")
-        try:
-            _gui_callback(beacon_type, beacon_data)
-            print("DEBUG: GUI callback completed successfully")
-        except Exception as e:
-            print(f"DEBUG: Error in GUI callback: {e}")
-            import traceback
-            print(traceback.format_exc())
-    else:
-        print("DEBUG: No GUI callback set")
+    publish_message(publisher, message)
+    return message
+
+def publish_message(publisher, message):
+    """Queue a message for delivery."""
+    global _first_publish_hook
+    if _first_publish_hook is not None:
+        hook, _first_publish_hook = _first_publish_hook, None
+        hook(message)
     
-    # Send to Kafka if producer is available
-    if producer:
-        print(f"DEBUG: Sending to Kafka topic {KAFKA_TOPIC}")
-        try:
-            future = producer.send(KAFKA_TOPIC, message)
-            producer.flush()
-            print("DEBUG: Message sent to Kafka")
-        except Exception as e:
-            print(f"DEBUG: Error sending to Kafka: {e}")
+    # Queue for Kafka if a publisher is available; delivery happens in the background
+    if publisher:
+        if not publisher.publish(message):
+            log.debug("Kafka queue full, message dropped")
     else:
-        print("DEBUG: No Kafka producer available")
+        log.debug("No Kafka producer available")
+
+def process_beacon_data(publisher, beacon_type, beacon_data, host_id, timestamp):
+    """Process beacon data and send to Kafka."""
+    notify_gui(beacon_type, beacon_data)
+    return publish_beacon_data(publisher, beacon_type, beacon_data, host_id, timestamp)
+
+def create_coalescer(host_id, publisher):
+    """Create the per-beacon coalescing stage if it is enabled in the [coalesce] section."""
+    coalesce_config = config['coalesce']
+    if not coalesce_config.getboolean('enabled', False):
+        return None
     
-    return message
+    def emit(beacon_type, beacon_data, timestamp):
+        publish_beacon_data(publisher, beacon_type, beacon_data, host_id, timestamp)
+    
+    try:
+        coalescer = BeaconCoalescer(
+            emit,
+            window_ms=coalesce_config.getint('window_ms', 1000),
+            max_beacons=coalesce_config.getint('max_beacons', 4096),
+            max_samples=coalesce_config.getint('max_samples', 64)
+        )
+    except ValueError as e:
+        config_log.warning("Invalid coalescing configuration (%s), coalescing disabled", e)
+        return None
+    log.info("Coalescing readings over %dms windows", coalescer.window * 1000)
+    return coalescer
+
+def create_reading_window(host_id, publisher):
+    """Create the columnar window stage if it is enabled in the [columnar] section."""
+    columnar_config = config['columnar']
+    if not columnar_config.getboolean('enabled', False):
+        return None
+    from columnar import ReadingWindow
+    try:
+        window = ReadingWindow(
+            lambda message: publish_message(publisher, message),
+            host_id,
+            window_ms=columnar_config.getint('window_ms', 1000),
+            max_readings=columnar_config.getint('max_readings', 65536)
+        )
+    except ValueError as e:
+        config_log.warning("Invalid columnar configuration (%s), publishing readings one by one", e)
+        return None
+    if config['coalesce'].getboolean('enabled', False):
+        config_log.warning("Coalescing is not used with columnar windows, which already carry every reading")
+    log.info("Publishing readings in columnar windows of %dms", window.window * 1000)
+    return window
+
+def create_reading_sink(host_id, publisher, coalescer=None, window=None, archive=None):
+    """Create the function that hands a processed reading to the archive, the GUI and the window, coalescer or publisher."""
+    def deliver(beacon_type, beacon_data, now):
+        if archive is not None:
+            archive.add(beacon_type, beacon_data, now)
+        if window is not None:
+            # The GUI still sees every reading; Kafka gets one message per window
+            notify_gui(beacon_type, beacon_data)
+            window.add(beacon_type, beacon_data, now)
+            return None
+        if coalescer is not None:
+            # The GUI still sees every reading; Kafka gets one record per window
+            notify_gui(beacon_type, beacon_data)
+            coalescer.add(beacon_type, beacon_data, now)
+            return None
+        timestamp = datetime.datetime.fromtimestamp(now).isoformat()
+        return process_beacon_data(publisher, beacon_type, beacon_data, host_id, timestamp)
+    return deliver
+
+def create_smoother():
+    """Create the RSSI smoothing stage if it is enabled in the [smoothing] section."""
+    smoothing_config = config['smoothing']
+    if not smoothing_config.getboolean('enabled', False):
+        return None
+    from smoothing import RssiSmoother
+    try:
+        smoother = RssiSmoother(
+            method=smoothing_config.get('method', 'ema'),
+            alpha=smoothing_config.getfloat('alpha', 0.3),
+            process_noise=smoothing_config.getfloat('process_noise', 0.5),
+            measurement_noise=smoothing_config.getfloat('measurement_noise', 16.0),
+            max_beacons=smoothing_config.getint('max_beacons', 4096),
+            idle_timeout=smoothing_config.getfloat('idle_timeout', 30.0)
+        )
+    except ValueError as e:
+        config_log.warning("Invalid smoothing configuration (%s), smoothing disabled", e)
+        return None
+    log.info("Smoothing RSSI with %s filter", smoother.method)
+    return smoother
+
+def create_distance_estimator():
+    """Create the distance estimation stage if it is enabled in the [distance] section."""
+    distance_config = config['distance']
+    if not distance_config.getboolean('enabled', False):
+        return None
+    from distance import DistanceEstimator, parse_calibration
+    try:
+        exponent = distance_config.get('path_loss_exponent', '')
+        default_tx_power = distance_config.get('default_tx_power', '')
+        estimator = DistanceEstimator(
+            environment=distance_config.get('environment', 'indoor'),
+            path_loss_exponent=float(exponent) if exponent else None,
+            default_tx_power=float(default_tx_power) if default_tx_power else None,
+            calibration=parse_calibration(config['calibration']) if config.has_section('calibration') else None,
+            immediate=distance_config.getfloat('immediate', 0.5),
+            near=distance_config.getfloat('near', 4.0)
+        )
+    except ValueError as e:
+        config_log.warning("Invalid distance configuration (%s), distance estimation disabled", e)
+        return None
+    log.info("Estimating distance with path-loss exponent %.2f (%d calibrated beacons)",
+             estimator.path_loss_exponent, len(estimator.calibration))
+    return estimator
 
-def create_beacon_processor(host_id, producer):
-    """Create a beacon processor that captures the host ID and producer."""
-    def process_beacon(beacon_type, beacon_data):
-        timestamp = datetime.datetime.now().isoformat()
-        return process_beacon_data(producer, beacon_type, beacon_data, host_id, timestamp)
+def create_batcher(deliver):
+    """Create the micro-batching stage if any batch stage is enabled, otherwise return None.
+    
+    Smoothing runs first so that distance is estimated from the filtered RSSI.
+    """
+    stages = [stage for stage in (create_smoother(), create_distance_estimator()) if stage is not None]
+    if not stages:
+        return None
+    from batching import ReadingBatcher
+    return ReadingBatcher(deliver, stages, max_batch=config['batching'].getint('batch_size', 1024))
+
+def create_beacon_processor(deliver, batcher=None):
+    """Create a beacon processor that passes readings to the batcher, or straight to deliver."""
+    if batcher is not None:
+        # Readings are delivered when the batch is flushed
+        def process_beacon(beacon_type, beacon_data):
+            batcher.add(beacon_type, beacon_data, time.time())
+            return None
+    else:
+        def process_beacon(beacon_type, beacon_data):
+            return deliver(beacon_type, beacon_data, time.time())
     return process_beacon
 
-async def scan_ble_devices():
-    """Scan for BLE devices and process beacon data."""
-    print("DEBUG: Starting BLE scan")
+def count_beacons(process_beacon, counter):
+    """Wrap a beacon processor so that it counts beacons per type in a metrics counter."""
+    inc = counter.inc
+    def counted(beacon_type, beacon_data):
+        inc(beacon_type)
+        return process_beacon(beacon_type, beacon_data)
+    return counted
+
+def process_advertisement(device, advertisement_data, process_beacon, adapter=None):
+    """Decode a single BLE advertisement and hand any beacons found to the processor.
+    
+    Readings are tagged with the adapter that received the advertisement, if given.
+    """
+    rssi = advertisement_data.rssi
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("Processing device: %s (%s), RSSI: %s", device.address, device.name, rssi)
+    
+    records = decode_advertisement(advertisement_data.manufacturer_data, advertisement_data.service_data)
+    for record in records:
+        beacon_data = record._asdict()
+        beacon_data['rssi'] = rssi
+        beacon_data['address'] = device.address
+        beacon_data['name'] = device.name or 'Unknown'
+        if adapter is not None:
+            beacon_data['adapter'] = adapter
+        
+        if debug:
+            log.debug("Found %s: %s, RSSI=%s", record.beacon_type, record, rssi)
+        process_beacon(record.beacon_type, beacon_data)
+    
+    return len(records)
+
+def create_deduplicator():
+    """Create the cross-adapter deduplication stage when scanning on more than one adapter."""
+    scanner_config = config['scanner']
+    if scanner_config.get('backend', 'bleak') == 'replay' or len(parse_adapters(scanner_config.get('adapters', ''))) < 2:
+        return None
+    try:
+        return AdvertisementDeduplicator(window_ms=scanner_config.getint('dedup_window_ms', 50))
+    except ValueError as e:
+        config_log.warning("Invalid dedup_window_ms (%s), using 50ms", e)
+        return AdvertisementDeduplicator()
+
+def create_filter():
+    """Create the pre-decode advertisement filter if it is enabled in the [filter] section."""
+    filter_config = config['filter']
+    if not filter_config.getboolean('enabled', False):
+        return None
+    try:
+        advertisement_filter = parse_filter(filter_config)
+    except ValueError as e:
+        config_log.warning("Invalid filter configuration (%s), filtering disabled", e)
+        return None
+    log.info("Filtering advertisements with %d rules", advertisement_filter.rules())
+    return advertisement_filter
+
+def create_scanner(detection_callback, scanning_mode):
+    """Create a long-lived scanner that delivers every advertisement to the callback.
+    
+    The [scanner] backend setting selects a BleakScanner ('bleak') or a ReplayScanner
+    that plays back a recorded capture ('replay'). With a list of adapters, one
+    BleakScanner runs per adapter and the callback also receives the adapter name as
+    its `adapter` keyword argument.
+    """
+    scanner_config = config['scanner']
+    if scanner_config.get('backend', 'bleak') == 'replay':
+        replay_file = os.path.expanduser(scanner_config.get('replay_file', ''))
+        log.info("Creating replay scanner for %s", replay_file)
+        return ReplayScanner(
+            detection_callback,
+            replay_file,
+            speed=scanner_config.getfloat('replay_speed', 1.0),
+            loop=scanner_config.getboolean('replay_loop', False)
+        )
+    
+    if scanning_mode not in ('active', 'passive'):
+        config_log.warning("Unknown scanning mode '%s', using active", scanning_mode)
+        scanning_mode = 'active'
+    
+    from bleak import BleakScanner
+    
+    adapters = parse_adapters(scanner_config.get('adapters', ''))
+    if adapters:
+        log.info("Creating %s scanners on %s", scanning_mode, ', '.join(adapters))
+        return MultiAdapterScanner({
+            adapter: BleakScanner(detection_callback=functools.partial(detection_callback, adapter=adapter),
+                                  scanning_mode=scanning_mode, adapter=adapter)
+            for adapter in adapters
+        })
+    
+    log.info("Creating %s scanner", scanning_mode)
+    return BleakScanner(detection_callback=detection_callback, scanning_mode=scanning_mode)
+
+def register_scan_metrics(metrics, stats, startup, publisher, current_stages):
+    """Expose the scan loop's, publisher's and stages' counters as metrics read at scrape time.
+    
+    current_stages() returns the (coalescer, batcher, deduplicator, filter, window) in
+    use, which change when the configuration does.
+    """
+    metrics.counter_callback('ble_advertisements_total', "Advertisements received (after deduplication)",
+                             lambda: stats['advertisements'])
+    metrics.counter_callback('ble_config_reloads_total', "Configuration changes applied or rejected while scanning",
+                             lambda: {('applied',): stats['config_reloads'], ('rejected',): stats['config_rejected']},
+                             labels=('result',))
+    metrics.gauge_callback('ble_startup_seconds', "Seconds from process start to each startup milestone",
+                           lambda: {(name,): ms / 1000 for name, ms in startup.milestones.items()},
+                           labels=('milestone',))
+    
+    def adapter_counts():
+        deduplicator = current_stages()[2]
+        return dict(((adapter,), count) for adapter, count in deduplicator.adapter_counts.items()) if deduplicator else None
+    metrics.counter_callback('ble_adapter_advertisements_total', "Advertisements accepted per adapter",
+                             adapter_counts, labels=('adapter',))
+    metrics.counter_callback('ble_duplicate_advertisements_total', "Advertisements dropped as heard by another adapter",
+                             lambda: current_stages()[2].stats['duplicates'] if current_stages()[2] else None)
+    
+    def coalesced():
+        coalescer = current_stages()[0]
+        return dict(((event,), coalescer.stats[event]) for event in ('emitted', 'evicted')) if coalescer else None
+    metrics.counter_callback('ble_coalesced_windows_total', "Coalescing windows emitted, and closed early to free a slot",
+                             coalesced, labels=('event',))
+    
+    def windows():
+        window = current_stages()[4]
+        return window.stats['windows'] if window else None
+    metrics.counter_callback('ble_columnar_windows_total', "Columnar windows of readings published", windows)
+    metrics.gauge_callback('ble_batch_pending', "Readings waiting for the next batch flush",
+                           lambda: current_stages()[1].pending() if current_stages()[1] else None)
+    
+    def filtered():
+        advertisement_filter = current_stages()[3]
+        return dict(((result,), count) for result, count in advertisement_filter.stats.items()) \
+            if advertisement_filter else None
+    def filter_hits():
+        advertisement_filter = current_stages()[3]
+        return dict(advertisement_filter.hits) if advertisement_filter else None
+    metrics.counter_callback('ble_filtered_advertisements_total', "Advertisements accepted and rejected by the filter",
+                             filtered, labels=('result',))
+    metrics.counter_callback('ble_filter_hits_total', "Advertisements matched by each filter rule",
+                             filter_hits, labels=('rule', 'value'))
+    
+    if publisher is None:
+        return
+    metrics.gauge_callback('ble_publisher_queue_depth', "Readings queued for Kafka", publisher.queue_depth)
+    metrics.gauge_callback('ble_publisher_queue_capacity', "Maximum readings queued for Kafka",
+                           lambda: publisher.max_queue_size)
+    metrics.gauge_callback('ble_kafka_broker_available', "1 if the last delivery attempt reached the broker",
+                           lambda: int(publisher.broker_available()))
+    metrics.counter_callback('ble_publisher_messages_total', "Readings by publisher outcome",
+                             lambda: dict(((outcome,), count) for outcome, count in publisher.stats.items()),
+                             labels=('outcome',))
+    if publisher.spool is not None:
+        metrics.counter_callback('ble_spool_records_total', "Spool records appended, committed and dropped",
+                                 lambda: dict(((event,), count) for event, count in publisher.spool.stats.items()),
+                                 labels=('event',))
+
+class StartupTimer:
+    """Milliseconds from process start to each startup milestone of a scan."""
+    
+    def __init__(self, started=None):
+        # time.monotonic() when the process started
+        self.started = time.monotonic() if started is None else started
+        self.milestones = {}
+    
+    def mark(self, name):
+        """Record a milestone the first time it is reached."""
+        if name not in self.milestones:
+            self.milestones[name] = round((time.monotonic() - self.started) * 1000, 1)
+
+async def scan_ble_devices(startup=None):
+    """Scan for BLE devices and process beacon data as each advertisement arrives.
+    
+    Progress is recorded in `startup` (a StartupTimer) up to the first reading handed
+    to the publisher ('first_reading') and the first acknowledged by Kafka ('first_delivered').
+    """
+    global _first_publish_hook
+    startup = startup or StartupTimer()
+    if not _config_loaded:
+        reload_config()
+    startup.mark('config')
+    log.info("Starting BLE scan")
     
     # Get host ID
     host_id = get_host_id()
-    print(f"DEBUG: Host ID: {host_id}")
+    log.info("Host ID: %s", host_id)
+    startup.mark('host_id')
+    
+    def first_reading(message):
+        startup.mark('first_reading')
+        log.info("First reading published %.1fms after start", startup.milestones['first_reading'],
+                 extra=startup.milestones)
+    _first_publish_hook = first_reading
+    
+    def on_delivery(message, metadata, error):
+        if error is None and 'first_delivered' not in startup.milestones:
+            startup.mark('first_delivered')
+            log.info("First reading delivered to Kafka %.1fms after start", startup.milestones['first_delivered'])
     
-    # Create Kafka producer
-    producer = create_kafka_producer()
+    # Optional metrics endpoint
+    metrics_server = create_metrics_server()
+    metrics = metrics_server.registry if metrics_server is not None else None
     
-    # Create beacon processor
-    process_beacon = create_beacon_processor(host_id, producer)
+    # Create the background publisher; it connects to Kafka from its own thread
+    publisher = create_publisher(on_delivery=on_delivery, metrics=metrics)
+    startup.mark('publisher')
     
-    # Counter for logging
-    scan_count = 0
+    # Optional local archive of every reading
+    archive = create_archive(host_id)
     
     # Flag to check if scanning should continue
     # This will be checked by the GUI thread
     global _scanning_active
     _scanning_active = True
     
+    # Counters for logging
+    stats = {'advertisements': 0, 'beacons': 0, 'config_reloads': 0, 'config_rejected': 0}
+    
+    # The processing stages are rebuilt when their configuration changes while scanning;
+    # detection_callback() and the scan loop always use the current ones
+    coalescer = batcher = process_beacon = recorder = deduplicator = window = None
+    advertisement_filter = create_filter()
+    
+    def build_stages():
+        """Create the coalescing and batch stages and the beacon processor from the current configuration."""
+        nonlocal coalescer, batcher, process_beacon, window
+        window = create_reading_window(host_id, publisher)
+        coalescer = create_coalescer(host_id, publisher) if window is None else None
+        deliver = create_reading_sink(host_id, publisher, coalescer, window, archive)
+        batcher = create_batcher(deliver)
+        process_beacon = create_beacon_processor(deliver, batcher)
+        if beacons_decoded is not None:
+            process_beacon = count_beacons(process_beacon, beacons_decoded)
+    
+    def build_scanner_stages():
+        """Open the capture recorder and create the cross-adapter deduplicator, if configured."""
+        nonlocal recorder, deduplicator
+        # Optionally record raw advertisements for later replay
+        record_file = config['scanner'].get('record_file', '')
+        recorder = CaptureWriter(os.path.expanduser(record_file)) if record_file else None
+        # Drops copies of advertisements heard by several adapters
+        deduplicator = create_deduplicator()
+    
+    def flush_stages():
+        """Deliver everything the current stages hold."""
+        if batcher is not None:
+            batcher.flush()
+        if coalescer is not None:
+            coalescer.flush_all()
+        if window is not None:
+            window.flush()
+    
+    # Metrics updated per advertisement; everything else is read from the stats at scrape time
+    beacons_decoded = parse_time = None
+    if metrics is not None:
+        from metrics import MICROSECOND_BUCKETS
+        beacons_decoded = metrics.counter('ble_beacons_total', "Beacons decoded, by type", labels=('type',))
+        parse_time = metrics.histogram('ble_parse_seconds', "Time to decode an advertisement and hand its "
+                                       "beacons to the pipeline", MICROSECOND_BUCKETS)
+        register_scan_metrics(metrics, stats, startup, publisher,
+                              lambda: (coalescer, batcher, deduplicator, advertisement_filter, window))
+        if archive is not None:
+            metrics.counter_callback('ble_archive_rows_total', "Readings written to and dropped from the archive",
+                                     lambda: {('written',): archive.stats['rows'],
+                                              ('dropped',): archive.stats['dropped']},
+                                     labels=('result',))
+    
+    build_stages()
+    build_scanner_stages()
+    
+    def detection_callback(device, advertisement_data, adapter=None):
+        """Handle an advertisement as soon as the scanner reports it."""
+        if not _scanning_active:
+            return
+        if deduplicator is not None and not deduplicator.accept(device, advertisement_data, adapter, time.monotonic()):
+            return
+        stats['advertisements'] += 1
+        # Captures are recorded before filtering, so they can be replayed under other rules
+        if recorder is not None:
+            recorder.write(time.time(), device, advertisement_data)
+        if advertisement_filter is not None and not advertisement_filter.accept(
+                device.address, advertisement_data.manufacturer_data, advertisement_data.service_data,
+                advertisement_data.rssi):
+            return
+        try:
+            if parse_time is not None:
+                started = time.perf_counter()
+                stats['beacons'] += process_advertisement(device, advertisement_data, process_beacon, adapter)
+                parse_time.observe(time.perf_counter() - started)
+            else:
+                stats['beacons'] += process_advertisement(device, advertisement_data, process_beacon, adapter)
+        except Exception:
+            log.exception("Error processing advertisement from %s", device.address)
+    
+    async def start_scanner():
+        """Create and start a scanner, falling back to active scanning where passive is unavailable."""
+        new_scanner = create_scanner(detection_callback, SCANNING_MODE)
+        try:
+            await new_scanner.start()
+        except Exception as e:
+            if SCANNING_MODE != 'passive':
+                raise
+            # Passive scanning is not available on every platform/backend
+            log.warning("Passive scanning unavailable (%s), falling back to active", e)
+            new_scanner = create_scanner(detection_callback, 'active')
+            await new_scanner.start()
+        return new_scanner
+    
+    async def apply_config_changes():
+        """Read a changed configuration file and apply it without stopping the scan.
+        
+        Invalid configurations are rejected as a whole. Otherwise only the parts whose
+        sections changed are replaced, between two advertisements.
+        """
+        nonlocal scanner, replay_done, advertisement_filter
+        try:
+            new_config = read_config(CONFIG_FILE, default_config())
+        except (OSError, configparser.Error) as e:
+            config_log.warning("Ignoring unreadable configuration change: %s", e)
+            stats['config_rejected'] += 1
+            return
+        problems = validate_config(new_config, default_config(), CONFIG_CHOICES)
+        if new_config.has_section('routing'):
+            try:
+                parse_routes(new_config['routing'], default_route())
+            except ValueError as e:
+                problems.append(f"[routing] {e}")
+        try:
+            parse_filter(new_config['filter'])
+        except ValueError as e:
+            problems.append(f"[filter] {e}")
+        if problems:
+            config_log.warning("Ignoring invalid configuration change: %s", '; '.join(problems))
+            stats['config_rejected'] += 1
+            return
+        sections = changed_sections(config, new_config)
+        if not sections:
+            return
+        
+        old_scanner_config = dict(config['scanner'])
+        set_config(new_config)
+        config_log.info("Applying configuration change to %s", ', '.join(sorted(sections)))
+        stats['config_reloads'] += 1
+        
+        if sections & PRODUCER_SECTIONS and publisher is not None:
+            publisher_config = config['publisher']
+            try:
+                publisher.reconfigure(
+                    topic=KAFKA_TOPIC,
+                    max_queue_size=publisher_config.getint('queue_size', 10000),
+                    overflow_policy=publisher_config.get('overflow_policy', 'drop-oldest'),
+                    batch_size=publisher_config.getint('batch_size', 500),
+                    linger_ms=publisher_config.getint('linger_ms', 20),
+                    block_timeout=publisher_config.getfloat('block_timeout', 1.0),
+                    keyed=config['kafka'].get('message_key', 'identity') != 'none',
+                    # The broker, serialization, routes, compression and linger are producer settings
+                    reconnect=True
+                )
+            except ValueError as e:
+                config_log.warning("Invalid publisher configuration (%s), keeping the previous settings", e)
+        for section in sorted(sections & {'spool', 'metrics', 'archive'}):
+            config_log.warning("[%s] settings take effect when scanning is restarted", section)
+        
+        if sections & STAGE_SECTIONS:
+            flush_stages()
+            build_stages()
+        
+        if 'filter' in sections:
+            advertisement_filter = create_filter()
+        
+        if sections & SCANNER_SECTIONS:
+            changed = {key for key in set(old_scanner_config) | set(config['scanner'])
+                       if old_scanner_config.get(key) != config['scanner'].get(key)}
+            if changed & {'record_file', 'adapters', 'dedup_window_ms', 'backend'}:
+                if recorder is not None:
+                    recorder.close()
+                build_scanner_stages()
+            if changed - {'record_file', 'dedup_window_ms', 'reload_interval'}:
+                # Start the new scanner before stopping the old one so no advertisements are missed
+                try:
+                    new_scanner = await start_scanner()
+                except Exception:
+                    log.exception("Could not start a scanner with the new settings, keeping the current one")
+                else:
+                    old_scanner, scanner = scanner, new_scanner
+                    replay_done = scanner.done if isinstance(scanner, ReplayScanner) else None
+                    try:
+                        await old_scanner.stop()
+                    except Exception as e:
+                        log.error("Error stopping the previous scanner: %s", e)
+                    log.info("Scanner restarted with the new settings")
+    
+    scanner = None
+    replay_done = None
     try:
-        print("DEBUG: Starting continuous scan loop")
+        scanner = await start_scanner()
+        
+        startup.mark('scanner')
+        log.info("Scanner started, waiting for advertisements")
+        last_report = time.monotonic()
+        replay_done = scanner.done if isinstance(scanner, ReplayScanner) else None
+        watcher = ConfigWatcher(CONFIG_FILE)
+        next_config_check = 0.0
         while _scanning_active:
-            scan_count += 1
-            print(f"DEBUG: Starting scan #{scan_count}")
+            await asyncio.sleep(STOP_POLL_INTERVAL)
             
-            # Scan for devices
-            devices = await BleakScanner.discover(timeout=1.0)
-            print(f"DEBUG: Found {len(devices)} devices in scan #{scan_count}")
-            
-            # Check if scanning should stop
-            if not _scanning_active:
-                print("DEBUG: Scanning stopped by user")
+            # A replay that has played to the end stops the scan
+            if replay_done is not None and replay_done.is_set():
+                log.info("Replay finished")
                 break
             
-            # Process each device
-            beacons_found = 0
-            for device in devices:
-                print(f"DEBUG: Processing device: {device.address} ({device.name}), RSSI: {device.rssi}")
-                
-                # Extract manufacturer data
-                if device.metadata.get('manufacturer_data'):
-                    for company_code, data in device.metadata['manufacturer_data'].items():
-                        print(f"DEBUG: Found manufacturer data for company code {company_code}")
-                        
-                        # Check for iBeacon (Apple's company code is 0x004C)
-                        if company_code == 0x004C and len(data) >= 23:
-                            try:
-                                # Check for iBeacon identifier (0x02, 0x15)
-                                if data[0] == 0x02 and data[1] == 0x15:
-                                    # Parse iBeacon data
-                                    uuid_bytes = data[2:18]
-                                    uuid_str = str(uuid.UUID(bytes=bytes(uuid_bytes)))
-                                    major = int.from_bytes(data[18:20], byteorder='big')
-                                    minor = int.from_bytes(data[20:22], byteorder='big')
-                                    tx_power = data[22] - 256 if data[22] > 127 else data[22]
-                                    
-                                    beacon_data = {
-                                        'uuid': uuid_str,
-                                        'major': major,
-                                        'minor': minor,
-                                        'tx_power': tx_power,
-                                        'rssi': device.rssi,
-                                        'address': device.address,
-                                        'name': device.name or 'Unknown'
-                                    }
-                                    
-                                    print(f"DEBUG: Found iBeacon: UUID={uuid_str}, Major={major}, Minor={minor}, RSSI={device.rssi}")
-                                    process_beacon('iBeacon', beacon_data)
-                                    beacons_found += 1
-                            except Exception as e:
-                                print(f"DEBUG: Error processing iBeacon data: {e}")
-                                import traceback
-                                print(traceback.format_exc())
-                        
-                        # Check for Eddystone beacons
-                        elif company_code == 0x00AA and len(data) >= 20:  # Google's company code
-                            try:
-                                # Check for Eddystone identifier
-                                if data[0] == 0xAA and data[1] == 0xFE:
-                                    frame_type = data[2]
-                                    
-                                    if frame_type == 0x00:  # Eddystone-UID
-                                        namespace = bytes(data[3:13]).hex()
-                                        instance = bytes(data[13:19]).hex()
-                                        
-                                        beacon_data = {
-                                            'namespace': namespace,
-                                            'instance': instance,
-                                            'rssi': device.rssi,
-                                            'address': device.address,
-                                            'name': device.name or 'Unknown'
-                                        }
-                                        
-                                        print(f"DEBUG: Found Eddystone-UID: Namespace={namespace}, Instance={instance}, RSSI={device.rssi}")
-                                        process_beacon('Eddystone-UID', beacon_data)
-                                        beacons_found += 1
-                                    
-                                    elif frame_type == 0x10:  # Eddystone-URL
-                                        url_scheme = ['http://www.', 'https://www.', 'http://', 'https://'][data[3]]
-                                        url_data = bytes(data[4:]).decode('ascii')
-                                        url = url_scheme + url_data
-                                        
-                                        beacon_data = {
-                                            'url': url,
-                                            'rssi': device.rssi,
-                                            'address': device.address,
-                                            'name': device.name or 'Unknown'
-                                        }
-                                        
-                                        print(f"DEBUG: Found Eddystone-URL: URL={url}, RSSI={device.rssi}")
-                                        process_beacon('Eddystone-URL', beacon_data)
-                                        beacons_found += 1
-                            except Exception as e:
-                                print(f"DEBUG: Error processing Eddystone data: {e}")
-                                import traceback
-                                print(traceback.format_exc())
-                        
-                        # Check for AltBeacon
-                        elif len(data) >= 24:
-                            try:
-                                # AltBeacon has a different structure but similar concept
-                                beacon_id = bytes(data[2:22]).hex()
-                                
-                                beacon_data = {
-                                    'beacon_id': beacon_id,
-                                    'rssi': device.rssi,
-                                    'address': device.address,
-                                    'name': device.name or 'Unknown'
-                                }
-                                
-                                print(f"DEBUG: Found possible AltBeacon: ID={beacon_id}, RSSI={device.rssi}")
-                                process_beacon('AltBeacon', beacon_data)
-                                beacons_found += 1
-                            except Exception as e:
-                                print(f"DEBUG: Error processing AltBeacon data: {e}")
-                                import traceback
-                                print(traceback.format_exc())
+            # Run the readings collected since the last tick through the batch stages
+            if batcher is not None:
+                batcher.flush()
+            
+            # Emit coalesced windows that have ended
+            if coalescer is not None:
+                coalescer.flush_due(time.time())
+            
+            # Publish the columnar window once it has ended
+            if window is not None:
+                window.flush_due(time.time())
             
-            print(f"DEBUG: Scan #{scan_count} found {beacons_found} beacons")
+            # Hand the archived readings to its writer as a row group when due
+            if archive is not None:
+                archive.flush_due(time.monotonic())
             
-            # Wait before next scan
-            await asyncio.sleep(0)
+            # Apply configuration changes made while scanning
+            now = time.monotonic()
+            reload_interval = config['scanner'].getfloat('reload_interval', 1.0)
+            if reload_interval > 0 and now >= next_config_check:
+                next_config_check = now + reload_interval
+                if watcher.poll(now):
+                    await apply_config_changes()
+            
+            # Periodic summary instead of a per-window report
+            if now - last_report >= SUMMARY_INTERVAL:
+                log.info("Received %d advertisements, %d beacons so far",
+                         stats['advertisements'], stats['beacons'], extra=stats)
+                if deduplicator is not None:
+                    log.info("Adapters: %s; %d duplicate advertisements dropped",
+                             ', '.join(f"{adapter} {count}" for adapter, count in deduplicator.adapter_counts.items()),
+                             deduplicator.stats['duplicates'])
+                if advertisement_filter is not None:
+                    log.info("Filter rejected %d advertisements, accepted %d",
+                             advertisement_filter.stats['rejected'], advertisement_filter.stats['accepted'],
+                             extra=advertisement_filter.stats)
+                last_report = now
+        
+        log.info("Scanning stopped by user")
     except asyncio.CancelledError:
-        print("DEBUG: BLE scan was cancelled")
+        log.info("BLE scan was cancelled")
         raise
-    except Exception as e:
-        print(f"DEBUG: Error in BLE scan: {e}")
-        import traceback
-        print(traceback.format_exc())
+    except Exception:
+        log.exception("Error in BLE scan")
     finally:
-        print("DEBUG: BLE scan ended")
-        if producer:
-            producer.close()
-            print("DEBUG: Kafka producer closed")
+        _scanning_active = False
+        if scanner is not None:
+            try:
+                await scanner.stop()
+            except Exception as e:
+                log.error("Error stopping scanner: %s", e)
+        log.info("BLE scan ended")
+        if recorder is not None:
+            recorder.close()
+        flush_stages()
+        # After the final flush, which may publish the first reading of a short scan
+        _first_publish_hook = None
+        if archive is not None:
+            archive.close()
+        if publisher:
+            publisher.close()
+            log.info("Kafka producer closed")
+        if metrics_server is not None:
+            metrics_server.close()
 
 # Add a function to stop scanning
 def stop_scanning():
     """Stop the BLE scanning process."""
     global _scanning_active
-    print("DEBUG: Stopping scanning")
+    log.info("Stopping scanning")
     _scanning_active = False
 
-def reload_config():
-    """Reload configuration from file."""
-    global KAFKA_BROKER, KAFKA_TOPIC, config
+def set_config(new_config):
+    """Make new_config the active configuration and update the settings derived from it."""
+    global KAFKA_BROKER, KAFKA_TOPIC, KAFKA_SERIALIZATION, SCANNING_MODE, config, _config_loaded
     
-    # Reload configuration
-    config = load_config()
+    config = new_config
+    configure_logging(config)
+    _config_loaded = True
     
     # Update global variables
     KAFKA_BROKER = os.environ.get('KAFKA_BROKER', config['kafka']['broker'])
     KAFKA_TOPIC = os.environ.get('KAFKA_TOPIC', config['kafka']['topic'])
+    KAFKA_SERIALIZATION = os.environ.get('KAFKA_SERIALIZATION', config['kafka']['serialization'])
+    SCANNING_MODE = os.environ.get('BLE_SCANNING_MODE', config['scanner']['scanning_mode'])
+
+def reload_config(config_file=None):
+    """Reload configuration from file (~/.ble/config.conf unless config_file is given)."""
+    global CONFIG_FILE
+    
+    # Reload configuration
+    if config_file:
+        CONFIG_FILE = config_file
+    set_config(load_config())
     
-    print(f"DEBUG: Reloaded configuration - Kafka broker: {KAFKA_BROKER}, topic: {KAFKA_TOPIC}")
+    config_log.info("Reloaded configuration - Kafka broker: %s, topic: %s, scanning mode: %s",
+                    KAFKA_BROKER, KAFKA_TOPIC, SCANNING_MODE)
     
     return config
 
@@ -0,0 +1,145 @@
+"""
+Vectorized RSSI smoothing across all tracked beacons.
+
+Raw per-packet RSSI jumps by several dB between consecutive advertisements. The
+smoother keeps one filter state per beacon in NumPy arrays indexed by beacon slot
+and updates every beacon in a batch with a handful of array operations:
+
+    ema      estimate += alpha * (rssi - estimate)
+    kalman   1-D random-walk Kalman filter; process_noise is the variance added per
+             reading, measurement_noise the variance of a single RSSI reading (dB^2)
+
+The filtered value is attached to each reading as 'rssi_filtered'. A beacon not seen
+for idle_timeout seconds starts again from its next raw reading, and when all
+max_beacons slots are in use the least recently seen beacon gives up its slot.
+"""
+
+import numpy as np
+
+METHOD_EMA = 'ema'
+METHOD_KALMAN = 'kalman'
+METHODS = (METHOD_EMA, METHOD_KALMAN)
+
+
+class RssiSmoother:
+    """Per-beacon EMA or Kalman RSSI filters, updated a batch at a time."""
+
+    def __init__(self, method=METHOD_EMA, alpha=0.3, process_noise=0.5, measurement_noise=16.0,
+                 max_beacons=4096, idle_timeout=30.0):
+        if method not in METHODS:
+            raise ValueError(f"Unknown smoothing method '{method}', expected one of {METHODS}")
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError(f"Smoothing alpha must be in (0, 1], got {alpha}")
+
+        self.method = method
+        self.alpha = alpha
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.max_beacons = max_beacons
+        self.idle_timeout = idle_timeout
+
+        # Per-slot filter state
+        self._estimate = np.zeros(max_beacons, dtype=np.float64)
+        self._variance = np.zeros(max_beacons, dtype=np.float64)
+        self._last_seen = np.zeros(max_beacons, dtype=np.float64)
+        self._initialised = np.zeros(max_beacons, dtype=bool)
+
+        self._slots = {}
+        self._keys = [None] * max_beacons
+        self._free = list(range(max_beacons - 1, -1, -1))
+
+        self.stats = {'updates': 0, 'evicted': 0}
+
+    def tracked_beacons(self):
+        """Return the number of beacons with filter state."""
+        return len(self._slots)
+
+    def slots_for(self, keys):
+        """Return an array with the slot of each beacon key, assigning slots to new beacons."""
+        slots = np.empty(len(keys), dtype=np.intp)
+        lookup = self._slots
+        for i, key in enumerate(keys):
+            slot = lookup.get(key)
+            if slot is None:
+                slot = self._assign(key)
+            slots[i] = slot
+        return slots
+
+    def update(self, slots, rssi, times):
+        """Feed one reading per element into the slot filters; returns the filtered RSSI.
+
+        Readings for the same slot are applied in array order, so a batch gives the
+        same result as feeding its readings one at a time.
+        """
+        filtered = np.empty(len(slots), dtype=np.float64)
+        if not len(slots):
+            return filtered
+
+        # Split the batch into rounds in which every slot occurs at most once; a beacon's
+        # n-th reading in the batch goes into round n
+        rank = _occurrence_rank(slots)
+        rounds = int(rank.max()) + 1
+        for r in range(rounds):
+            index = np.flatnonzero(rank == r) if rounds > 1 else slice(None)
+            filtered[index] = self._update_unique(slots[index], rssi[index], times[index])
+
+        self.stats['updates'] += len(slots)
+        return filtered
+
+    def process(self, batch):
+        """Batch stage: attach 'rssi_filtered' to every reading in a ReadingBatch."""
+        filtered = self.update(self.slots_for(batch.keys), batch.rssi, batch.times)
+        batch.rssi_filtered = filtered
+        for beacon_data, value in zip(batch.data, np.round(filtered, 2).tolist()):
+            beacon_data['rssi_filtered'] = value
+
+    def _update_unique(self, slots, rssi, times):
+        """Update filters for a set of distinct slots."""
+        estimate = self._estimate[slots]
+        # New, evicted and idle beacons restart from the raw reading
+        fresh = ~self._initialised[slots] | (times - self._last_seen[slots] > self.idle_timeout)
+
+        if self.method == METHOD_EMA:
+            estimate += self.alpha * (rssi - estimate)
+            estimate = np.where(fresh, rssi, estimate)
+        else:
+            variance = self._variance[slots] + self.process_noise
+            gain = variance / (variance + self.measurement_noise)
+            estimate += gain * (rssi - estimate)
+            variance *= 1.0 - gain
+            estimate = np.where(fresh, rssi, estimate)
+            self._variance[slots] = np.where(fresh, self.measurement_noise, variance)
+
+        self._estimate[slots] = estimate
+        self._last_seen[slots] = times
+        self._initialised[slots] = True
+        return estimate
+
+    def _assign(self, key):
+        """Give a new beacon a slot, evicting the least recently seen beacon if needed."""
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = int(np.argmin(self._last_seen))
+            del self._slots[self._keys[slot]]
+            self.stats['evicted'] += 1
+        self._slots[key] = slot
+        self._keys[slot] = key
+        # The first reading initialises the filter; until then the slot is not evictable
+        self._initialised[slot] = False
+        self._last_seen[slot] = np.inf
+        return slot
+
+
+def _occurrence_rank(slots):
+    """Return, for each element, how many earlier elements have the same slot."""
+    order = np.argsort(slots, kind='stable')
+    ordered = slots[order]
+    positions = np.arange(len(slots))
+    starts = np.empty(len(slots), dtype=bool)
+    starts[0] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=starts[1:])
+    group_start = np.maximum.accumulate(np.where(starts, positions, 0))
+    rank = np.empty(len(slots), dtype=np.intp)
+    rank[order] = positions - group_start
+    return rank
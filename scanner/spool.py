@@ -0,0 +1,275 @@
+"""
+Disk-backed store-and-forward spool for readings that could not be delivered.
+
+The spool is an append-only log split into fixed-size segment files. Each segment is
+preallocated and written through a memory map, so an append is a memory copy; a
+record is framed as
+
+    length u32 | crc32 u32 | payload
+
+and a zero length marks the end of the written data in a segment. Readers consume
+records in order and commit their position once the records have been delivered.
+The committed position is kept in a small index file, so after a restart replay
+resumes where it left off, and segments that are entirely behind it are deleted.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from logging_config import get_logger
+
+log = get_logger('publisher')
+
+FRAME = struct.Struct('<II')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+INDEX_FILE = 'spool.index'
+
+
+class Spool:
+    """Segmented, memory-mapped append-only log with a committed read position."""
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, max_segments=64):
+        self.directory = os.path.expanduser(directory)
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._write_seq = None
+        self._write_map = None
+        self._write_file = None
+        self._write_offset = 0
+        self._read_maps = {}
+
+        self.stats = {'appended': 0, 'committed': 0, 'dropped': 0}
+
+        self._segments = self._list_segments()
+        self._committed = self._load_index()
+        if not self._segments:
+            self._segments = [self._committed[0]]
+        self._read_pos = self._committed
+        self._open_for_write(self._segments[-1])
+
+        backlog = self.backlog_segments()
+        if self.pending():
+            log.info("Spool %s has undelivered records in %d segment(s)", self.directory, backlog)
+
+    def append(self, payload):
+        """Append one record."""
+        self.append_many((payload,))
+
+    def append_many(self, payloads):
+        """Append several records and sync them to disk."""
+        with self._lock:
+            for payload in payloads:
+                size = FRAME.size + len(payload)
+                if size + FRAME.size > self.segment_size:
+                    log.error("Record of %d bytes does not fit in a spool segment, dropped", len(payload))
+                    self.stats['dropped'] += 1
+                    continue
+                if self._write_offset + size > self.segment_size - FRAME.size:
+                    self._roll()
+                FRAME.pack_into(self._write_map, self._write_offset, len(payload), zlib.crc32(payload))
+                start = self._write_offset + FRAME.size
+                self._write_map[start:start + len(payload)] = payload
+                self._write_offset += size
+                self.stats['appended'] += 1
+            self._write_map.flush()
+
+    def append_messages(self, messages):
+        """Append message dicts as JSON records."""
+        self.append_many([json.dumps(message).encode('utf-8') for message in messages])
+
+    def pending(self):
+        """Return True if there are records after the read position."""
+        with self._lock:
+            return self._read_pos != (self._write_seq, self._write_offset)
+
+    def backlog_segments(self):
+        """Return the number of segments holding undelivered records."""
+        with self._lock:
+            return sum(1 for seq in self._segments if seq >= self._committed[0])
+
+    def read_batch(self, max_records):
+        """Return up to max_records payloads after the read position, oldest first.
+
+        The read position advances; call commit() once the batch has been delivered or
+        rewind() to read it again.
+        """
+        with self._lock:
+            batch = []
+            seq, offset = self._read_pos
+            while len(batch) < max_records:
+                if seq == self._write_seq and offset >= self._write_offset:
+                    break
+                buf = self._map_for_read(seq)
+                frame = self._read_frame(buf, offset)
+                if frame is None:
+                    # End of this segment; move on to the next one
+                    next_seqs = [s for s in self._segments if s > seq]
+                    if not next_seqs:
+                        break
+                    seq, offset = next_seqs[0], 0
+                    continue
+                payload, offset = frame
+                batch.append(payload)
+            self._read_pos = (seq, offset)
+            return batch
+
+    def read_messages(self, max_records):
+        """Return up to max_records JSON records as message dicts."""
+        messages = []
+        for payload in self.read_batch(max_records):
+            try:
+                messages.append(json.loads(payload))
+            except ValueError:
+                log.warning("Skipping unreadable spool record")
+        return messages
+
+    def commit(self):
+        """Mark everything read so far as delivered and delete fully consumed segments."""
+        with self._lock:
+            self._committed = self._read_pos
+            self._write_index()
+            for seq in [s for s in self._segments if s < self._committed[0]]:
+                self._delete_segment(seq)
+
+    def rewind(self):
+        """Move the read position back to the last commit."""
+        with self._lock:
+            self._read_pos = self._committed
+
+    def close(self):
+        """Sync and close all segment files."""
+        with self._lock:
+            for buf in self._read_maps.values():
+                buf.close()
+            self._read_maps.clear()
+            if self._write_map is not None:
+                self._write_map.flush()
+                self._write_map.close()
+                self._write_file.close()
+                self._write_map = self._write_file = None
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self):
+        """Return the sequence numbers of the segment files on disk, in order."""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def _load_index(self):
+        """Read the committed position, defaulting to the start of the oldest segment."""
+        default = (self._segments[0] if self._segments else 0, 0)
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+            position = (int(index['segment']), int(index['offset']))
+        except FileNotFoundError:
+            return default
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning("Ignoring corrupt spool index: %s", e)
+            return default
+        if position[0] not in self._segments:
+            # The committed segment is gone; resume at the oldest one still on disk
+            return default
+        return position
+
+    def _write_index(self):
+        """Atomically persist the committed position."""
+        path = os.path.join(self.directory, INDEX_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'segment': self._committed[0], 'offset': self._committed[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.stats['committed'] += 1
+
+    def _open_for_write(self, seq):
+        """Map a segment for appending, positioned after its last valid record."""
+        path = self._segment_path(seq)
+        f = open(path, 'a+b')
+        if os.path.getsize(path) < self.segment_size:
+            f.truncate(self.segment_size)
+        buf = mmap.mmap(f.fileno(), self.segment_size)
+
+        offset = 0
+        while True:
+            frame = self._read_frame(buf, offset)
+            if frame is None:
+                break
+            offset = frame[1]
+
+        self._write_seq = seq
+        self._write_file = f
+        self._write_map = buf
+        self._write_offset = offset
+        if seq not in self._segments:
+            self._segments.append(seq)
+
+    def _roll(self):
+        """Seal the current segment and start the next one, enforcing max_segments."""
+        self._write_map.flush()
+        self._write_map.close()
+        self._write_file.close()
+        self._open_for_write(self._write_seq + 1)
+
+        while len(self._segments) > self.max_segments:
+            oldest = self._segments[0]
+            if self._committed[0] <= oldest:
+                log.warning("Spool full, dropping undelivered segment %d", oldest)
+                self.stats['dropped'] += 1
+                self._committed = (self._segments[1], 0)
+                if self._read_pos[0] <= oldest:
+                    self._read_pos = self._committed
+                self._write_index()
+            self._delete_segment(oldest)
+
+    def _delete_segment(self, seq):
+        buf = self._read_maps.pop(seq, None)
+        if buf is not None:
+            buf.close()
+        try:
+            os.remove(self._segment_path(seq))
+        except FileNotFoundError:
+            pass
+        self._segments.remove(seq)
+
+    def _map_for_read(self, seq):
+        """Return a buffer for reading a segment."""
+        if seq == self._write_seq:
+            return self._write_map
+        buf = self._read_maps.get(seq)
+        if buf is None:
+            with open(self._segment_path(seq), 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_maps[seq] = buf
+        return buf
+
+    @staticmethod
+    def _read_frame(buf, offset):
+        """Return (payload, next offset) for the record at offset, or None at end of data."""
+        if offset + FRAME.size > len(buf):
+            return None
+        length, crc = FRAME.unpack_from(buf, offset)
+        start = offset + FRAME.size
+        if length == 0 or start + length > len(buf):
+            return None
+        payload = bytes(buf[start:start + length])
+        if zlib.crc32(payload) != crc:
+            # Torn write from a crash; treat as the end of the segment
+            return None
+        return payload, start + length
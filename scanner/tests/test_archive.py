@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from archive import ReadingArchive, archive_files, beacon_name, query  # noqa: E402
+
+# An hour boundary, in epoch seconds
+HOUR = 1792245600
+
+IBEACON = {'uuid': 'f7826da6-4fa2-4e98-8024-bc5b71e0893e', 'major': 1, 'minor': 2, 'tx_power': -59,
+           'address': 'AA:BB:CC:DD:EE:01', 'name': 'Desk'}
+EDDYSTONE = {'namespace': 'edd1ebeac04e5defa017', 'instance': '0123456789ab', 'tx_power': -62,
+             'address': 'AA:BB:CC:DD:EE:02', 'name': 'Door'}
+
+
+def write(directory, readings, **kwargs):
+    archive = ReadingArchive(directory, 'scanner-1', flush_interval=3600, **kwargs)
+    for beacon_type, beacon_data, now in readings:
+        archive.add(beacon_type, beacon_data, now)
+    archive.close()
+    return archive
+
+
+def readings():
+    """Two beacons, one reading each every 10 minutes from half an hour before HOUR to half an hour after."""
+    result = []
+    for i in range(6):
+        now = HOUR - 1800 + i * 600
+        result.append(('iBeacon', dict(IBEACON, rssi=-60 - i), now))
+        result.append(('Eddystone-UID', dict(EDDYSTONE, rssi=-70 - i), now + 1))
+    return result
+
+
+def test_hourly_rollover(tmp_path):
+    archive = write(tmp_path, readings())
+    assert archive.stats['rows'] == 12
+    # One row group, split where it crosses into the next hour
+    assert archive.stats['files'] == 2 and archive.stats['row_groups'] == 2
+
+    files = archive_files(tmp_path)
+    assert [hour for hour, _ in files] == [HOUR // 3600 - 1, HOUR // 3600]
+    assert [os.path.relpath(os.path.dirname(path), tmp_path) for _, path in files] == [
+        os.path.join('date=2026-10-17', 'hour=13'), os.path.join('date=2026-10-17', 'hour=14')]
+    # Files are renamed once complete
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith('.tmp')]
+
+
+def test_rollover_between_row_groups(tmp_path):
+    archive = write(tmp_path, readings(), row_group_size=4)
+    assert archive.stats['rows'] == 12
+    assert len(archive_files(tmp_path)) == 2
+    assert query(tmp_path).num_rows == 12
+
+
+def test_query_time_range(tmp_path):
+    write(tmp_path, readings())
+    assert query(tmp_path).num_rows == 12
+
+    # Only the second hour's file is opened, and the end is exclusive
+    table = query(tmp_path, start=HOUR, end=HOUR + 1200)
+    assert table.column('rssi').to_pylist() == [-63, -73, -64, -74]
+    assert query(tmp_path, start=HOUR + 7200).num_rows == 0
+
+
+def test_query_filters_and_columns(tmp_path):
+    write(tmp_path, readings())
+    desk = beacon_name('iBeacon', IBEACON)
+    table = query(tmp_path, beacons=[desk], min_rssi=-62, columns=['beacon', 'rssi', 'host_id'])
+    assert table.column_names == ['beacon', 'rssi', 'host_id']
+    assert table.to_pylist() == [{'beacon': desk, 'rssi': rssi, 'host_id': 'scanner-1'} for rssi in (-60, -61, -62)]
+
+    table = query(tmp_path, types=['Eddystone-UID'], columns=['namespace', 'uuid'])
+    assert set(table.column('namespace').to_pylist()) == {EDDYSTONE['namespace']}
+    assert set(table.column('uuid').to_pylist()) == {None}
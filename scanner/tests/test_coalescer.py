@@ -0,0 +1,21 @@
+import pytest
+
+from coalescer import BeaconCoalescer
+
+
+@pytest.mark.parametrize('settings', [{'window_ms': 0}, {'max_beacons': 0}, {'max_samples': 0}],
+                         ids=['window_ms', 'max_beacons', 'max_samples'])
+def test_rejects_non_positive_settings(settings):
+    with pytest.raises(ValueError):
+        BeaconCoalescer(lambda *args: None, **settings)
+
+
+def test_one_record_per_window():
+    emitted = []
+    coalescer = BeaconCoalescer(lambda *args: emitted.append(args), window_ms=1000, max_samples=1)
+    reading = {'uuid': 'f7826da6-4fa2-4e98-8024-bc5b71e0893e', 'major': 1, 'minor': 2}
+    for i, rssi in enumerate((-60, -70, -65)):
+        coalescer.add('iBeacon', dict(reading, rssi=rssi), 100.0 + i * 0.1)
+    assert coalescer.flush_due(101.0) == 1
+    beacon_type, data, _ = emitted[0]
+    assert (data['rssi_count'], data['rssi_min'], data['rssi_max']) == (3, -70, -60)
@@ -0,0 +1,89 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from columnar import ReadingWindow, is_window, window_arrays
+from wire_format import decode_message, encode_record, message_readings, serialize_json
+
+BASE = 1790000000.0
+
+IBEACON = {'uuid': 'f7826da6-4fa2-4e98-8024-bc5b71e0893e', 'major': 1, 'minor': 2, 'tx_power': -59,
+           'address': 'AA:BB:CC:DD:EE:01', 'name': 'Desk'}
+EDDYSTONE = {'namespace': 'edd1ebeac04e5defa017', 'instance': '0123456789ab', 'tx_power': -62,
+             'address': 'AA:BB:CC:DD:EE:02', 'name': 'Door'}
+ALTBEACON = {'beacon_id': 'f7826da64fa24e988024bc5b71e0893e00010002', 'tx_power': -58,
+             'address': 'AA:BB:CC:DD:EE:03', 'name': 'Shelf'}
+
+# (type, identity, reading fields); the smoothing and distance stages only ran for some readings
+READINGS = [
+    ('iBeacon', IBEACON, {'rssi': -60, 'rssi_filtered': -61.5, 'distance_m': 2.25, 'proximity': 'near'}),
+    ('Eddystone-UID', EDDYSTONE, {'rssi': -70}),
+    ('iBeacon', IBEACON, {'rssi': -64, 'rssi_filtered': -62.0, 'distance_m': 2.5, 'proximity': 'near'}),
+    ('AltBeacon', ALTBEACON, {'rssi': -80, 'rssi_filtered': -79.75}),
+    ('Eddystone-UID', EDDYSTONE, {'rssi': -72}),
+]
+
+
+def collect(readings, **kwargs):
+    windows = []
+    window = ReadingWindow(windows.append, 'scanner-1', window_ms=10000, **kwargs)
+    for i, (beacon_type, identity, fields) in enumerate(readings):
+        window.add(beacon_type, dict(identity, **fields), BASE + i * 0.25)
+    window.flush()
+    return windows
+
+
+def expected_readings(readings):
+    expected = []
+    for i, (beacon_type, identity, fields) in enumerate(readings):
+        timestamp_ms = round((BASE + i * 0.25) * 1000)
+        reading = dict(identity, type=beacon_type, host_id='scanner-1', timestamp_ms=timestamp_ms,
+                       timestamp=datetime.datetime.fromtimestamp(timestamp_ms / 1000).isoformat())
+        # The proximity class is not carried
+        reading.update((field, value) for field, value in fields.items() if field != 'proximity')
+        expected.append(reading)
+    return expected
+
+
+@pytest.mark.parametrize('serialize', [encode_record, serialize_json], ids=['binary', 'json'])
+def test_round_trip(serialize):
+    [message] = collect(READINGS)
+    decoded = decode_message(serialize(message))
+    assert is_window(decoded)
+    assert message_readings(decoded) == expected_readings(READINGS)
+
+
+@pytest.mark.parametrize('serialize', [encode_record, serialize_json], ids=['binary', 'json'])
+def test_window_arrays(serialize):
+    [message] = collect(READINGS)
+    window = window_arrays(decode_message(serialize(message)))
+    assert len(window) == 5
+    assert len(window.beacons) == 3
+    assert window.beacon_index.tolist() == [0, 1, 0, 2, 1]
+    assert window.timestamp_ms.tolist() == [round(BASE * 1000) + 250 * i for i in range(5)]
+    assert window.rssi.tolist() == [-60, -70, -64, -80, -72]
+    np.testing.assert_array_equal(window.rssi_filtered, [-61.5, np.nan, -62.0, -79.75, np.nan])
+    np.testing.assert_array_equal(window.distance_m, [2.25, np.nan, 2.5, np.nan, np.nan])
+
+
+def test_optional_columns_left_out():
+    readings = [(beacon_type, identity, {'rssi': fields['rssi']}) for beacon_type, identity, fields in READINGS]
+    [message] = collect(readings)
+    assert 'rssi_filtered' not in message and 'distance_m' not in message
+
+    window = window_arrays(decode_message(encode_record(message)))
+    assert window.rssi_filtered is None and window.distance_m is None
+    assert message_readings(decode_message(encode_record(message))) == expected_readings(readings)
+
+
+def test_max_readings_splits_windows():
+    windows = collect(READINGS, max_readings=2)
+    assert [len(window['beacon_index']) for window in windows] == [2, 2, 1]
+    readings = [reading for window in windows for reading in message_readings(window)]
+    assert readings == expected_readings(READINGS)
+
+
+def test_single_reading_passes_through():
+    message = dict(IBEACON, type='iBeacon', rssi=-60, host_id='scanner-1', timestamp='2026-10-17T14:00:00')
+    assert message_readings(message) == [message]
@@ -0,0 +1,24 @@
+import struct
+
+from decoders import COMPANY_APPLE, AltBeacon, IBeacon, decode_advertisement
+
+BEACON_ID = bytes(range(20))
+ALTBEACON_FRAME = b'\xbe\xac' + BEACON_ID + struct.pack('b', -58) + b'\x00'
+IBEACON_FRAME = b'\x02\x15' + bytes.fromhex('f7826da64fa24e988024bc5b71e0893e') + struct.pack('>HHb', 1, 2, -59)
+
+
+def test_altbeacon_under_any_company():
+    assert decode_advertisement({0x0118: ALTBEACON_FRAME}) == [AltBeacon(BEACON_ID.hex(), -58)]
+
+
+def test_altbeacon_under_company_with_registered_decoder():
+    assert decode_advertisement({COMPANY_APPLE: ALTBEACON_FRAME}) == [AltBeacon(BEACON_ID.hex(), -58)]
+
+
+def test_registered_decoder_takes_precedence():
+    assert decode_advertisement({COMPANY_APPLE: IBEACON_FRAME}) == [
+        IBeacon('f7826da6-4fa2-4e98-8024-bc5b71e0893e', 1, 2, -59)]
+
+
+def test_other_manufacturer_data_is_not_a_beacon():
+    assert decode_advertisement({COMPANY_APPLE: b'\x10\x05\x01\x18\x44\x00\x00'}) == []
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from batching import ReadingBatch
+from decoders import beacon_key
+from distance import ENVIRONMENTS, DistanceEstimator, calibration_key, parse_calibration
+from smoothing import RssiSmoother
+
+UUID = 'f7826da6-4fa2-4e98-8024-bc5b71e0893e'
+
+
+def ibeacon(minor, rssi, tx_power=-59):
+    data = {'uuid': UUID, 'major': 1, 'minor': minor, 'rssi': rssi}
+    if tx_power is not None:
+        data['tx_power'] = tx_power
+    return data
+
+
+def reference(rssi, tx_power, exponent):
+    return round(10 ** ((tx_power - rssi) / (10 * exponent)), 2)
+
+
+def process(estimator, data, smoother=None):
+    batch = ReadingBatch(['iBeacon'] * len(data), data, [0.0] * len(data))
+    if smoother is not None:
+        smoother.process(batch)
+    estimator.process(batch)
+    return data
+
+
+@pytest.mark.parametrize('environment', list(ENVIRONMENTS))
+def test_matches_scalar_reference(environment):
+    rng = np.random.default_rng(2)
+    data = [ibeacon(i % 7, int(rssi), int(tx_power))
+            for i, (rssi, tx_power) in enumerate(zip(rng.integers(-100, -30, 200), rng.integers(-75, -50, 200)))]
+    process(DistanceEstimator(environment), data)
+    exponent = ENVIRONMENTS[environment]
+    assert [reading['distance_m'] for reading in data] == [
+        reference(reading['rssi'], reading['tx_power'], exponent) for reading in data]
+
+
+@pytest.mark.parametrize('rssi, proximity', [(-50, 'immediate'), (-59, 'near'), (-70, 'near'), (-80, 'far')])
+def test_proximity(rssi, proximity):
+    [reading] = process(DistanceEstimator(path_loss_exponent=2.0), [ibeacon(1, rssi)])
+    assert reading['proximity'] == proximity
+
+
+def test_unknown_tx_power_is_skipped():
+    estimator = DistanceEstimator()
+    data = process(estimator, [ibeacon(1, -60, tx_power=None), ibeacon(2, -60)])
+    assert 'distance_m' not in data[0] and 'proximity' not in data[0]
+    assert 'distance_m' in data[1]
+    assert estimator.stats == {'estimated': 1, 'skipped': 1}
+
+    [reading] = process(DistanceEstimator(path_loss_exponent=2.0, default_tx_power=-60),
+                        [ibeacon(1, -60, tx_power=None)])
+    assert reading['distance_m'] == 1.0
+
+
+def test_calibration_overrides():
+    calibration = parse_calibration({
+        calibration_key(beacon_key('iBeacon', ibeacon(1, 0))): '-65',
+        calibration_key(beacon_key('iBeacon', ibeacon(2, 0))): '-70, 2.0',
+        calibration_key(beacon_key('iBeacon', ibeacon(3, 0))): ', 3.5',
+    })
+    estimator = DistanceEstimator(path_loss_exponent=2.7, calibration=calibration)
+    data = process(estimator, [ibeacon(minor, -75) for minor in (1, 2, 3, 4)])
+    assert [reading['distance_m'] for reading in data] == [
+        reference(-75, -65, 2.7),   # tx_power only
+        reference(-75, -70, 2.0),   # tx_power and exponent
+        reference(-75, -59, 3.5),   # exponent only; tx_power from the advertisement
+        reference(-75, -59, 2.7),   # not calibrated
+    ]
+
+
+def test_uses_smoothed_rssi():
+    data = process(DistanceEstimator(path_loss_exponent=2.0), [ibeacon(1, -60), ibeacon(1, -80)],
+                   smoother=RssiSmoother(alpha=0.5))
+    assert data[1]['rssi_filtered'] == -70.0
+    assert data[1]['distance_m'] == reference(-70, -59, 2.0)
+
+
+@pytest.mark.parametrize('value', ['-59, 2.0, 1', 'loud', '-59, steep'])
+def test_bad_calibration(value):
+    with pytest.raises(ValueError):
+        parse_calibration({'ibeacon/x/1/2': value})
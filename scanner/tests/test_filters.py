@@ -0,0 +1,115 @@
+import struct
+
+import pytest
+
+from decoders import COMPANY_APPLE, EDDYSTONE_SERVICE_UUID, EDDYSTONE_UID_LAYOUT
+from filters import AdvertisementFilter, parse_filter, split_values
+
+UUID = 'f7826da6-4fa2-4e98-8024-bc5b71e0893e'
+OTHER_UUID = '00000000-0000-0000-0000-000000000001'
+NAMESPACE = 'edd1ebeac04e5defa017'
+ADDRESS = '00:1a:7d:da:71:13'
+
+
+def ibeacon(uuid=UUID):
+    return {COMPANY_APPLE: b'\x02\x15' + bytes.fromhex(uuid.replace('-', '')) + struct.pack('>HHb', 1, 2, -59)}
+
+
+def eddystone_uid(namespace=NAMESPACE):
+    return {EDDYSTONE_SERVICE_UUID: EDDYSTONE_UID_LAYOUT.pack(0x00, -20, bytes.fromhex(namespace), bytes(6))}
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('', []),
+    ('a, b', ['a', 'b']),
+    (' a\n b,,c ', ['a', 'b', 'c']),
+])
+def test_split_values(value, expected):
+    assert split_values(value) == expected
+
+
+def test_parse_filter():
+    advertisement_filter = parse_filter({
+        'allow_uuids': UUID.upper(),
+        'allow_namespaces': NAMESPACE,
+        'deny_mac_prefixes': '00:1A:7D, 00-1B',
+        'deny_company_ids': '0x0006 76',
+        'min_rssi': '-90',
+    })
+    assert advertisement_filter.rules() == 7
+    assert advertisement_filter.min_rssi == -90
+    assert advertisement_filter.deny_company_ids == {0x0006: '0x0006', 0x004C: '0x004C'}
+
+
+@pytest.mark.parametrize('section', [
+    {'allow_uuids': 'f7826da6'},
+    {'deny_namespaces': 'not hex at all'},
+    {'allow_company_ids': 'apple'},
+    {'allow_company_ids': '0x10000'},
+    {'min_rssi': 'loud'},
+])
+def test_parse_filter_rejects_bad_rules(section):
+    with pytest.raises(ValueError):
+        parse_filter(section)
+
+
+def test_no_rules_accept_everything():
+    advertisement_filter = AdvertisementFilter()
+    assert advertisement_filter.accept(ADDRESS, {}, {}, -100)
+    assert advertisement_filter.stats == {'accepted': 1, 'rejected': 0}
+
+
+def test_uuid_rules():
+    advertisement_filter = AdvertisementFilter(allow_uuids=[UUID])
+    assert advertisement_filter.accept(ADDRESS, ibeacon(), {}, -60)
+    assert not advertisement_filter.accept(ADDRESS, ibeacon(OTHER_UUID), {}, -60)
+    assert advertisement_filter.hits == {('allow_uuids', UUID): 1, ('allow', 'none matched'): 1}
+
+    advertisement_filter = AdvertisementFilter(deny_uuids=[UUID])
+    assert not advertisement_filter.accept(ADDRESS, ibeacon(), {}, -60)
+    assert advertisement_filter.accept(ADDRESS, ibeacon(OTHER_UUID), {}, -60)
+
+
+def test_namespace_rules():
+    advertisement_filter = AdvertisementFilter(allow_namespaces=[NAMESPACE])
+    assert advertisement_filter.accept(ADDRESS, {}, eddystone_uid(), -60)
+    assert not advertisement_filter.accept(ADDRESS, {}, eddystone_uid('00' * 10), -60)
+    assert not advertisement_filter.accept(ADDRESS, ibeacon(), {}, -60)
+
+
+def test_address_prefix_rules():
+    advertisement_filter = AdvertisementFilter(deny_mac_prefixes=['00:1A', '00-1A-7D-DA'])
+    assert not advertisement_filter.accept(ADDRESS, {}, {}, -60)
+    assert advertisement_filter.accept('00:1B:7D:DA:71:13', {}, {}, -60)
+    # The longest matching prefix is the one counted
+    assert advertisement_filter.hits == {('deny_mac_prefixes', '00:1A:7D:DA'): 1}
+
+
+def test_company_rules():
+    advertisement_filter = AdvertisementFilter(allow_company_ids=['0x004C'])
+    assert advertisement_filter.accept(ADDRESS, {COMPANY_APPLE: b'\x10\x05'}, {}, -60)
+    assert not advertisement_filter.accept(ADDRESS, {0x0006: b'\x01'}, {}, -60)
+    assert advertisement_filter.hits[('allow_company_ids', '0x004C')] == 1
+
+
+def test_rssi_rule():
+    advertisement_filter = AdvertisementFilter(min_rssi=-80)
+    assert advertisement_filter.accept(ADDRESS, {}, {}, -80)
+    assert not advertisement_filter.accept(ADDRESS, {}, {}, -81)
+    assert advertisement_filter.accept(ADDRESS, {}, {}, None)
+    assert advertisement_filter.hits == {('min_rssi', -80): 1}
+
+
+def test_deny_takes_precedence_over_allow():
+    advertisement_filter = AdvertisementFilter(allow_uuids=[UUID], deny_mac_prefixes=['00:1A:7D'])
+    assert not advertisement_filter.accept(ADDRESS, ibeacon(), {}, -60)
+    assert advertisement_filter.accept('00:1B:7D:DA:71:13', ibeacon(), {}, -60)
+    assert advertisement_filter.hits == {('deny_mac_prefixes', '00:1A:7D'): 1, ('allow_uuids', UUID): 1}
+
+
+def test_any_allow_rule_is_enough():
+    advertisement_filter = AdvertisementFilter(allow_uuids=[UUID], allow_mac_prefixes=['00:1B'])
+    assert advertisement_filter.accept(ADDRESS, ibeacon(), {}, -60)
+    assert advertisement_filter.accept('00:1b:00:00:00:00', {}, {}, -60)
+    assert not advertisement_filter.accept(ADDRESS, {}, {}, -60)
+    assert advertisement_filter.stats == {'accepted': 2, 'rejected': 1}
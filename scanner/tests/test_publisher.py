@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from publisher import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL, KafkaPublisher
+from spool import Spool
+
+
+class FakeFuture:
+    def __init__(self, error):
+        self.error = error
+
+    def add_callback(self, callback, *args):
+        if self.error is None:
+            callback(*args, None)
+
+    def add_errback(self, errback, *args):
+        if self.error is not None:
+            errback(*args, self.error)
+
+    def succeeded(self):
+        return self.error is None
+
+
+class FakeProducer:
+    """Records what is sent; every send fails while `error` is set."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+        self.closed = False
+
+    def send(self, topic, message, key=None):
+        if self.error is None:
+            self.sent.append(message)
+        return FakeFuture(self.error)
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def readings(count):
+    return [{'type': 'iBeacon', 'uuid': 'u', 'major': 1, 'minor': i, 'rssi': -60} for i in range(count)]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        KafkaPublisher(FakeProducer(), 'beacons', overflow_policy='ignore')
+
+
+def test_drop_oldest():
+    producer = FakeProducer()
+    publisher = KafkaPublisher(producer, 'beacons', max_queue_size=2, overflow_policy=OVERFLOW_DROP_OLDEST)
+    assert all(publisher.publish(message) for message in readings(3))
+    assert publisher.stats['dropped'] == 1
+
+    publisher.close()
+    assert producer.sent == readings(3)[1:]
+    assert producer.closed
+
+
+def test_block_gives_up_after_timeout():
+    producer = FakeProducer()
+    # The worker lingers longer than the test, so nothing drains the queue
+    publisher = KafkaPublisher(producer, 'beacons', max_queue_size=2, overflow_policy=OVERFLOW_BLOCK,
+                               batch_size=100, linger_ms=60000, block_timeout=0.05)
+    publisher.start()
+    messages = readings(3)
+    assert publisher.publish(messages[0]) and publisher.publish(messages[1])
+    assert not publisher.publish(messages[2])
+    assert publisher.stats['dropped'] == 1
+
+    publisher.close()
+    assert producer.sent == messages[:2]
+
+
+def test_spill_to_spool(tmp_path):
+    spool = Spool(tmp_path)
+    publisher = KafkaPublisher(FakeProducer(), 'beacons', max_queue_size=2, overflow_policy=OVERFLOW_SPILL,
+                               spool=spool)
+    messages = readings(3)
+    assert all(publisher.publish(message) for message in messages)
+    assert publisher.stats['spilled'] == 1
+    assert spool.read_messages(10) == messages[2:]
+    publisher.close()
+
+
+def test_spill_without_spool_drops():
+    publisher = KafkaPublisher(FakeProducer(), 'beacons', max_queue_size=1, overflow_policy=OVERFLOW_SPILL)
+    messages = readings(2)
+    assert publisher.publish(messages[0])
+    assert not publisher.publish(messages[1])
+    assert publisher.stats['dropped'] == 1
+    publisher.close()
+
+
+def test_failed_sends_are_spooled_and_replayed_in_order(tmp_path):
+    producer = FakeProducer(error=ConnectionError("broker down"))
+    publisher = KafkaPublisher(producer, 'beacons', batch_size=5, linger_ms=1, retry_interval=0.05,
+                               spool=Spool(tmp_path))
+    publisher.start()
+    messages = readings(10)
+    for message in messages[:5]:
+        publisher.publish(message)
+    wait_for(lambda: publisher.stats['spilled'] == 5)
+    assert not publisher.broker_available()
+
+    # Readings published while the broker is down queue up behind the spooled ones
+    for message in messages[5:]:
+        publisher.publish(message)
+    producer.error = None
+    wait_for(lambda: producer.sent == messages)
+    assert publisher.broker_available()
+    publisher.close()
@@ -0,0 +1,49 @@
+from rollups import RollupAggregator
+
+BEACON = {'type': 'iBeacon', 'uuid': 'f7826da6-4fa2-4e98-8024-bc5b71e0893e', 'major': 1, 'minor': 2,
+          'host_id': 'scanner-1'}
+
+
+def reading(timestamp_ms, **fields):
+    return dict(BEACON, timestamp_ms=timestamp_ms, **fields)
+
+
+def close_all(aggregator):
+    """Close every bucket; returns the records of each resolution."""
+    records = {}
+    for name, _, record in aggregator.close_due(flush=True):
+        records.setdefault(name, []).append(record)
+    return records
+
+
+def test_raw_readings():
+    aggregator = RollupAggregator(resolutions=('1s',), percentiles=(50,))
+    for i, rssi in enumerate((-60, -70, -65)):
+        aggregator.add(reading(1000 + i * 100, rssi=rssi))
+    [record] = close_all(aggregator)['1s']
+    assert (record['count'], record['rssi_min'], record['rssi_max'], record['rssi_mean']) == (3, -70, -60, -65)
+    assert record['rssi_p50'] == -65
+
+
+def test_coalesced_records_keep_min_and_max():
+    aggregator = RollupAggregator(resolutions=('1s', '10s'), percentiles=(0, 50, 100))
+    aggregator.add(reading(1000, rssi=-66, rssi_count=10, rssi_min=-80, rssi_max=-55, rssi_mean=-66.4,
+                           rssi_median=-67))
+    aggregator.add(reading(2000, rssi=-60, rssi_count=4, rssi_min=-62, rssi_max=-50, rssi_mean=-58.0,
+                           rssi_median=-59.5))
+    closed = close_all(aggregator)
+    records = closed['1s']
+    assert [(r['count'], r['rssi_min'], r['rssi_max']) for r in records] == [(10, -80, -55), (4, -62, -50)]
+    assert records[0]['rssi_mean'] == -66.4
+    assert (records[0]['rssi_p0'], records[0]['rssi_p100']) == (-80, -55)
+
+    [merged] = closed['10s']
+    assert (merged['count'], merged['rssi_min'], merged['rssi_max']) == (14, -80, -50)
+    assert merged['rssi_mean'] == round((-66.4 * 10 - 58.0 * 4) / 14, 2)
+
+
+def test_single_reading_summary():
+    aggregator = RollupAggregator(resolutions=('1s',), percentiles=(50,))
+    aggregator.add(reading(1000, rssi=-70, rssi_count=1, rssi_min=-70, rssi_max=-70, rssi_mean=-70.0))
+    [record] = close_all(aggregator)['1s']
+    assert (record['count'], record['rssi_min'], record['rssi_max'], record['rssi_p50']) == (1, -70, -70, -70)
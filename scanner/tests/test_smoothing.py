@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from smoothing import METHOD_EMA, METHOD_KALMAN, RssiSmoother
+
+
+def reference(method, readings, alpha=0.3, process_noise=0.5, measurement_noise=16.0, idle_timeout=30.0):
+    """Filter (key, rssi, time) readings one at a time with plain Python arithmetic."""
+    state = {}
+    filtered = []
+    for key, rssi, now in readings:
+        previous = state.get(key)
+        if previous is None or now - previous[2] > idle_timeout:
+            estimate, variance = rssi, measurement_noise
+        elif method == METHOD_EMA:
+            estimate, variance = previous[0] + alpha * (rssi - previous[0]), 0.0
+        else:
+            variance = previous[1] + process_noise
+            gain = variance / (variance + measurement_noise)
+            estimate = previous[0] + gain * (rssi - previous[0])
+            variance *= 1.0 - gain
+        state[key] = (estimate, variance, now)
+        filtered.append(estimate)
+    return filtered
+
+
+def random_readings(count, beacons=20, seed=1):
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(0, beacons, count).tolist()
+    rssi = rng.integers(-95, -40, count).tolist()
+    # Mostly close together, with a few gaps longer than the idle timeout
+    times = np.cumsum(rng.choice([0.1, 0.1, 0.1, 40.0], count, p=[0.3, 0.3, 0.38, 0.02])).tolist()
+    return list(zip(keys, rssi, times))
+
+
+def run(smoother, readings, batch_size):
+    filtered = []
+    for start in range(0, len(readings), batch_size):
+        keys, rssi, times = zip(*readings[start:start + batch_size])
+        slots = smoother.slots_for(keys)
+        filtered.extend(smoother.update(slots, np.array(rssi, dtype=np.float64), np.array(times)).tolist())
+    return filtered
+
+
+@pytest.mark.parametrize('method', [METHOD_EMA, METHOD_KALMAN])
+@pytest.mark.parametrize('batch_size', [1, 7, 500])
+def test_matches_scalar_reference(method, batch_size):
+    readings = random_readings(500)
+    filtered = run(RssiSmoother(method), readings, batch_size)
+    np.testing.assert_allclose(filtered, reference(method, readings))
+
+
+def test_eviction_restarts_filter():
+    smoother = RssiSmoother(METHOD_EMA, alpha=0.5, max_beacons=2)
+    run(smoother, [('a', -60, 0.0), ('b', -70, 1.0), ('a', -80, 2.0)], 1)
+    # 'c' takes the slot of 'b', the least recently seen beacon, and 'b' then takes the slot of 'c'
+    assert run(smoother, [('c', -50, 3.0), ('a', -40, 4.0), ('b', -90, 5.0)], 1) == [-50.0, -55.0, -90.0]
+    assert smoother.stats['evicted'] == 2
+    assert smoother.tracked_beacons() == 2
+
+
+def test_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        RssiSmoother('median')
+    with pytest.raises(ValueError):
+        RssiSmoother(alpha=0.0)
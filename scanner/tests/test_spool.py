@@ -0,0 +1,75 @@
+import os
+
+from spool import FRAME, SEGMENT_PREFIX, Spool
+
+
+def payloads(count):
+    return [f"reading {i:03d}".encode() for i in range(count)]
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith(SEGMENT_PREFIX))
+
+
+def test_round_trip_across_segment_roll(tmp_path):
+    spool = Spool(tmp_path, segment_size=128)
+    spool.append_many(payloads(20))
+    assert len(segment_files(tmp_path)) > 1
+
+    assert spool.read_batch(100) == payloads(20)
+    assert not spool.pending()
+    spool.commit()
+    assert len(segment_files(tmp_path)) == 1
+    spool.close()
+
+
+def test_rewind_and_resume_after_reopen(tmp_path):
+    spool = Spool(tmp_path, segment_size=128)
+    spool.append_many(payloads(10))
+    assert spool.read_batch(3) == payloads(3)
+    spool.rewind()
+    assert spool.read_batch(4) == payloads(4)
+    spool.commit()
+    spool.close()
+
+    spool = Spool(tmp_path, segment_size=128)
+    assert spool.read_batch(100) == payloads(10)[4:]
+    spool.close()
+
+
+def test_recovery_from_torn_last_frame(tmp_path):
+    spool = Spool(tmp_path, segment_size=4096)
+    spool.append_many(payloads(3))
+    spool.close()
+
+    # Corrupt the last payload byte, as if the process died while writing it
+    last = FRAME.size * 3 + sum(len(payload) for payload in payloads(3)) - 1
+    with open(tmp_path / segment_files(tmp_path)[0], 'r+b') as f:
+        f.seek(last)
+        f.write(b'\xff')
+
+    spool = Spool(tmp_path, segment_size=4096)
+    assert spool.read_batch(100) == payloads(2)
+    spool.append(b'after restart')
+    assert spool.read_batch(100) == [b'after restart']
+    spool.close()
+
+
+def test_max_segments_drops_oldest(tmp_path):
+    spool = Spool(tmp_path, segment_size=128, max_segments=2)
+    spool.append_many(payloads(40))
+    assert len(segment_files(tmp_path)) == 2
+    assert spool.stats['dropped'] > 0
+
+    # What is left is the newest records, still in order
+    remaining = spool.read_batch(100)
+    assert remaining == payloads(40)[-len(remaining):]
+    spool.close()
+
+
+def test_messages_round_trip(tmp_path):
+    spool = Spool(tmp_path)
+    messages = [{'type': 'iBeacon', 'rssi': -60}, {'type': 'AltBeacon', 'rssi': -70}]
+    spool.append_messages(messages)
+    assert spool.read_messages(10) == messages
+    spool.close()
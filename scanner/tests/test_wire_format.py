@@ -0,0 +1,53 @@
+import struct
+
+import pytest
+
+from wire_format import HEADER, MAGIC, SCHEMA_V1, TYPE_CODES, decode_record, encode_record
+
+COMMON = {
+    'host_id': 'scanner-1',
+    'timestamp': '2026-10-17T14:00:00.250000',
+    'rssi': -67,
+    'address': 'AA:BB:CC:DD:EE:FF',
+    'name': 'Beacon',
+}
+
+MESSAGES = [
+    {'type': 'iBeacon', 'uuid': 'f7826da6-4fa2-4e98-8024-bc5b71e0893e', 'major': 1, 'minor': 2, 'tx_power': -59},
+    {'type': 'Eddystone-UID', 'namespace': 'edd1ebeac04e5defa017', 'instance': '0123456789ab', 'tx_power': -62},
+    {'type': 'Eddystone-URL', 'url': 'https://example.com/', 'tx_power': -61},
+    {'type': 'AltBeacon', 'beacon_id': 'f7826da64fa24e988024bc5b71e0893e00010002', 'tx_power': -58},
+]
+
+
+@pytest.mark.parametrize('fields', MESSAGES, ids=[message['type'] for message in MESSAGES])
+def test_round_trip(fields):
+    message = dict(COMMON, **fields)
+    decoded = decode_record(encode_record(message))
+    del decoded['timestamp_ms']
+    assert decoded == message
+
+
+def test_long_non_ascii_text():
+    # 2 bytes per character, so the 255-byte limit falls inside a character
+    name = 'ü' * 300
+    url = 'https://example.com/' + 'ü' * 300
+    message = dict(COMMON, type='Eddystone-URL', url=url, tx_power=-61, name=name)
+    decoded = decode_record(encode_record(message))
+    # Identifiers are cut to at most 255 bytes, on a character boundary; URLs are kept whole
+    assert decoded['name'] == 'ü' * 127
+    assert decoded['url'] == url
+
+
+def test_decodes_version_1_records():
+    _, layout, _, _ = SCHEMA_V1[TYPE_CODES['AltBeacon']]
+    record = bytearray(HEADER.pack(MAGIC, 1, TYPE_CODES['AltBeacon'], 0, 1792245600250, -67))
+    record += layout.pack(bytes(range(20)))
+    # host_id and name as text identifiers, the address as a MAC
+    record += struct.pack('>BB', 0, 9) + b'scanner-1'
+    record += b'\x01' + bytes.fromhex('AABBCCDDEEFF')
+    record += struct.pack('>BB', 0, 6) + b'Beacon'
+    decoded = decode_record(bytes(record))
+    assert decoded['beacon_id'] == bytes(range(20)).hex()
+    assert decoded['address'] == 'AA:BB:CC:DD:EE:FF'
+    assert 'tx_power' not in decoded
@@ -0,0 +1,372 @@
+"""
+Compact binary wire format for beacon readings published to Kafka.
+
+A record is a fixed header, a fixed-width body whose layout depends on the beacon
+type, and a short tail of tagged identifier strings:
+
+    header   magic 'BB' | version u8 | type code u8 | flags u8 | timestamp ms i64 | rssi i8
+    body     per-type struct (see SCHEMA)
+    tail     host_id, address, name, then any per-type strings (e.g. url)
+
+The flags byte marks optional sections appended after the tail, in flag-bit order:
+
+    FLAG_AGGREGATE   coalesced RSSI statistics (see coalescer.py)
+    FLAG_SMOOTHED    filtered RSSI (see smoothing.py)
+    FLAG_DISTANCE    estimated distance and proximity class (see distance.py)
+    FLAG_ADAPTER     receiving adapter when scanning on several (see adapters.py)
+
+Fields outside the schema are not carried by known beacon types.
+
+Identifiers in the tail are tagged so that the common shapes are stored as raw bytes:
+a MAC address takes 6 bytes and a UUID (macOS host IDs and peripheral addresses)
+takes 16, instead of their 17/36 character text forms.
+
+The same module is the decoder library for consumers: decode_record() turns a binary
+record back into the dict the JSON format carries, and decode_message() accepts
+either format. Messages of type WINDOW_TYPE carry a window of readings in columnar
+form and have a binary record of their own (see columnar.py); message_readings()
+returns the readings of any message.
+"""
+
+import datetime
+import json
+import struct
+
+MAGIC = b'BB'
+VERSION = 2
+
+# Columnar windows of readings (see columnar.py)
+WINDOW_TYPE = 'BeaconWindow'
+WINDOW_MAGIC = b'BW'
+
+HEADER = struct.Struct('>2sBBBqb')
+
+# Optional sections
+FLAG_AGGREGATE = 0x01
+# count u16 | min i8 | max i8 | mean x100 i16 | median x10 i16 | timestamp - first_seen ms u32 | timestamp - last_seen ms u32
+AGGREGATE = struct.Struct('>HbbhhII')
+FLAG_SMOOTHED = 0x02
+# rssi_filtered x100 i16
+SMOOTHED = struct.Struct('>h')
+FLAG_DISTANCE = 0x04
+# distance cm u32 | proximity class u8 (index into PROXIMITY_CLASSES)
+DISTANCE = struct.Struct('>IB')
+PROXIMITY_CLASSES = ('immediate', 'near', 'far')
+FLAG_ADAPTER = 0x08
+# adapter name as a tagged identifier
+
+# Identifier tags. MACs are canonically upper case and UUIDs lower case;
+# ID_OTHER_CASE marks a value that used the other case.
+ID_TEXT = 0
+ID_MAC = 1
+ID_UUID = 2
+ID_OTHER_CASE = 0x80
+
+# Type code 0 carries beacon types without a dedicated layout as a JSON body
+TYPE_EXTENSION = 0
+
+# Wire schema, version 2: type code -> (beacon type, body layout, body fields, tail string fields)
+# Fields ending in '!' are hex strings stored as raw bytes in the body.
+SCHEMA = {
+    1: ('iBeacon', struct.Struct('>16sHHb'), ('uuid!', 'major', 'minor', 'tx_power'), ()),
+    2: ('Eddystone-UID', struct.Struct('>10s6sb'), ('namespace!', 'instance!', 'tx_power'), ()),
+    3: ('Eddystone-URL', struct.Struct('>b'), ('tx_power',), ('url',)),
+    4: ('AltBeacon', struct.Struct('>20sb'), ('beacon_id!', 'tx_power'), ()),
+}
+
+# Version 1 did not carry tx_power for Eddystone and AltBeacon; its records are still decoded
+SCHEMA_V1 = {
+    1: SCHEMA[1],
+    2: ('Eddystone-UID', struct.Struct('>10s6s'), ('namespace!', 'instance!'), ()),
+    3: ('Eddystone-URL', struct.Struct(''), (), ('url',)),
+    4: ('AltBeacon', struct.Struct('>20s'), ('beacon_id!',), ()),
+}
+
+SCHEMAS = {1: SCHEMA_V1, VERSION: SCHEMA}
+
+TYPE_CODES = {beacon_type: code for code, (beacon_type, _, _, _) in SCHEMA.items()}
+
+# Fields the header and tail already carry
+COMMON_FIELDS = ('type', 'host_id', 'timestamp', 'rssi', 'address', 'name')
+AGGREGATE_FIELDS = ('rssi_count', 'rssi_min', 'rssi_max', 'rssi_mean', 'rssi_median', 'first_seen', 'last_seen')
+SMOOTHED_FIELDS = ('rssi_filtered',)
+DISTANCE_FIELDS = ('distance_m', 'proximity')
+ADAPTER_FIELDS = ('adapter',)
+OPTIONAL_FIELDS = frozenset(AGGREGATE_FIELDS + SMOOTHED_FIELDS + DISTANCE_FIELDS + ADAPTER_FIELDS)
+
+
+def describe_schema():
+    """Return a JSON-serializable description of the current wire schema."""
+    return {
+        'magic': MAGIC.decode('ascii'),
+        'version': VERSION,
+        'header': ['magic:2s', 'version:u8', 'type_code:u8', 'flags:u8', 'timestamp_ms:i64', 'rssi:i8'],
+        'tail': ['host_id:id', 'address:id', 'name:id'],
+        'sections': {
+            FLAG_AGGREGATE: ['rssi_count:u16', 'rssi_min:i8', 'rssi_max:i8', 'rssi_mean_x100:i16',
+                             'rssi_median_x10:i16', 'first_seen_age_ms:u32', 'last_seen_age_ms:u32'],
+            FLAG_SMOOTHED: ['rssi_filtered_x100:i16'],
+            FLAG_DISTANCE: ['distance_cm:u32', 'proximity:u8'],
+            FLAG_ADAPTER: ['adapter:id'],
+        },
+        'types': {
+            code: {
+                'type': beacon_type,
+                'body': list(fields),
+                'body_format': layout.format,
+                'tail': list(tail),
+            }
+            for code, (beacon_type, layout, fields, tail) in SCHEMA.items()
+        },
+    }
+
+
+def _pack_id(value, out):
+    """Append a tagged identifier string to the output buffer."""
+    value = str(value)
+    if len(value) == 17 and value.count(':') == 5:
+        try:
+            raw = bytes.fromhex(value.replace(':', ''))
+            out.append(ID_MAC if value == value.upper() else ID_MAC | ID_OTHER_CASE)
+            out += raw
+            return
+        except ValueError:
+            pass
+    elif len(value) == 36 and value.count('-') == 4:
+        try:
+            raw = bytes.fromhex(value.replace('-', ''))
+            out.append(ID_UUID if value == value.lower() else ID_UUID | ID_OTHER_CASE)
+            out += raw
+            return
+        except ValueError:
+            pass
+    encoded = value.encode('utf-8')
+    if len(encoded) > 255:
+        # Truncate on a character boundary so the value still decodes
+        encoded = encoded[:255].decode('utf-8', 'ignore').encode('utf-8')
+    out.append(ID_TEXT)
+    out.append(len(encoded))
+    out += encoded
+
+
+def _unpack_id(data, offset):
+    """Read a tagged identifier string, returning (value, new offset)."""
+    tag = data[offset]
+    offset += 1
+    kind = tag & ~ID_OTHER_CASE
+    if kind == ID_MAC:
+        value = bytes(data[offset:offset + 6]).hex(':')
+        return (value if tag & ID_OTHER_CASE else value.upper()), offset + 6
+    if kind == ID_UUID:
+        h = bytes(data[offset:offset + 16]).hex()
+        value = f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+        return (value.upper() if tag & ID_OTHER_CASE else value), offset + 16
+    length = data[offset]
+    offset += 1
+    return str(data[offset:offset + length], 'utf-8'), offset + length
+
+
+def _timestamp_ms(timestamp):
+    """Convert a message timestamp (ISO string or epoch seconds) to integer epoch milliseconds."""
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp).timestamp()
+    return round(timestamp * 1000)
+
+
+def encode_record(message):
+    """Encode a beacon message dict as a binary record."""
+    beacon_type = message.get('type')
+    if beacon_type == WINDOW_TYPE:
+        from columnar import encode_window
+        return encode_window(message)
+    code = TYPE_CODES.get(beacon_type, TYPE_EXTENSION)
+
+    flags = 0
+    if 'rssi_count' in message:
+        flags |= FLAG_AGGREGATE
+    if 'rssi_filtered' in message:
+        flags |= FLAG_SMOOTHED
+    if 'distance_m' in message:
+        flags |= FLAG_DISTANCE
+    if 'adapter' in message:
+        flags |= FLAG_ADAPTER
+    timestamp_ms = _timestamp_ms(message['timestamp'])
+    out = bytearray(HEADER.pack(MAGIC, VERSION, code, flags, timestamp_ms,
+                                max(-128, min(127, int(message.get('rssi', 0))))))
+
+    if code == TYPE_EXTENSION:
+        tail = ()
+    else:
+        _, layout, fields, tail = SCHEMA[code]
+        values = []
+        for field in fields:
+            if field.endswith('!'):
+                values.append(bytes.fromhex(message[field[:-1]].replace('-', '')))
+            else:
+                values.append(message[field])
+        out += layout.pack(*values)
+
+    _pack_id(message.get('host_id', ''), out)
+    _pack_id(message.get('address', 'unknown'), out)
+    _pack_id(message.get('name', 'Unknown'), out)
+
+    if code == TYPE_EXTENSION:
+        extra = {k: v for k, v in message.items() if k not in COMMON_FIELDS and k not in OPTIONAL_FIELDS}
+        extra['type'] = beacon_type
+        body = json.dumps(extra, separators=(',', ':')).encode('utf-8')
+        out += struct.pack('>H', len(body))
+        out += body
+    else:
+        for field in tail:
+            encoded = message[field].encode('utf-8')
+            out += struct.pack('>H', len(encoded))
+            out += encoded
+
+    if flags & FLAG_AGGREGATE:
+        out += AGGREGATE.pack(
+            min(message['rssi_count'], 0xFFFF),
+            message['rssi_min'],
+            message['rssi_max'],
+            round(message['rssi_mean'] * 100),
+            round(message['rssi_median'] * 10),
+            max(0, timestamp_ms - _timestamp_ms(message['first_seen'])),
+            max(0, timestamp_ms - _timestamp_ms(message['last_seen'])),
+        )
+
+    if flags & FLAG_SMOOTHED:
+        out += SMOOTHED.pack(max(-32768, min(32767, round(message['rssi_filtered'] * 100))))
+
+    if flags & FLAG_DISTANCE:
+        out += DISTANCE.pack(min(0xFFFFFFFF, round(message['distance_m'] * 100)),
+                             PROXIMITY_CLASSES.index(message['proximity']))
+
+    if flags & FLAG_ADAPTER:
+        _pack_id(message['adapter'], out)
+
+    return bytes(out)
+
+
+def decode_record(data, iso_timestamps=True):
+    """Decode a binary record into a message dict.
+
+    With iso_timestamps the 'timestamp' field is a local ISO-8601 string, as in the
+    JSON format; the integer epoch time is always available as 'timestamp_ms'.
+    """
+    view = memoryview(data)
+    magic, version, code, flags, timestamp_ms, rssi = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("Not a binary beacon record")
+    schema = SCHEMAS.get(version)
+    if schema is None:
+        raise ValueError(f"Unsupported wire format version {version}")
+
+    offset = HEADER.size
+    message = {'rssi': rssi, 'timestamp_ms': timestamp_ms}
+
+    if code != TYPE_EXTENSION:
+        beacon_type, layout, fields, tail = schema[code]
+        message['type'] = beacon_type
+        for field, value in zip(fields, layout.unpack_from(view, offset)):
+            if field == 'uuid!':
+                h = value.hex()
+                message['uuid'] = f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+            elif field.endswith('!'):
+                message[field[:-1]] = value.hex()
+            else:
+                message[field] = value
+        offset += layout.size
+    else:
+        tail = ()
+
+    message['host_id'], offset = _unpack_id(view, offset)
+    message['address'], offset = _unpack_id(view, offset)
+    message['name'], offset = _unpack_id(view, offset)
+
+    if code == TYPE_EXTENSION:
+        (length,) = struct.unpack_from('>H', view, offset)
+        offset += 2
+        message.update(json.loads(str(view[offset:offset + length], 'utf-8')))
+        offset += length
+    else:
+        for field in tail:
+            (length,) = struct.unpack_from('>H', view, offset)
+            offset += 2
+            message[field] = str(view[offset:offset + length], 'utf-8')
+            offset += length
+
+    if flags & FLAG_AGGREGATE:
+        count, rssi_min, rssi_max, mean, median, first_age, last_age = AGGREGATE.unpack_from(view, offset)
+        offset += AGGREGATE.size
+        median = median / 10
+        message.update({
+            'rssi_count': count,
+            'rssi_min': rssi_min,
+            'rssi_max': rssi_max,
+            'rssi_mean': mean / 100,
+            'rssi_median': int(median) if median.is_integer() else median,
+            'first_seen': datetime.datetime.fromtimestamp((timestamp_ms - first_age) / 1000).isoformat(),
+            'last_seen': datetime.datetime.fromtimestamp((timestamp_ms - last_age) / 1000).isoformat(),
+        })
+
+    if flags & FLAG_SMOOTHED:
+        (filtered,) = SMOOTHED.unpack_from(view, offset)
+        offset += SMOOTHED.size
+        message['rssi_filtered'] = filtered / 100
+
+    if flags & FLAG_DISTANCE:
+        distance, proximity = DISTANCE.unpack_from(view, offset)
+        offset += DISTANCE.size
+        message['distance_m'] = distance / 100
+        message['proximity'] = PROXIMITY_CLASSES[proximity]
+
+    if flags & FLAG_ADAPTER:
+        message['adapter'], offset = _unpack_id(view, offset)
+
+    if iso_timestamps:
+        message['timestamp'] = datetime.datetime.fromtimestamp(timestamp_ms / 1000).isoformat()
+    return message
+
+
+def serialize_json(message):
+    """Serialize a message as UTF-8 JSON (the original wire format)."""
+    return json.dumps(message).encode('utf-8')
+
+
+SERIALIZERS = {
+    'json': serialize_json,
+    'binary': encode_record,
+}
+
+
+def get_serializer(name):
+    """Return the Kafka value serializer for a serialization name."""
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown serialization '{name}', expected one of {tuple(SERIALIZERS)}")
+
+
+def message_time_ms(message):
+    """Return the event time of a decoded message (either format) in epoch milliseconds."""
+    timestamp_ms = message.get('timestamp_ms')
+    if timestamp_ms is not None:
+        return timestamp_ms
+    return _timestamp_ms(message['timestamp'])
+
+
+def decode_message(data, iso_timestamps=True):
+    """Decode a Kafka message value in either the JSON or the binary format."""
+    if data[:2] == MAGIC:
+        return decode_record(data, iso_timestamps)
+    if data[:2] == WINDOW_MAGIC:
+        from columnar import decode_window
+        return decode_window(data, iso_timestamps)
+    return json.loads(data)
+
+
+def message_readings(message):
+    """Return the readings a decoded message carries: the message itself, or a window's readings."""
+    if message.get('type') == WINDOW_TYPE:
+        from columnar import window_readings
+        return window_readings(message)
+    return [message]